@@ -16,13 +16,38 @@
 import os
 import glob
 import arcpy
-from functools import lru_cache
+import threading
+import hashlib
+import heapq
+import math
+import sqlite3
+import time
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import select
+import struct
+import sys
+import numpy as np
+from collections import OrderedDict, deque
+
+# python 2 without the futures backport walks directories on one thread
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+except ImportError:
+    ThreadPoolExecutor = None
 
 try:
     import xml.etree.cElementTree as ET
 except ImportError:
     import xml.etree.ElementTree as ET
 
+try:
+    from lxml import etree as lxmlEtree
+except ImportError:
+    lxmlEtree = None
+
 
 class DataSourceType():
     File = 1
@@ -443,7 +468,14 @@ class GeoSceneSentinelBuilder():
         # Open the datasetPath and check if the metadata file contains the string TELEOS
         return self.utilities.isTarget(datasetPath)
 
+    # records the scene in crawlState once it is built
     def build(self, itemURI):
+        builtItemsList = self.buildItems(itemURI)
+        if builtItemsList:
+            crawlState.built(itemURI.get('path'))
+        return builtItemsList
+
+    def buildItems(self, itemURI):
         
         if len(itemURI) <= 0:
             return None
@@ -455,37 +487,39 @@ class GeoSceneSentinelBuilder():
             else:
                 return None
 
-            tree = cacheElementTree(path)
+            product = getProduct(path)
+            if product is None:
+                return None
+
             builtItem = {}
             # builtItem['raster'] = {'uri': path}
             builtItem['raster'] = None
             builtItem['itemUri'] = itemURI
 
-            generalInfoNode = self.utilities.getInfoElement(tree,'General_Info')
-            if generalInfoNode is not None:
-                element = generalInfoNode.find('Product_Info/Datatake/SPACECRAFT_NAME')
-                if element is not None:
-                    builtItem['sensorname'] = element.text
+            sensorName = product.fields['sensorName']
+            if sensorName is not None:
+                builtItem['sensorname'] = sensorName
 
-                element = generalInfoNode.find('Product_Info/Datatake/DATATAKE_SENSING_START')
-                if element is not None:
-                    builtItem['acquisitiondate'] = element.text[0:19].replace("T", " ")
+            sensingStart = product.fields['sensingStart']
+            if sensingStart is not None:
+                builtItem['acquisitiondate'] = sensingStart[0:19].replace("T", " ")
 
-                #element = generalInfoNode.find('Product_Info/Datatake/SENSING_ORBIT_NUMBER')
-                #if element is not None:
-                #    builtItem['SensingOrbit'] = element.text
-                
-            qualityInfoNode = self.utilities.getInfoElement(tree,'Quality_Indicators_Info')
-            if qualityInfoNode is not None:
-                element = qualityInfoNode.find('Cloud_Coverage_Assessment')
-                if element is not None:
-                    builtItem['cloudcover'] = element.text
-                    
-            geometricInfoNode = self.utilities.getInfoElement(tree,'Geometric_Info')
-            if qualityInfoNode is not None:
-                element = geometricInfoNode.find('Product_Footprint/Product_Footprint/Global_Footprint/EXT_POS_LIST')
-                if element is not None:
-                    builtItem['footprint'] = element.text
+            #element = generalInfoNode.find('Product_Info/Datatake/SENSING_ORBIT_NUMBER')
+            #if element is not None:
+            #    builtItem['SensingOrbit'] = element.text
+
+            cloudCover = product.fields['cloudCover']
+            if cloudCover is not None:
+                builtItem['cloudcover'] = cloudCover
+
+            footprint = product.fields['footprint']
+            if footprint is not None:
+                if footprintProcessor.enabled():
+                    ring = footprintProcessor.exteriorRing(footprintProcessor.parseCoordinates(footprint))
+                    ring, stats = footprintProcessor.simplify(ring)
+                    footprintProcessor.report(path, stats)
+                    footprint = footprintProcessor.polygon([ring], 4326)
+                builtItem['footprint'] = footprint
                     
             builtItem['resolution'] = '10/20/60'
             builtItem['resolutionmin'] = 10
@@ -496,11 +530,22 @@ class GeoSceneSentinelBuilder():
 
         except:
             return None
+        finally:
+            if path is not None:
+                productCache.release(path)
 
 class GeoSceneSentinelCrawler():
 
     def __init__(self, **crawlerProperties):
         self.utils = Utilities()
+        productCache.configure(crawlerProperties)
+        xmlBackend.configure(crawlerProperties)
+        directoryWalker.configure(crawlerProperties)
+        productLayout.configure(crawlerProperties)
+        crawlState.configure(crawlerProperties)
+        fileWatcher.configure(crawlerProperties)
+        crawlShard.configure(crawlerProperties)
+        footprintProcessor.configure(crawlerProperties)
         try:
             self.paths = crawlerProperties['paths']
             self.recurse = crawlerProperties['recurse']
@@ -511,10 +556,19 @@ class GeoSceneSentinelCrawler():
         if (self.filter is (None or "")):
             self.filter = 'MTD_MSI*.xml'
         try:
-            self.pathGenerator = self.createGenerator()
+            generator = crawlShard.wrap(self.createGenerator(), self.paths)
+            generator = fileWatcher.wrap(generator, self.paths, self.isMetadata, self.recurse,
+                                         crawlShard.owner(self.paths))
+            self.pathGenerator = crawlState.wrap(generator, self.paths)
         except StopIteration:
             return None
 
+    # whether a file of a crawled directory is one of the metadata files
+    def isMetadata(self, name):
+        if self.recurse:
+            return name.endswith(".xml") and name.startswith("MTD_MSIL")
+        return fnmatch.fnmatch(name, self.filter)
+
     def createGenerator(self):
         for path in self.paths:
             if not os.path.exists(path):
@@ -522,11 +576,8 @@ class GeoSceneSentinelCrawler():
             
             if os.path.isdir(path):
                 if self.recurse:
-                    for root, dirs, files in (os.walk(path)):
-                        for file in (files):
-                            if file.endswith(".xml") and file.startswith("MTD_MSIL"):
-                                filename = os.path.join(root, file)
-                                yield filename
+                    for filename in directoryWalker.walk(path, self.isMetadata, productLayout.pruner()):
+                        yield filename
                 else:
                     filter_to_scan = path + os.path.sep + self.filter
                     for filename in glob.glob(filter_to_scan):
@@ -570,15 +621,7 @@ class Utilities():
     
     def isTarget(self, path):
 
-        result = False
-        tree = cacheElementTree(path)
-        if tree is not None:
-            generalInfo = self.__getGeneralInfoElement(tree)
-            if generalInfo is not None:
-                element = generalInfo.find('Product_Info/PRODUCT_TYPE')
-                if element is not None and  'S2MSI' in element.text:
-                    result = True
-        return result
+        return sentinel2Sniffer.match(path)
 
     def getTag(self, path):
 
@@ -586,40 +629,21 @@ class Utilities():
             return 'ALLBANDS'
         return None
 
-    def __getGeneralInfoElement(self,tree):
-        
-        if tree is not None:
-            root = tree.getroot()
-            if root is not None:
-                for child in root:
-                    if 'General_Info' in child.tag:
-                        return child
-        return None
-    
     def getProductName(self, path):
         """        
         get Product Type
         :param path: MTD_MSI*.xml
         :return:
         """
-        tree = cacheElementTree(path)
-        if tree is not None:
-            generalInfo = self.__getGeneralInfoElement(tree)
-            if generalInfo is not None:
-                product = generalInfo.find('Product_Info/PRODUCT_TYPE')
-                if product is not None:
-                    return product.text
+        product = getProduct(path)
+        if product is not None:
+            return product.fields['productType']
         return None
 
-    def getInfoElement(self,tree,infoTag):
+    def getInfoElement(self,product,infoTag):
         
-        if tree is not None:
-            root = tree.getroot()
-            if root is None:
-                return result
-            for child in root:
-                if infoTag in child.tag:
-                    return child
+        if product is not None:
+            return product.sections.get(infoTag)
         return None
 
     #def getProcessingLevel(self, doc):
@@ -631,12 +655,1305 @@ class Utilities():
     #        return None
     #    return None
     
-@lru_cache(maxsize=128)
-def cacheElementTree(path):
+# Parser backend for the metadata files. lxml is used when it is installed, as
+# it parses large documents such as SAFE manifests markedly faster than
+# ElementTree; the crawler property xmlParser=etree|lxml picks one explicitly.
+# The lxml parser drops comments and processing instructions, as ElementTree
+# does, so both backends give the same children. errors holds the parse
+# exceptions of both, and find() evaluates a path on either kind of element,
+# through an XPath compiled once per path for lxml elements.
+class XmlBackend():
+
+    def __init__(self):
+        self.useLxml = lxmlEtree is not None
+        self.errors = (ET.ParseError,)
+        if lxmlEtree is not None:
+            self.errors = (ET.ParseError, lxmlEtree.XMLSyntaxError)
+        self.xpaths = {}
+
+    def configure(self, properties):
+        parser = properties.get('xmlParser')
+        if parser:
+            self.useLxml = parser == 'lxml' and lxmlEtree is not None
+
+    def parse(self, path):
+        if self.useLxml:
+            return lxmlEtree.parse(path, lxmlEtree.XMLParser(
+                remove_comments=True, remove_pis=True))
+        return ET.parse(path)
+
+    def find(self, element, path):
+        if lxmlEtree is None or not isinstance(element, lxmlEtree._Element):
+            return element.find(path)
+        xpath = self.xpaths.get(path)
+        if xpath is None:
+            xpath = self.xpaths[path] = lxmlEtree.XPath(path)
+        result = xpath(element)
+        return result[0] if result else None
+
+
+xmlBackend = XmlBackend()
+
+
+# Parsed product metadata shared by the crawler and the builder, which both
+# read the same MTD_MSI file. The cache is bounded by the size on disk of the
+# files it holds (xmlCacheSize crawler property, in MB) rather than by their
+# count, and an entry is only reused while the file's mtime and size are
+# unchanged. The builder releases a product once the item is built, so
+# the cache only holds scenes that are still in flight. Files that fail to
+# parse are not cached.
+class ElementTreeCache():
+
+    def __init__(self, maxBytes=64 * 1024 * 1024, parse=None):
+        self.maxBytes = maxBytes
+        self.parse = parse if parse is not None else xmlBackend.parse
+        self.trees = OrderedDict()
+        self.totalBytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.releases = 0
+
+    def configure(self, properties):
+        size = properties.get('xmlCacheSize')
+        if size:
+            self.maxBytes = int(float(size) * 1024 * 1024)
+
+    def key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    # returns the parsed file, raises one of xmlBackend.errors on bad XML
+    def get(self, path):
+        key = self.key(path)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime, stat.st_size)
+        with self.lock:
+            entry = self.trees.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.trees.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        tree = self.parse(path)
+
+        with self.lock:
+            self.remove(key)
+            self.trees[key] = (stamp, tree)
+            self.totalBytes += stat.st_size
+            while self.totalBytes > self.maxBytes and len(self.trees) > 1:
+                self.remove(next(iter(self.trees)))
+                self.evictions += 1
+        return tree
+
+    def release(self, path):
+        with self.lock:
+            if self.remove(self.key(path)):
+                self.releases += 1
+
+    # callers hold the lock
+    def remove(self, key):
+        entry = self.trees.pop(key, None)
+        if entry is None:
+            return False
+        self.totalBytes -= entry[0][1]
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'releases': self.releases,
+                'entries': len(self.trees),
+                'bytes': self.totalBytes}
+
+
+# A parsed MTD_MSIL1C/MTD_MSIL2A document. The top-level sections are indexed
+# by local name, without the namespace, in one pass over the root, and the
+# leaf fields the crawler and builder read are resolved once into fields
+class ProductMetadata():
+
+    # field name: (section, path below the section)
+    fieldPaths = {
+        'productType': ('General_Info', 'Product_Info/PRODUCT_TYPE'),
+        'sensorName': ('General_Info', 'Product_Info/Datatake/SPACECRAFT_NAME'),
+        'sensingStart': ('General_Info', 'Product_Info/Datatake/DATATAKE_SENSING_START'),
+        'cloudCover': ('Quality_Indicators_Info', 'Cloud_Coverage_Assessment'),
+        'footprint': ('Geometric_Info', 'Product_Footprint/Product_Footprint/Global_Footprint/EXT_POS_LIST')}
+
+    def __init__(self, path):
+        self.path = path
+        self.tree = xmlBackend.parse(path)
+        self.sections = {}
+        for child in self.tree.getroot():
+            self.sections.setdefault(child.tag.rsplit('}', 1)[-1], child)
+
+        self.fields = {}
+        for name, (section, fieldPath) in self.fieldPaths.items():
+            element = None
+            sectionNode = self.sections.get(section)
+            if sectionNode is not None:
+                element = xmlBackend.find(sectionNode, fieldPath)
+            self.fields[name] = element.text if element is not None else None
+
+
+productCache = ElementTreeCache(parse=ProductMetadata)
+
+
+def getProduct(path):
     try:
-        tree = ET.parse(path)
-    except ET.ParseError as e:
-        print("Exception while parsing {0}\n{1}".format(path,e))
+        return productCache.get(path)
+    except xmlBackend.errors as e:
+        print("Exception while parsing {0}\n{1}".format(path, e))
         return None
 
-    return tree
\ No newline at end of file
+
+# Decides whether a metadata file belongs to this raster type without parsing
+# all of it. Each rule is an element path from the root, compared by local
+# name so namespace prefixes do not matter, and a predicate on the element's
+# text. The file is fed to a pull parser in small chunks and reading stops at
+# the first element that matches a rule, whose predicate gives the answer.
+# Files without any matching element, or that fail to parse before one is
+# seen, are rejected.
+class XmlSniffer():
+
+    def __init__(self, *rules, **kwargs):
+        self.rules = [(path.split('/'), predicate) for path, predicate in rules]
+        self.chunkSize = kwargs.get('chunkSize', 4096)
+
+    def localName(self, tag):
+        return tag.rsplit('}', 1)[-1]
+
+    def match(self, path):
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        stack = []
+        try:
+            with open(path, 'rb') as f:
+                chunk = f.read(self.chunkSize)
+                while chunk:
+                    parser.feed(chunk)
+                    for event, element in parser.read_events():
+                        if event == 'start':
+                            stack.append(self.localName(element.tag))
+                            continue
+                        for rulePath, predicate in self.rules:
+                            if stack[1:] == rulePath:
+                                return bool(predicate(element.text or ''))
+                        stack.pop()
+                        element.clear()
+                    chunk = f.read(self.chunkSize)
+        except ET.ParseError as e:
+            print("Exception while parsing {0}\n{1}".format(path, e))
+        return False
+
+
+sentinel2Sniffer = XmlSniffer(
+    ('General_Info/Product_Info/PRODUCT_TYPE', lambda text: 'S2MSI' in text))
+
+
+# The edges of a ring held as a linked list (x, y and after, the next vertex,
+# by vertex) in a uniform grid, each edge, named by its first vertex, in the
+# cells its bounding box covers. build sets the cell size to the mean length
+# of the edges, the owner calls it again as the ring shrinks. Edges
+# covering more than longCells cells are kept apart and always returned, so
+# that one long edge does not fill the grid.
+class EdgeGrid():
+
+    def __init__(self, x, y, after, longCells=64):
+        self.x = x
+        self.y = y
+        self.after = after
+        self.longCells = longCells
+        self.size = 0
+        self.cells = {}
+        self.spans = {}
+        self.long = set()
+
+    def build(self, vertices):
+        vertices = list(vertices)
+        self.left = min(self.x[vertex] for vertex in vertices)
+        self.bottom = min(self.y[vertex] for vertex in vertices)
+        self.size = len(vertices)
+        # cells of the mean edge length, a footprint's vertices lie along its
+        # outline and not all over its bounding box
+        self.cell = sum(math.hypot(self.x[self.after[vertex]] - self.x[vertex],
+                                   self.y[self.after[vertex]] - self.y[vertex])
+                        for vertex in vertices) / self.size or 1.0
+        self.cells = {}
+        self.spans = {}
+        self.long = set()
+        for vertex in vertices:
+            self.add(vertex)
+
+    # the cells covered by a box, as column and row ranges
+    def span(self, left, bottom, right, top):
+        return (int(math.floor((left - self.left) / self.cell)),
+                int(math.floor((right - self.left) / self.cell)),
+                int(math.floor((bottom - self.bottom) / self.cell)),
+                int(math.floor((top - self.bottom) / self.cell)))
+
+    def cellCount(self, span):
+        return (span[1] - span[0] + 1) * (span[3] - span[2] + 1)
+
+    def add(self, edge):
+        end = self.after[edge]
+        span = self.span(min(self.x[edge], self.x[end]), min(self.y[edge], self.y[end]),
+                         max(self.x[edge], self.x[end]), max(self.y[edge], self.y[end]))
+        self.spans[edge] = span
+        if self.cellCount(span) > self.longCells:
+            self.long.add(edge)
+            return
+        for column in range(span[0], span[1] + 1):
+            for row in range(span[2], span[3] + 1):
+                self.cells.setdefault((column, row), set()).add(edge)
+
+    def remove(self, edge):
+        span = self.spans.pop(edge)
+        if edge in self.long:
+            self.long.discard(edge)
+            return
+        for column in range(span[0], span[1] + 1):
+            for row in range(span[2], span[3] + 1):
+                self.cells[(column, row)].discard(edge)
+
+    # the edges in the cells a box covers, a superset of those meeting it
+    def near(self, left, bottom, right, top):
+        span = self.span(left, bottom, right, top)
+        if self.cellCount(span) > len(self.spans):
+            return set(self.spans)
+        found = set(self.long)
+        for column in range(span[0], span[1] + 1):
+            for row in range(span[2], span[3] + 1):
+                cell = self.cells.get((column, row))
+                if cell:
+                    found |= cell
+        return found
+
+
+# Footprints handled as NumPy arrays. EXT_POS_LIST is parsed in one go and,
+# when simplification is enabled, the arcpy geometry is created once, from
+# Esri JSON, for the simplified ring.
+class FootprintProcessor():
+
+    def __init__(self):
+        self.tolerance = None
+        self.maxVertices = None
+        self.lock = threading.Lock()
+        self.items = 0
+        self.vertices = 0
+        self.simplifiedVertices = 0
+
+    # EXT_POS_LIST ('lat lon lat lon ...') to an (n, 2) array of x, y, rejecting
+    # text that is not numbers, an odd count or fewer than 3 points
+    def parseCoordinates(self, text):
+        values = np.array(text.split(), dtype=float)
+        if len(values) % 2:
+            raise ValueError('odd number of coordinates in footprint: {}'.format(len(values)))
+        if len(values) < 6:
+            raise ValueError('footprint has {} points, a ring needs at least 3'.format(len(values) // 2))
+        return values.reshape(-1, 2)[:, ::-1]
+
+    # twice the signed area of a ring, positive when it runs counter-clockwise
+    def signedArea(self, ring):
+        x = ring[:, 0]
+        y = ring[:, 1]
+        return np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))
+
+    # the ring closed and running clockwise, as Esri exterior rings do
+    def exteriorRing(self, ring):
+        if len(ring) and (ring[0] != ring[-1]).any():
+            ring = np.vstack((ring, ring[:1]))
+        if self.signedArea(ring) > 0:
+            ring = ring[::-1]
+        return ring
+
+    # Optional simplification of the footprints, set by the crawler
+    # properties footprintTolerance (how far the outline may move, in the
+    # units of the footprint's coordinate system) and footprintMaxVertices.
+    # Either one enables it, with both the tolerance is never exceeded even
+    # when the vertex budget is not met.
+    def configure(self, properties):
+        tolerance = properties.get('footprintTolerance')
+        maxVertices = properties.get('footprintMaxVertices')
+        self.tolerance = float(tolerance) if tolerance else None
+        self.maxVertices = max(int(maxVertices), 3) if maxVertices else None
+
+    def enabled(self):
+        return self.tolerance is not None or self.maxVertices is not None
+
+    # Simplifies an exterior ring (closed, clockwise) and returns it together
+    # with its stats. The outline is only ever moved outwards, so the result
+    # covers the original: concave vertices are removed, which adds the
+    # triangle they cut off, and once none are left pairs of convex vertices
+    # b, c are replaced by the point p where their outer edges meet. A change
+    # is only made when the added triangle holds no other vertex of the ring
+    # and no edge of the ring crosses its new edges, which keeps the ring from
+    # crossing itself. The deviation is bounded both ways: the distance from
+    # the original vertices to the new edges, and error, for each edge, the
+    # farthest any of its points can be from the original outline. That is
+    # the deviation of the edge for the edges between original vertices, and
+    # grows by the distance of p from the edge b-c for the edges through p.
+    def simplify(self, ring):
+        original = ring[:-1]
+        count = len(original)
+        points = original
+        index = np.arange(count)
+        error = np.zeros(count)
+        tolerance = self.tolerance if self.tolerance is not None else np.inf
+        budget = self.maxVertices if self.maxVertices is not None else 3
+
+        # concave vertices go in passes, every other one of a run per pass
+        # so that the edges around a removed vertex stay as they were
+        parity = 0
+        idle = 0
+        while len(points) > budget and idle < 2:
+            before = np.roll(points, 1, axis=0)
+            after = np.roll(points, -1, axis=0)
+            concave = self.cross(before, points, after) >= 0
+            concave[1 - parity::2] = False
+            if len(points) % 2:
+                concave[-1] = False
+            candidates = np.flatnonzero(concave)
+            if len(candidates):
+                deviation = self.spanDeviation(
+                    original, index[candidates - 1],
+                    index[(candidates + 1) % len(points)],
+                    before[candidates], after[candidates])
+                candidates = candidates[deviation <= tolerance]
+                deviation = deviation[deviation <= tolerance]
+                excess = len(points) - budget
+                if self.maxVertices is not None and len(candidates) > excess:
+                    order = np.argsort(deviation, kind='mergesort')[:excess]
+                    candidates = candidates[order]
+                    deviation = deviation[order]
+                empty = self.emptyTriangles(
+                    points, candidates - 1, candidates,
+                    (candidates + 1) % len(points))
+                candidates = candidates[empty]
+                deviation = deviation[empty]
+            if len(candidates):
+                # the edge from a to c replaces the original vertices up to
+                # c, so its error is the deviation
+                error[candidates - 1] = deviation
+                keep = np.ones(len(points), dtype=bool)
+                keep[candidates] = False
+                points = points[keep]
+                index = index[keep]
+                error = error[keep]
+                idle = 0
+            else:
+                idle += 1
+            parity = 1 - parity
+
+        # then convex pairs, the one adding the least area first, until the
+        # vertex budget is met
+        if self.maxVertices is not None and len(points) > max(budget, 3):
+            points, index, error = self.collapsePairs(
+                original, points, index, error, tolerance, max(budget, 3))
+
+        simplified = np.vstack((points, points[:1]))
+        stats = {
+            'vertices': count,
+            'simplifiedVertices': len(points),
+            'area': abs(self.signedArea(ring)) / 2.0,
+            'simplifiedArea': abs(self.signedArea(simplified)) / 2.0,
+            'deviation': float(max(error.max(), self.spanDeviation(
+                original, index, np.roll(index, -1), points,
+                np.roll(points, -1, axis=0)).max()))}
+        with self.lock:
+            self.items += 1
+            self.vertices += stats['vertices']
+            self.simplifiedVertices += stats['simplifiedVertices']
+        return simplified, stats
+
+    # z of (b - a) x (c - b), negative where a clockwise ring turns convex
+    def cross(self, a, b, c):
+        return ((b[:, 0] - a[:, 0]) * (c[:, 1] - b[:, 1]) -
+                (b[:, 1] - a[:, 1]) * (c[:, 0] - b[:, 0]))
+
+    # Replaces convex pairs b, c by the point p where the edges from a and to
+    # d meet, the pair adding the least area first, until count vertices are
+    # left. The ring is held as a linked list with a heap of its pairs and a
+    # grid of its edges, so that a merge only recomputes the pairs around p
+    # and tests the new edges against the edges near them. A heap entry is
+    # dropped once its vertex has changed since. A pair whose triangle the
+    # ring gets in the way of is set aside and tried again after other merges,
+    # which may have removed what was in the way.
+    def collapsePairs(self, original, points, index, error, tolerance, count):
+        originalX = original[:, 0].tolist()
+        originalY = original[:, 1].tolist()
+        x = points[:, 0].tolist()
+        y = points[:, 1].tolist()
+        index = index.tolist()
+        error = error.tolist()
+        size = len(x)
+        after = list(range(1, size)) + [0]
+        before = [size - 1] + list(range(size - 1))
+        alive = [True] * size
+        stamp = [0] * size
+        grid = EdgeGrid(x, y, after)
+        grid.build(range(size))
+        heap = []
+
+        def push(b):
+            stamp[b] += 1
+            a = before[b]
+            c = after[b]
+            d = after[c]
+            ux, uy = x[b] - x[a], y[b] - y[a]
+            wx, wy = x[c] - x[d], y[c] - y[d]
+            ex, ey = x[c] - x[b], y[c] - y[b]
+            denominator = ux * wy - uy * wx
+            if denominator == 0:
+                return
+            t = (ex * wy - ey * wx) / denominator
+            s = (ex * uy - ey * ux) / denominator
+            # the edges from a and to d meet beyond b and c, both convex
+            if not (t > 0 and s > 0) or ux * ey - uy * ex >= 0 or ex * wy - ey * wx <= 0:
+                return
+            p = (x[b] + t * ux, y[b] + t * uy)
+            area = abs(self.turn((x[b], y[b]), p, (x[c], y[c])))
+            heapq.heappush(heap, (area, b, stamp[b], p))
+
+        for b in range(size):
+            push(b)
+        blocked = []
+        merged = False
+        while size > count:
+            if not heap:
+                if not blocked or not merged:
+                    break
+                for entry in blocked:
+                    heapq.heappush(heap, entry)
+                blocked = []
+                merged = False
+            entry = heapq.heappop(heap)
+            area, b, mark, p = entry
+            if not alive[b] or stamp[b] != mark:
+                continue
+            a = before[b]
+            c = after[b]
+            d = after[c]
+            # p takes the place of b, the original vertices up to b stay with
+            # the edge from a and those after it go with the edge to d. The
+            # points of the new edges are within the height of p over the
+            # edge b-c of that edge, or on the edges from a and to d they
+            # extend. a-p extends a-b, so the original vertices of a-b are no
+            # farther from it.
+            height = self.pointDistance(p, (x[b], y[b]), (x[c], y[c]))
+            errorFrom = max(error[a], height + error[b])
+            errorTo = max(error[c], height + error[b])
+            if max(errorFrom, errorTo) > tolerance:
+                continue
+            if tolerance < np.inf and self.spanExceeds(
+                    originalX, originalY, index[b], index[d], p, (x[d], y[d]), tolerance):
+                continue
+            if self.blocked(grid, x, y, after, a, b, c, p):
+                blocked.append(entry)
+                continue
+
+            for edge in (a, b, c):
+                grid.remove(edge)
+            x[b], y[b] = p
+            alive[c] = False
+            after[b] = d
+            before[d] = b
+            error[a] = errorFrom
+            error[b] = errorTo
+            grid.add(a)
+            grid.add(b)
+            size -= 1
+            merged = True
+            for vertex in (before[a], a, b, d):
+                push(vertex)
+            if size * 2 <= grid.size:
+                grid.build([vertex for vertex in range(len(x)) if alive[vertex]])
+
+        # back to arrays, in the order of the ring as it was
+        first = alive.index(True)
+        order = [first]
+        while after[order[-1]] != first:
+            order.append(after[order[-1]])
+        return (np.column_stack((np.take(x, order), np.take(y, order))),
+                np.take(index, order), np.take(error, order))
+
+    # whether the ring gets in the way of replacing the convex pair b, c by
+    # p: a vertex other than b and c in the triangle b, p, c, or an edge other
+    # than the three at the pair meeting its new edges from b to p or from p
+    # to c
+    def blocked(self, grid, x, y, after, a, b, c, p):
+        pb = (x[b], y[b])
+        pc = (x[c], y[c])
+        flat = self.turn(pb, p, pc) == 0
+        for edge in grid.near(min(pb[0], p[0], pc[0]), min(pb[1], p[1], pc[1]),
+                              max(pb[0], p[0], pc[0]), max(pb[1], p[1], pc[1])):
+            if edge == a or edge == b or edge == c:
+                continue
+            start = (x[edge], y[edge])
+            end = (x[after[edge]], y[after[edge]])
+            # a triangle without area adds nothing and holds no vertex
+            if not flat:
+                sides = (self.turn(pb, p, start), self.turn(p, pc, start),
+                         self.turn(pc, pb, start))
+                if not (min(sides) < 0 and max(sides) > 0):
+                    return True
+            if self.segmentMeets(pb, p, start, end) or self.segmentMeets(p, pc, start, end):
+                return True
+        return False
+
+    # z of (b - a) x (c - b) for single points
+    def turn(self, a, b, c):
+        return (b[0] - a[0]) * (c[1] - b[1]) - (b[1] - a[1]) * (c[0] - b[0])
+
+    # whether the segment from a to b meets the segment from start to end,
+    # touching included
+    def segmentMeets(self, a, b, start, end):
+        d1 = self.turn(a, b, start)
+        d2 = self.turn(a, b, end)
+        d3 = self.turn(start, end, a)
+        d4 = self.turn(start, end, b)
+        if d1 * d2 < 0 and d3 * d4 < 0:
+            return True
+        return ((d1 == 0 and self.inBox(a, b, start)) or
+                (d2 == 0 and self.inBox(a, b, end)) or
+                (d3 == 0 and self.inBox(start, end, a)) or
+                (d4 == 0 and self.inBox(start, end, b)))
+
+    # whether an original vertex strictly between the original indices start
+    # and end (along the ring) is farther than tolerance from the segment from
+    # a to b
+    def spanExceeds(self, originalX, originalY, start, end, a, b, tolerance):
+        count = len(originalX)
+        vertex = (start + 1) % count
+        while vertex != end:
+            if self.pointDistance((originalX[vertex], originalY[vertex]), a, b) > tolerance:
+                return True
+            vertex = (vertex + 1) % count
+        return False
+
+    # distance from a point to the segment from a to b
+    def pointDistance(self, point, a, b):
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        length = dx * dx + dy * dy
+        along = 0.0
+        if length > 0:
+            along = min(max(((point[0] - a[0]) * dx + (point[1] - a[1]) * dy) / length, 0.0), 1.0)
+        return math.hypot(point[0] - a[0] - along * dx, point[1] - a[1] - along * dy)
+
+    # whether the point lies in the bounding box of the segment from a to b,
+    # which for a point on its line means on the segment
+    def inBox(self, a, b, point):
+        return (min(a[0], b[0]) <= point[0] <= max(a[0], b[0]) and
+                min(a[1], b[1]) <= point[1] <= max(a[1], b[1]))
+
+    # The original vertices strictly between the original indices start and
+    # end (along the ring) of each span, and the span each one belongs to
+    def spanVertices(self, original, start, end):
+        count = len(original)
+        spans = (end - start) % count - 1
+        spans[spans < 0] += count
+        owner = np.repeat(np.arange(len(start)), spans)
+        offset = np.arange(len(owner)) - np.repeat(np.cumsum(spans) - spans, spans)
+        return owner, original[(start[owner] + 1 + offset) % count]
+
+    def segmentDistance(self, vertices, a, b):
+        segment = b - a
+        relative = vertices - a
+        length = (segment * segment).sum(axis=-1)
+        along = (relative * segment).sum(axis=-1) / np.where(length > 0, length, 1.0)
+        along = np.clip(along, 0.0, 1.0)[..., None]
+        return np.hypot(*(relative - along * segment).T)
+
+    # largest distance from the original vertices of each span to the
+    # segment from a to b that replaces them
+    def spanDeviation(self, original, start, end, a, b):
+        owner, vertices = self.spanVertices(original, start, end)
+        deviation = np.zeros(len(start))
+        np.maximum.at(deviation, owner,
+                      self.segmentDistance(vertices, a[owner], b[owner]))
+        return deviation
+
+    # For each triangle, given by the positions of its corners in points,
+    # whether no other vertex lies inside it or on its edges. Only the
+    # vertices within the x range of a triangle are tested, found by binary
+    # search on the vertices sorted by x, and all the pairs at once.
+    def emptyTriangles(self, points, first, second, third):
+        first = first % len(points)
+        corners = [points[first], points[second], points[third]]
+        order = np.argsort(points[:, 0], kind='mergesort')
+        x = points[order, 0]
+        low = np.searchsorted(x, np.minimum.reduce([c[:, 0] for c in corners]), 'left')
+        high = np.searchsorted(x, np.maximum.reduce([c[:, 0] for c in corners]), 'right')
+        counts = high - low
+        owner = np.repeat(np.arange(len(first)), counts)
+        offset = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        position = order[low[owner] + offset]
+        vertices = points[position]
+        side = []
+        for a, b in ((0, 1), (1, 2), (2, 0)):
+            a = corners[a][owner]
+            b = corners[b][owner]
+            side.append((b[:, 0] - a[:, 0]) * (vertices[:, 1] - a[:, 1]) -
+                        (b[:, 1] - a[:, 1]) * (vertices[:, 0] - a[:, 0]))
+        side = np.array(side)
+        inside = ~((side < 0).any(axis=0) & (side > 0).any(axis=0))
+        inside &= ((position != first[owner]) & (position != second[owner]) &
+                   (position != third[owner]))
+        # a triangle without area adds nothing and cannot be crossed
+        flat = self.cross(corners[0], corners[1], corners[2]) == 0
+        return flat | (np.bincount(owner[inside], minlength=len(first)) == 0)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'items': self.items,
+                'vertices': self.vertices,
+                'simplifiedVertices': self.simplifiedVertices}
+
+    # logs the stats of a simplified footprint
+    def report(self, name, stats):
+        arcpy.AddMessage(
+            "Footprint of {0} simplified from {1} to {2} vertices, area +{3:.2f}%, deviation {4:g}".format(
+                name, stats['vertices'], stats['simplifiedVertices'],
+                (stats['simplifiedArea'] / stats['area'] - 1) * 100 if stats['area'] else 0,
+                stats['deviation']))
+
+    def polygon(self, rings, spatialReference=None):
+        shape = {'rings': [np.asarray(ring).tolist() for ring in rings]}
+        if spatialReference is not None:
+            shape['spatialReference'] = {'wkid': spatialReference}
+        return arcpy.AsShape(shape, True)
+
+
+footprintProcessor = FootprintProcessor()
+
+
+# Directory walker for recursive crawls. Directories are listed with
+# os.scandir, whose entries tell files from directories without a stat per
+# entry, and the subdirectories fan out over a small thread pool (crawler
+# property crawlThreads, 1 lists one directory at a time) so that several
+# listings are in flight at once on network shares. Matching files are
+# yielded as each listing comes back, which with more than one thread is in
+# no fixed order across directories. As with os.walk, unreadable
+# directories are skipped and links to directories are not followed.
+class DirectoryWalker():
+
+    def __init__(self):
+        self.threads = 8
+
+    def configure(self, properties):
+        threads = properties.get('crawlThreads')
+        if threads:
+            self.threads = max(int(threads), 1)
+
+    # the names of the files and of the subdirectories of a directory
+    def scan(self, path):
+        files = []
+        dirs = []
+        try:
+            for entry in os.scandir(path):
+                try:
+                    isDir = entry.is_dir()
+                except OSError:
+                    isDir = False
+                if not isDir:
+                    files.append(entry.name)
+                elif not entry.is_symlink():
+                    dirs.append(entry.name)
+        except OSError:
+            pass
+        return path, files, dirs
+
+    # Paths of the files below top whose name passes match. prune, when
+    # given, is called with the subdirectory names of each directory and
+    # whether a file matched in it, and returns the ones to walk into.
+    def walk(self, top, match, prune=None):
+        # python 2 has no scandir
+        if not hasattr(os, 'scandir'):
+            for root, dirs, files in os.walk(top):
+                found = [file for file in files if match(file)]
+                if prune is not None:
+                    dirs[:] = prune(dirs, bool(found))
+                for file in found:
+                    yield os.path.join(root, file)
+            return
+
+        if self.threads == 1 or ThreadPoolExecutor is None:
+            pending = [top]
+            while pending:
+                path, files, dirs = self.scan(pending.pop())
+                found = [file for file in files if match(file)]
+                if prune is not None:
+                    dirs = prune(dirs, bool(found))
+                pending.extend(os.path.join(path, name) for name in reversed(dirs))
+                for file in found:
+                    yield os.path.join(path, file)
+            return
+
+        pending = deque([top])
+        running = set()
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            while pending or running:
+                while pending and len(running) < self.threads * 2:
+                    running.add(executor.submit(self.scan, pending.popleft()))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, files, dirs = future.result()
+                    found = [file for file in files if match(file)]
+                    if prune is not None:
+                        dirs = prune(dirs, bool(found))
+                    pending.extend(os.path.join(path, name) for name in dirs)
+                    for file in found:
+                        yield os.path.join(path, file)
+        finally:
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+directoryWalker = DirectoryWalker()
+
+
+# Layout of the products this raster type crawls, used to prune recursive
+# crawls. MTD_MSIL*.xml sits at the root of a .SAFE product, so once
+# a directory holds one nothing below it is walked, and the granule, datastrip
+# and auxiliary folders, which only hold image data and their own metadata,
+# are skipped wherever they are met, for paths that point inside a product.
+# The crawler property pruneProducts=false walks every directory.
+class ProductLayout():
+
+    def __init__(self, dataDirs=()):
+        self.dataDirs = set(name.lower() for name in dataDirs)
+        self.enabled = True
+
+    def configure(self, properties):
+        enabled = properties.get('pruneProducts')
+        if enabled is not None and not isinstance(enabled, bool):
+            enabled = str(enabled).lower() not in ('false', '0', 'no')
+        if enabled is not None:
+            self.enabled = enabled
+
+    # the subdirectories to walk into, none below a product's metadata file
+    def prune(self, dirs, found):
+        if found:
+            return []
+        return [name for name in dirs if name.lower() not in self.dataDirs]
+
+    def pruner(self):
+        return self.prune if self.enabled else None
+
+
+productLayout = ProductLayout(['GRANULE', 'DATASTRIP', 'AUX_DATA', 'HTML', 'rep_info'])
+
+
+# Opt-in record of the scenes already ingested, enabled with the crawler
+# property crawlState=<sqlite file>. The builder records the path, size,
+# mtime and a sha1 of the content of every local file it builds, and later
+# crawls only pass on the files that are new or have changed since: another
+# size, or another mtime unless the hash shows the content is the same (a
+# copied or touched file). Files that failed to build are not recorded and
+# are tried again, urls are always passed on. With crawlDeletions=<file>, a
+# crawl that runs to the end also appends the recorded files below its
+# directories that are gone to that file, one path per line, and forgets
+# them.
+class CrawlState():
+
+    def __init__(self):
+        self.path = None
+        self.connection = None
+        self.deletionsPath = None
+        self.lock = threading.Lock()
+        self.passed = 0
+        self.skipped = 0
+        self.deleted = 0
+
+    def configure(self, properties):
+        self.deletionsPath = properties.get('crawlDeletions') or None
+        path = properties.get('crawlState')
+        if path and path != self.path:
+            self.open(path)
+
+    def open(self, path):
+        connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS scenes (key TEXT PRIMARY KEY, '
+            'path TEXT, size INTEGER, mtime REAL, hash TEXT, seen REAL)')
+        connection.commit()
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+            self.connection = connection
+            self.path = path
+
+    def key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def isLocal(self, path):
+        return '://' not in path
+
+    def contentHash(self, path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # whether the file was built before and has not changed since
+    def unchanged(self, path):
+        key = self.key(path)
+        stat = os.stat(path)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT size, mtime, hash FROM scenes WHERE key = ?',
+                (key,)).fetchone()
+        if row is None or row[0] != stat.st_size:
+            return False
+        if row[1] == stat.st_mtime:
+            return True
+        if self.contentHash(path) != row[2]:
+            return False
+        with self.lock:
+            self.connection.execute(
+                'UPDATE scenes SET mtime = ? WHERE key = ?', (stat.st_mtime, key))
+            self.connection.commit()
+        return True
+
+    def built(self, path):
+        if self.connection is None or not path or not self.isLocal(path):
+            return
+        try:
+            stat = os.stat(path)
+            digest = self.contentHash(path)
+        except (IOError, OSError):
+            return
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO scenes VALUES (?, ?, ?, ?, ?, ?)',
+                (self.key(path), path, stat.st_size, stat.st_mtime, digest,
+                 time.time()))
+            self.connection.commit()
+
+    # the crawler's paths without the unchanged files, roots are the paths
+    # the crawl was given
+    def wrap(self, paths, roots):
+        if self.connection is None:
+            return paths
+        return self.skipUnchanged(paths, roots)
+
+    def skipUnchanged(self, paths, roots):
+        run = time.time()
+        seen = []
+        for path in paths:
+            if self.isLocal(path):
+                if self.deletionsPath is not None:
+                    seen.append((run, self.key(path)))
+                    if len(seen) >= 1000:
+                        self.markSeen(seen)
+                        seen = []
+                try:
+                    unchanged = self.unchanged(path)
+                except (IOError, OSError):
+                    unchanged = False
+                if unchanged:
+                    self.skipped += 1
+                    continue
+            self.passed += 1
+            yield path
+        self.markSeen(seen)
+        if self.deletionsPath is not None:
+            self.reportDeletions(run, roots)
+
+    def markSeen(self, seen):
+        if not seen:
+            return
+        with self.lock:
+            self.connection.executemany(
+                'UPDATE scenes SET seen = ? WHERE key = ?', seen)
+            self.connection.commit()
+
+    # recorded files below the crawled directories that this crawl did not
+    # come across and that no longer exist
+    def reportDeletions(self, run, roots):
+        prefixes = [self.key(root).rstrip(os.sep) + os.sep
+                    for root in roots if os.path.isdir(root)]
+        if not prefixes:
+            return
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT key, path FROM scenes WHERE seen IS NULL OR seen < ?',
+                (run,)).fetchall()
+        deleted = [(key, path) for key, path in rows
+                   if any(key.startswith(prefix) for prefix in prefixes) and
+                   not os.path.exists(path)]
+        if not deleted:
+            return
+        with open(self.deletionsPath, 'a') as f:
+            for key, path in deleted:
+                f.write(path + '\n')
+        with self.lock:
+            self.connection.executemany(
+                'DELETE FROM scenes WHERE key = ?', [(key,) for key, path in deleted])
+            self.connection.commit()
+            self.deleted += len(deleted)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'passed': self.passed,
+                'skipped': self.skipped,
+                'deleted': self.deleted}
+
+
+crawlState = CrawlState()
+
+
+# Watch mode, enabled with the crawler property watch=true. Once the crawl of
+# the paths is done the crawler keeps running and passes on the metadata
+# files delivered below the directories among them, as the crawl of those
+# directories would have found them. A file is passed on once nothing has
+# changed in its directory, or below it, for watchSettle seconds (5 by
+# default), so that a product still being copied is not built half written.
+# The changes are read from inotify on Linux. Elsewhere, on shares whose
+# changes inotify does not see, or with watch=poll, the directories are
+# scanned every watchPoll seconds (10 by default) instead and a file waits
+# a scan longer. watchTimeout=<seconds> ends the crawl after that long
+# without a new file, by default it runs until it is cancelled.
+class FileWatcher():
+
+    def __init__(self):
+        self.mode = None
+        self.settle = 5.0
+        self.poll = 10.0
+        self.timeout = None
+        self.passed = 0
+
+    def configure(self, properties):
+        mode = str(properties.get('watch') or '').lower()
+        if mode in ('', 'false', 'no', '0'):
+            self.mode = None
+        elif mode == 'poll':
+            self.mode = 'poll'
+        else:
+            self.mode = 'auto'
+        self.settle = float(properties.get('watchSettle') or self.settle)
+        self.poll = max(float(properties.get('watchPoll') or self.poll), 0.1)
+        self.timeout = float(properties.get('watchTimeout') or 0) or None
+
+    # the crawler's paths followed by the files delivered later below roots,
+    # match tells the metadata files from the rest by their name and owns,
+    # when given, the ones of this crawler's shard by their path
+    def wrap(self, paths, roots, match, recurse, owns=None):
+        roots = [root for root in roots if os.path.isdir(root)]
+        if self.mode is None or not roots:
+            return paths
+        return self.follow(paths, roots, match, recurse, owns)
+
+    def open(self, roots, recurse):
+        if self.mode == 'auto':
+            try:
+                return InotifySource(roots, recurse)
+            except (OSError, AttributeError) as e:
+                print('Cannot watch with inotify ({}), scanning every {} seconds'.format(
+                    e, self.poll))
+        return PollingSource(roots, recurse, self.poll)
+
+    def signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime)
+
+    def follow(self, paths, roots, match, recurse, owns):
+        # the source is opened first so that no delivery made during the
+        # crawl is missed, the ones the crawl found are not passed on twice
+        source = self.open(roots, recurse)
+        settle = self.settle + source.latency
+        pending = OrderedDict()
+        passed = {}
+        try:
+            for path in paths:
+                passed[path] = self.signature(path)
+                yield path
+
+            last = time.time()
+            while True:
+                now = time.time()
+                timeout = None
+                if pending:
+                    oldest = min(activity for directory, activity in pending.values())
+                    timeout = oldest + settle - now
+                if self.timeout is not None and not pending:
+                    timeout = last + self.timeout - now
+                for directory, name, written in source.events(
+                        None if timeout is None else max(timeout, 0)):
+                    now = time.time()
+                    if written and match(name):
+                        delivered = os.path.join(directory, name)
+                        if owns is None or owns(delivered):
+                            pending[delivered] = [directory, now]
+                    # any change in a product holds back its metadata file
+                    for product in pending.values():
+                        if directory == product[0] or directory.startswith(product[0] + os.sep):
+                            product[1] = now
+
+                now = time.time()
+                for path, (directory, activity) in list(pending.items()):
+                    if now - activity < settle:
+                        continue
+                    del pending[path]
+                    signature = self.signature(path)
+                    if signature is None or passed.get(path) == signature:
+                        continue
+                    passed[path] = signature
+                    last = now
+                    self.passed += 1
+                    yield path
+
+                if self.timeout is not None and not pending and now - last >= self.timeout:
+                    return
+        finally:
+            source.close()
+
+
+# Changes below a set of directories as inotify reports them, Linux only.
+class InotifySource():
+
+    # from sys/inotify.h
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+    EVENTS = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE)
+    WRITES = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    latency = 0.0
+
+    def __init__(self, roots, recurse):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.roots = roots
+        self.recurse = recurse
+        self.watches = {}
+        try:
+            for root in roots:
+                self.add(root)
+        except OSError:
+            self.close()
+            raise
+
+    # watches path, and the directories below it when recursing, and returns
+    # the files found in them
+    def add(self, path):
+        found = []
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.EVENTS)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise OSError(error, 'out of inotify watches, see fs.inotify.max_user_watches')
+                continue
+            # a directory moved within the tree keeps its watch
+            self.watches[wd] = directory
+            directory, files, dirs = directoryWalker.scan(directory)
+            found.extend((directory, name) for name in files)
+            if self.recurse:
+                pending.extend(os.path.join(directory, name) for name in dirs)
+        return found
+
+    # (directory, name, written) of the changes, waiting up to timeout
+    # seconds for the first, or for good when timeout is None
+    def events(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b'\0'))
+            offset += 16 + length
+            if mask & self.IN_Q_OVERFLOW:
+                # events were lost, everything is looked at again
+                for root in self.roots:
+                    events.extend((directory, file, True) for directory, file in self.add(root))
+                continue
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & self.IN_ISDIR:
+                # a product moved in whole raises no event for its files
+                if self.recurse and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    try:
+                        found = self.add(os.path.join(directory, name))
+                    except OSError as e:
+                        print('Cannot watch {}: {}'.format(os.path.join(directory, name), e))
+                        found = []
+                    events.extend((path, file, True) for path, file in found)
+                events.append((directory, name, False))
+            else:
+                events.append((directory, name, bool(mask & self.WRITES)))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+# Changes below a set of directories found by comparing scans made every
+# interval seconds.
+class PollingSource():
+
+    def __init__(self, roots, recurse, interval):
+        self.roots = roots
+        self.recurse = recurse
+        self.interval = interval
+        self.latency = interval
+        self.files = self.scan()
+        self.due = time.time() + interval
+
+    # size and mtime of every file below the roots
+    def scan(self):
+        files = {}
+        for root in self.roots:
+            if self.recurse:
+                paths = directoryWalker.walk(root, lambda file: True)
+            else:
+                directory, names, dirs = directoryWalker.scan(root)
+                paths = [os.path.join(directory, name) for name in names]
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_size, stat.st_mtime)
+        return files
+
+    def events(self, timeout):
+        wait = self.due - time.time()
+        if timeout is not None and timeout < wait:
+            time.sleep(timeout)
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        files = self.scan()
+        self.due = time.time() + self.interval
+        events = []
+        for path, signature in files.items():
+            if self.files.get(path) != signature:
+                events.append((os.path.dirname(path), os.path.basename(path), True))
+        for path in self.files:
+            if path not in files:
+                events.append((os.path.dirname(path), os.path.basename(path), False))
+        self.files = files
+        return events
+
+    def close(self):
+        pass
+
+
+fileWatcher = FileWatcher()
+
+
+# Splits a crawl between processes or hosts, enabled with the crawler property
+# shard=k/N: the crawler passes on only the paths of the k-th of N shards, k
+# from 1 to N. A path goes to the shard picked by a stable hash of where it
+# is below the crawled directory it was found in, or of the url or csv entry
+# as written, so that N crawlers of the same paths each get a disjoint part
+# of them without talking to each other, even with the archive mounted at
+# another place on each host. Separators are hashed as '/' for the same
+# reason.
+class CrawlShard():
+
+    def __init__(self):
+        self.index = 0
+        self.count = 1
+
+    def configure(self, properties):
+        shard = properties.get('shard')
+        if not shard:
+            self.index = 0
+            self.count = 1
+            return
+        try:
+            index, count = [int(part) for part in str(shard).split('/')]
+        except ValueError:
+            raise ValueError('shard must be given as k/N, not {}'.format(shard))
+        if count < 1 or index < 1 or index > count:
+            raise ValueError('shard {} is not one of 1/{} to {}/{}'.format(
+                shard, count, count, count))
+        self.index = index - 1
+        self.count = count
+
+    # the crawled directories, as the prefixes of the paths found in them
+    def prefixes(self, roots):
+        prefixes = [os.path.abspath(root).rstrip(os.sep) + os.sep
+                    for root in roots if os.path.isdir(root)]
+        return sorted(prefixes, key=len, reverse=True)
+
+    def key(self, path, prefixes):
+        if '://' not in path:
+            absolute = os.path.abspath(path)
+            for prefix in prefixes:
+                if absolute.startswith(prefix):
+                    path = absolute[len(prefix):]
+                    break
+        return path.replace('\\', '/')
+
+    # whether path belongs to this shard, scene maps the key of a path to the
+    # one of the scene it is part of, when several files make up a scene
+    def owns(self, path, prefixes, scene=None):
+        if self.count == 1:
+            return True
+        key = self.key(path, prefixes)
+        if scene is not None:
+            key = scene(key)
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % self.count == self.index
+
+    # a function telling whether a path found below roots belongs to this
+    # shard, None when the crawl is not split
+    def owner(self, roots, scene=None):
+        if self.count == 1:
+            return None
+        prefixes = self.prefixes(roots)
+        return lambda path: self.owns(path, prefixes, scene)
+
+    def wrap(self, paths, roots, scene=None):
+        owns = self.owner(roots, scene)
+        if owns is None:
+            return paths
+        return (path for path in paths if owns(path))
+
+
+crawlShard = CrawlShard()
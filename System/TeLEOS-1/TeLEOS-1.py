@@ -21,7 +21,8 @@
 
 import os
 import arcpy
-from functools import lru_cache
+import threading
+from collections import OrderedDict
 
 
 try:
@@ -29,6 +30,11 @@ try:
 except ImportError:
     import xml.etree.ElementTree as ET
 
+try:
+    from lxml import etree as lxmlEtree
+except ImportError:
+    lxmlEtree = None
+
 
 class DataSourceType():
     Unknown = 0
@@ -140,14 +146,7 @@ class Utilities():
 
     def isTeleos1(self, path):
 
-        isT1 = False
-        tree = cacheElementTree(path)
-        if tree is not None:
-            element = tree.find('Metadata_Id/METADATA_PROFILE')
-            if element is not None:
-                if 'TELEOS' in element.text:
-                    isT1 = True
-        return isT1
+        return teleos1Sniffer.match(path)
 
 
     def getProductName(self, path):
@@ -323,17 +322,176 @@ class TeleosBuilder():
 
         except:
             raise
+        finally:
+            if path is not None:
+                elementTreeCache.release(path)
+
+# Parser backend for the metadata files. lxml is used when it is installed, as
+# it parses large documents such as SAFE manifests markedly faster than
+# ElementTree; the crawler property xmlParser=etree|lxml picks one explicitly.
+# The lxml parser drops comments and processing instructions, as ElementTree
+# does, so both backends give the same children. errors holds the parse
+# exceptions of both, and find() evaluates a path on either kind of element,
+# through an XPath compiled once per path for lxml elements.
+class XmlBackend():
+
+    def __init__(self):
+        self.useLxml = lxmlEtree is not None
+        self.errors = (ET.ParseError,)
+        if lxmlEtree is not None:
+            self.errors = (ET.ParseError, lxmlEtree.XMLSyntaxError)
+        self.xpaths = {}
+
+    def configure(self, properties):
+        parser = properties.get('xmlParser')
+        if parser:
+            self.useLxml = parser == 'lxml' and lxmlEtree is not None
+
+    def parse(self, path):
+        if self.useLxml:
+            return lxmlEtree.parse(path, lxmlEtree.XMLParser(
+                remove_comments=True, remove_pis=True))
+        return ET.parse(path)
+
+    def find(self, element, path):
+        if lxmlEtree is None or not isinstance(element, lxmlEtree._Element):
+            return element.find(path)
+        xpath = self.xpaths.get(path)
+        if xpath is None:
+            xpath = self.xpaths[path] = lxmlEtree.XPath(path)
+        result = xpath(element)
+        return result[0] if result else None
+
+
+xmlBackend = XmlBackend()
+
+
+# Parsed metadata files shared by the crawler and the builder, which both
+# read the same scene file. The cache is bounded by the size on disk of the
+# files it holds (xmlCacheSize crawler property, in MB) rather than by their
+# count, and an entry is only reused while the file's mtime and size are
+# unchanged. The builder releases a scene's tree once the item is built, so
+# the cache only holds scenes that are still in flight. Files that fail to
+# parse are not cached.
+class ElementTreeCache():
+
+    def __init__(self, maxBytes=64 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        self.trees = OrderedDict()
+        self.totalBytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.releases = 0
+
+    def configure(self, properties):
+        size = properties.get('xmlCacheSize')
+        if size:
+            self.maxBytes = int(float(size) * 1024 * 1024)
+
+    def key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    # returns the parsed tree, raises one of xmlBackend.errors on bad XML
+    def get(self, path):
+        key = self.key(path)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime, stat.st_size)
+        with self.lock:
+            entry = self.trees.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.trees.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        tree = xmlBackend.parse(path)
+
+        with self.lock:
+            self.remove(key)
+            self.trees[key] = (stamp, tree)
+            self.totalBytes += stat.st_size
+            while self.totalBytes > self.maxBytes and len(self.trees) > 1:
+                self.remove(next(iter(self.trees)))
+                self.evictions += 1
+        return tree
 
-@lru_cache(maxsize=128)
-def cacheElementTree(path):
-        try:
-            tree = ET.parse(path)
-        except ET.ParseError as e:
-            print("Exception while parsing {0}\n{1}".format(path,e))
-            return None
+    def release(self, path):
+        with self.lock:
+            if self.remove(self.key(path)):
+                self.releases += 1
 
-        return tree
+    # callers hold the lock
+    def remove(self, key):
+        entry = self.trees.pop(key, None)
+        if entry is None:
+            return False
+        self.totalBytes -= entry[0][1]
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'releases': self.releases,
+                'entries': len(self.trees),
+                'bytes': self.totalBytes}
+
+
+elementTreeCache = ElementTreeCache()
+
+
+def cacheElementTree(path):
+    try:
+        return elementTreeCache.get(path)
+    except xmlBackend.errors as e:
+        print("Exception while parsing {0}\n{1}".format(path, e))
+        return None
 
 #Using the default crawler as there is only Panchromatic band
 
 
+# Decides whether a metadata file belongs to this raster type without parsing
+# all of it. Each rule is an element path from the root, compared by local
+# name so namespace prefixes do not matter, and a predicate on the element's
+# text. The file is fed to a pull parser in small chunks and reading stops at
+# the first element that matches a rule, whose predicate gives the answer.
+# Files without any matching element, or that fail to parse before one is
+# seen, are rejected.
+class XmlSniffer():
+
+    def __init__(self, *rules, **kwargs):
+        self.rules = [(path.split('/'), predicate) for path, predicate in rules]
+        self.chunkSize = kwargs.get('chunkSize', 4096)
+
+    def localName(self, tag):
+        return tag.rsplit('}', 1)[-1]
+
+    def match(self, path):
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        stack = []
+        try:
+            with open(path, 'rb') as f:
+                chunk = f.read(self.chunkSize)
+                while chunk:
+                    parser.feed(chunk)
+                    for event, element in parser.read_events():
+                        if event == 'start':
+                            stack.append(self.localName(element.tag))
+                            continue
+                        for rulePath, predicate in self.rules:
+                            if stack[1:] == rulePath:
+                                return bool(predicate(element.text or ''))
+                        stack.pop()
+                        element.clear()
+                    chunk = f.read(self.chunkSize)
+        except ET.ParseError as e:
+            print("Exception while parsing {0}\n{1}".format(path, e))
+        return False
+
+
+teleos1Sniffer = XmlSniffer(
+    ('Metadata_Id/METADATA_PROFILE', lambda text: 'TELEOS' in text))
@@ -0,0 +1,130 @@
+# ------------------------------------------------------------------------------
+# Copyright 2018 Esri
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+# Name: crawl_state_tags.py
+# Description: Checks that crawlState records a scene the crawler emits
+# several tags for only once all of them are built. A Level-2 scene of
+# Geoscience-Sentinel2 and a DataCube-Landsat scene are crawled with one tag
+# failing to build: the next crawl must pass the scene on again, and once
+# every tag has been built the crawl after must skip it. The builders' item
+# assembly is replaced, only the crawl and its bookkeeping are exercised.
+# Exits with 1 on the first failure.
+# Version: 20181022
+# Requirements: ArcGIS Pro python (arcpy) and the dependencies of the raster
+# types (gdal, requests, yaml), a type that cannot be imported is skipped
+# Required Arguments: N/A
+# Optional Arguments: N/A
+# Usage: python crawl_state_tags.py
+# Author: Esri Imagery Workflows Team
+# ------------------------------------------------------------------------------
+
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# module, crawler, builder, failing tag
+TYPES = [
+    ('Geoscience-Sentinel', os.path.join(ROOT, 'types', 'Geoscience-Sentinel2', 'Geoscience-Sentinel.py'),
+     'GeoscienceSentinelCrawler', 'GeoscienceSentinelBuilder', 'QA'),
+    ('DataCube-Landsat', os.path.join(ROOT, 'types', 'DataCube-Landsat', 'DataCube-Landsat.py'),
+     'LandsatDataCubeCrawler', 'LandsatDataCubeBuilder', 'DataCube_L7_MS')]
+
+SCENE = ('product_type: S2MSIARD\n'
+         'processing_level: Level-2\n')
+
+
+def loadModule(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# builds every uri of one crawl, failing the given tag, and returns the
+# paths and tags the crawler emitted
+def crawl(module, crawlerName, builder, properties, failing=None):
+    def buildItems(itemURI):
+        if (itemURI['tag'] == failing):
+            raise Exception('cannot build {}'.format(failing))
+        return [{'itemUri': itemURI}]
+    builder.buildItems = buildItems
+
+    crawler = getattr(module, crawlerName)(**properties)
+    emitted = []
+    while (True):
+        uri = crawler.getNextUri()
+        if (uri is None):
+            break
+        emitted.append((uri['path'], uri['tag']))
+        try:
+            builder.build(uri)
+        except Exception:
+            pass
+    return emitted
+
+
+def check(name, path, crawlerName, builderName, failing):
+    module = loadModule(name, path)
+    directory = tempfile.mkdtemp()
+    try:
+        scene = os.path.join(directory, 'scene', 'ARD-METADATA.yaml')
+        os.makedirs(os.path.dirname(scene))
+        with open(scene, 'w') as f:
+            f.write(SCENE)
+        properties = {'paths': [directory], 'recurse': True, 'filter': '*.yaml',
+                      'crawlState': os.path.join(directory, 'state.sqlite')}
+        builder = getattr(module, builderName)()
+
+        problems = []
+        first = crawl(module, crawlerName, builder, properties, failing)
+        if (len(set(tag for path, tag in first)) < 2 or
+                failing not in [tag for path, tag in first]):
+            problems.append('the crawler emitted {}, not several tags including {}'.format(
+                [tag for path, tag in first], failing))
+        second = crawl(module, crawlerName, builder, properties)
+        if ([tag for path, tag in second] != [tag for path, tag in first]):
+            problems.append('after {} failed the next crawl emitted {}'.format(
+                failing, [tag for path, tag in second]))
+        third = crawl(module, crawlerName, builder, properties)
+        if (third):
+            problems.append('a scene built in full was crawled again: {}'.format(
+                [tag for path, tag in third]))
+        return problems
+    finally:
+        module.crawlState.connection.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    failed = False
+    for name, path, crawlerName, builderName, failing in TYPES:
+        try:
+            problems = check(name, path, crawlerName, builderName, failing)
+        except ImportError as e:
+            print('%-20s skipped, %s' % (name, e))
+            continue
+        for problem in problems:
+            print('%-20s %s' % (name, problem))
+        if (not problems):
+            print('%-20s ok' % name)
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# ------------------------------------------------------------------------------
+# Copyright 2018 Esri
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+# Name: directory_walker.py
+# Description: Compares the os.walk loop the crawlers used in recurse mode
+# with the DirectoryWalker of Deimos-2 on a generated deep tree, or on a
+# given directory. A per listing delay stands in for the round trip of a
+# network share.
+# Version: 20181020
+# Requirements: ArcGIS Pro python (arcpy), to import the Deimos-2 raster type
+# Required Arguments: N/A
+# Optional Arguments: -depth, -fanout and -files shape the generated tree,
+# -latency delay per directory listing in ms, -threads worker threads,
+# a directory to walk instead of the generated tree
+# Usage: python directory_walker.py [-depth 4] [-fanout 6] [-latency 5] [dir]
+# Author: Esri Imagery Workflows Team
+# ------------------------------------------------------------------------------
+
+import argparse
+import importlib.util
+import os
+import shutil
+import tempfile
+import time
+
+DEIMOS2_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'System', 'Deimos-2', 'Deimos_2.py')
+
+
+def loadDeimos2():
+    spec = importlib.util.spec_from_file_location('Deimos_2', DEIMOS2_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# an archive of scene folders, each level holds subfolders and each folder a
+# .dim with the image files next to it
+def makeTree(root, depth, fanout, files):
+    if (depth == 0):
+        return
+    for i in range(fanout):
+        folder = os.path.join(root, 'level%d_%02d' % (depth, i))
+        os.mkdir(folder)
+        open(os.path.join(folder, 'scene.dim'), 'w').close()
+        for j in range(files):
+            open(os.path.join(folder, 'scene_%02d.tif' % j), 'w').close()
+        makeTree(folder, depth - 1, fanout, files)
+
+
+# the recurse branch of createGenerator before DirectoryWalker
+def osWalk(top):
+    for root, dirs, files in (os.walk(top)):
+        for file in (files):
+            if file.endswith(".dim"):
+                yield os.path.join(root, file)
+
+
+def timed(generator):
+    start = time.time()
+    paths = list(generator)
+    return time.time() - start, paths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time os.walk against DirectoryWalker on a directory tree')
+    parser.add_argument('-depth', type=int, default=4)
+    parser.add_argument('-fanout', type=int, default=6)
+    parser.add_argument('-files', type=int, default=10)
+    parser.add_argument('-latency', type=float, default=5.0)
+    parser.add_argument('-threads', type=int, default=8)
+    parser.add_argument('top', nargs='?')
+    args = parser.parse_args()
+
+    walker = loadDeimos2().directoryWalker
+    top = args.top
+    if (top is None):
+        top = tempfile.mkdtemp()
+        makeTree(top, args.depth, args.fanout, args.files)
+
+    # os.walk lists directories with os.scandir as well, so the delay is
+    # added to both
+    scandir = os.scandir
+    if (args.latency > 0):
+        def slowScandir(path):
+            time.sleep(args.latency / 1000.0)
+            return scandir(path)
+        os.scandir = slowScandir
+
+    try:
+        walkTime, expected = timed(osWalk(top))
+        print('os.walk          %8.2f s  %d files' % (walkTime, len(expected)))
+        for threads in sorted(set([1, args.threads])):
+            walker.threads = threads
+            walkerTime, paths = timed(walker.walk(top, lambda file: file.endswith('.dim')))
+            if (sorted(paths) != sorted(expected)):
+                raise ValueError('walkers disagree with %d threads' % threads)
+            print('DirectoryWalker  %8.2f s  %d threads  x%.1f' % (
+                walkerTime, threads, walkTime / walkerTime))
+    finally:
+        os.scandir = scandir
+        if (args.top is None):
+            shutil.rmtree(top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+# ------------------------------------------------------------------------------
+# Copyright 2018 Esri
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+# Name: footprint_simplify.py
+# Description: Checks FootprintProcessor.simplify of the Geoscience and
+# GeoScene-Sentinel2 types with footprintTolerance and footprintMaxVertices
+# both set, on a concave footprint that used to come out self-intersecting and
+# on generated concave footprints: the result must be a simple ring that
+# covers the input, stays within the tolerance of it, and reports a deviation
+# no smaller than the one measured here. Exits with 1 on the first failure.
+# Also times a large footprint simplified with both properties set.
+# Version: 20181022
+# Requirements: ArcGIS Pro python (arcpy), to import the raster types, and the
+# Geoscience dependencies (gdal, requests, yaml) for its copy, which is
+# skipped without them
+# Required Arguments: N/A
+# Optional Arguments: -n number of generated footprints, -vertices of the
+# timed footprint
+# Usage: python footprint_simplify.py [-n 500] [-vertices 5000]
+# Author: Esri Imagery Workflows Team
+# ------------------------------------------------------------------------------
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODULES = [
+    ('GeoScene_Sentinel2', os.path.join(ROOT, 'GeoScene-Sentinel2', 'GeoScene_Sentinel2.py')),
+    ('Geoscience', os.path.join(ROOT, 'types', 'Geoscience', 'Geoscience.py'))]
+
+# two lobes joined by a neck, simplified with a tolerance of 0.05 and at most
+# 4 vertices: a pair of convex vertices was merged into a point whose new edges
+# cut across the other lobe, and the outline moved 0.14 while the stats
+# reported 0.046
+REGRESSION = (
+    [[0.753, 1.494], [0.744, 1.498], [0.636, 1.759], [0.744, 2.02], [1.004, 2.128],
+     [1.265, 2.02], [1.373, 1.759], [1.266, 1.499], [1.275, 1.495], [1.32, 1.386],
+     [1.385, 1.543], [1.349, 1.63], [1.457, 1.891], [1.718, 1.999], [1.979, 1.891],
+     [2.087, 1.63], [1.988, 1.393], [2.025, 1.306], [1.916, 1.045], [1.656, 0.937],
+     [1.395, 1.045], [1.35, 1.153], [1.275, 0.973], [1.015, 0.865], [0.754, 0.973],
+     [0.646, 1.234]], 0.05, 4)
+
+
+def loadModule(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# a concave outline around a few overlapping lobes, as the valid_data of a
+# scene with nodata bays looks
+def makeFootprint(rng):
+    lobes = rng.randint(1, 5)
+    count = rng.randint(20, 300)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, count))
+    radius = np.ones(count)
+    for lobe in range(lobes):
+        centre = rng.uniform(0, 2 * np.pi)
+        width = rng.uniform(0.1, 0.6)
+        distance = np.angle(np.exp(1j * (angles - centre)))
+        radius += rng.uniform(0.3, 1.5) * np.exp(-(distance / width) ** 2)
+    radius *= 1 + rng.uniform(-0.2, 0.2, count) * rng.choice([0.1, 0.5, 1.0])
+    return np.c_[np.cos(angles) * radius, np.sin(angles) * radius]
+
+
+def side(a, b, c):
+    return ((b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1]) -
+            (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0]))
+
+
+# whether no two edges of the closed ring meet, other than neighbours at
+# their shared vertex
+def isSimple(ring):
+    start = ring[:-1]
+    end = ring[1:]
+    count = len(start)
+    for i in range(count):
+        others = np.array([k for k in range(count)
+                           if (k != i and k != (i + 1) % count and k != (i - 1) % count)])
+        if (not len(others)):
+            continue
+        a = np.broadcast_to(start[i], (len(others), 2))
+        b = np.broadcast_to(end[i], (len(others), 2))
+        c = start[others]
+        d = end[others]
+        d1, d2 = side(a, b, c), side(a, b, d)
+        d3, d4 = side(c, d, a), side(c, d, b)
+        if (((d1 * d2 <= 0) & (d3 * d4 <= 0) &
+             ~((d1 == 0) & (d2 == 0) & (d3 == 0) & (d4 == 0))).any()):
+            return False
+    return True
+
+
+# distance from each point to the closest edge of the closed ring
+def distanceToRing(points, ring):
+    a = ring[:-1][None, :, :]
+    segment = ring[1:][None, :, :] - a
+    relative = points[:, None, :] - a
+    length = (segment * segment).sum(axis=-1)
+    along = np.clip((relative * segment).sum(axis=-1) /
+                    np.where(length > 0, length, 1.0), 0.0, 1.0)
+    offset = relative - along[..., None] * segment
+    return np.sqrt((offset * offset).sum(axis=-1)).min(axis=1)
+
+
+# whether each point is inside the closed ring or within epsilon of it
+def covered(points, ring, epsilon):
+    a = ring[:-1]
+    b = ring[1:]
+    x = points[:, 0][:, None]
+    y = points[:, 1][:, None]
+    straddles = (a[:, 1] > y) != (b[:, 1] > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing = a[:, 0] + (y - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+    inside = (straddles & (x < crossing)).sum(axis=1) % 2 == 1
+    return inside | (distanceToRing(points, ring) <= epsilon)
+
+
+# the problems found with one simplification, empty when there are none
+def check(processor, ring, tolerance, maxVertices):
+    processor.configure({'footprintTolerance': str(tolerance),
+                         'footprintMaxVertices': str(maxVertices)})
+    ring = processor.exteriorRing(np.asarray(ring, dtype=float))
+    simplified, stats = processor.simplify(ring)
+    epsilon = 1e-9 * max(1.0, np.abs(ring).max())
+    problems = []
+    if (not isSimple(simplified)):
+        problems.append('the ring crosses itself')
+    if (not covered(ring[:-1], simplified, epsilon).all()):
+        problems.append('the input is not covered')
+    # both ways, the simplified edges sampled finely
+    steps = np.linspace(0.0, 1.0, 33)[:-1, None]
+    samples = np.vstack([simplified[i] + steps * (simplified[i + 1] - simplified[i])
+                         for i in range(len(simplified) - 1)])
+    deviation = max(distanceToRing(ring[:-1], simplified).max(),
+                    distanceToRing(samples, ring).max())
+    if (deviation > tolerance + epsilon):
+        problems.append('moved %.4g, more than the tolerance %.4g' % (deviation, tolerance))
+    if (stats['deviation'] + epsilon < deviation):
+        problems.append('reported deviation %.4g below the measured %.4g' % (
+            stats['deviation'], deviation))
+    return problems, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check footprint simplification with a tolerance and a vertex budget')
+    parser.add_argument('-n', type=int, default=500)
+    parser.add_argument('-vertices', type=int, default=5000)
+    args = parser.parse_args()
+
+    failed = False
+    for name, path in MODULES:
+        try:
+            module = loadModule(name, path)
+        except ImportError as e:
+            print('%-20s skipped, %s' % (name, e))
+            continue
+        processor = module.FootprintProcessor()
+
+        problems, stats = check(processor, *REGRESSION)
+        for problem in problems:
+            print('%-20s regression footprint: %s' % (name, problem))
+        failed = failed or bool(problems)
+
+        rng = np.random.RandomState(20181022)
+        broken = 0
+        vertices = 0
+        simplifiedVertices = 0
+        start = time.time()
+        for i in range(args.n):
+            tolerance = 10 ** rng.uniform(-3, -0.5)
+            maxVertices = rng.randint(4, 40)
+            problems, stats = check(processor, makeFootprint(rng), tolerance, maxVertices)
+            vertices += stats['vertices']
+            simplifiedVertices += stats['simplifiedVertices']
+            if (problems):
+                broken += 1
+                if (broken <= 5):
+                    print('%-20s footprint %d (tolerance %.4g, %d vertices): %s' % (
+                        name, i, tolerance, maxVertices, '; '.join(problems)))
+        failed = failed or broken > 0
+        print('%-20s %d footprints, %d failed, %d vertices to %d, %.1f ms each' % (
+            name, args.n, broken, vertices, simplifiedVertices,
+            (time.time() - start) * 1000.0 / max(args.n, 1)))
+
+        # a scene edge of 100 km in metres, traced to the pixel
+        angles = np.linspace(0, 2 * np.pi, args.vertices, endpoint=False)
+        radius = 50000 * (1 + 0.3 * np.sin(7 * angles)) + rng.uniform(-15, 15, args.vertices)
+        ring = processor.exteriorRing(np.c_[np.cos(angles) * radius, np.sin(angles) * radius])
+        for properties in ({'footprintTolerance': '100', 'footprintMaxVertices': '50'},
+                           {'footprintMaxVertices': '50'}):
+            processor.configure(properties)
+            start = time.time()
+            simplified, stats = processor.simplify(ring)
+            print('%-20s %d vertices to %d with %s in %.3f s' % (
+                name, stats['vertices'], stats['simplifiedVertices'],
+                ', '.join('%s=%s' % item for item in sorted(properties.items())),
+                time.time() - start))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# ------------------------------------------------------------------------------
+# Copyright 2018 Esri
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+# Name: rpc_reader.py
+# Description: Checks the RpcModel readers of SuperView-1 (.rpb) and
+# TripleSat (_rpc.txt) against the split based parsers the builders used
+# before, on a corpus of RPC files, and times both along with a cached read.
+# Version: 20181019
+# Requirements: ArcGIS Pro python (arcpy), to import the raster types
+# Required Arguments: N/A
+# Optional Arguments: -n number of reads per file, .rpb and _rpc.txt files
+# to read instead of the generated corpus
+# Usage: python rpc_reader.py [-n 200] [scene.rpb scene_rpc.txt ...]
+# Author: Esri Imagery Workflows Team
+# ------------------------------------------------------------------------------
+
+import argparse
+import importlib.util
+import os
+import random
+import shutil
+import tempfile
+import timeit
+
+TYPES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'types')
+
+RPB_SCALARS = ['lineOffset', 'sampOffset', 'latOffset', 'longOffset',
+               'heightOffset', 'lineScale', 'sampScale', 'latScale',
+               'longScale', 'heightScale']
+
+TXT_SCALARS = [('LINE_OFF', 'pixels'), ('SAMP_OFF', 'pixels'),
+               ('LAT_OFF', 'degrees'), ('LONG_OFF', 'degrees'),
+               ('HEIGHT_OFF', 'meters'), ('LINE_SCALE', 'pixels'),
+               ('SAMP_SCALE', 'pixels'), ('LAT_SCALE', 'degrees'),
+               ('LONG_SCALE', 'degrees'), ('HEIGHT_SCALE', 'meters')]
+
+
+def loadType(name, fileName):
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(TYPES_PATH, name, fileName))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# writes an .rpb laid out like the ones delivered with SuperView-1 scenes
+def writeRpb(path, rng):
+    lines = ['satId = "SV1-01";', 'bandId = "P";', 'SpecId = "RPC00B";',
+             'BEGIN_GROUP = IMAGE', '\terrBias =   -1.00;', '\terrRand =   -1.00;']
+    for name in RPB_SCALARS:
+        lines.append('\t%s = %+.4f;' % (name, rng.uniform(-1000, 1000)))
+    for name in ['lineNumCoef', 'lineDenCoef', 'sampNumCoef', 'sampDenCoef']:
+        terms = ['\t\t\t%+.15E' % rng.uniform(-1, 1) for i in range(20)]
+        lines.append('\t%s = (\n%s);' % (name, ',\n'.join(terms)))
+    lines += ['END_GROUP = IMAGE', 'END;']
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+# writes an _rpc.txt laid out like the ones delivered with TripleSat scenes,
+# without a final line break, which the split based parser could not read
+def writeRpcText(path, rng):
+    lines = ['%s: %+.4f %s' % (name, rng.uniform(-1000, 1000), unit)
+             for name, unit in TXT_SCALARS]
+    for name in ['LINE_NUM_COEFF', 'LINE_DEN_COEFF', 'SAMP_NUM_COEFF', 'SAMP_DEN_COEFF']:
+        lines += ['%s_%d: %+.15E' % (name, i, rng.uniform(-1, 1)) for i in range(1, 21)]
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+# the SuperView-1 builder before RpcModel, returns (CONSTANTZ, geodataXform)
+def legacyRpb(path):
+    constantZ = None
+    try:
+        coeffVal = []
+        data = open(path, 'r')
+        rpc = data.read()
+        rpc = rpc.replace('\t', '').split('(')
+        constantZ = (rpc[0].split('heightOffset = ')[1]).split(";")[0]
+        predata = rpc[0]
+        predata = predata.split('IMAGE')[1].split('lineNumCoef')[0]
+        predata = predata.split(';')
+        predata = [float(val.split('=')[1]) for val in predata[0:-1]]
+        lineNumCoef = [float(val) for val in rpc[1].split(')')[0].split(',')]
+        lineDenCoef = [float(val) for val in rpc[2].split(')')[0].split(',')]
+        sampNumCoef = [float(val) for val in rpc[3].split(')')[0].split(',')]
+        sampDenCoef = [float(val) for val in rpc[4].split(')')[0].split(',')]
+        coeffVal = predata[2:] + lineNumCoef + lineDenCoef + sampNumCoef + sampDenCoef
+    except Exception:
+        coeffVal = []
+    RPC = {'GeodataTransforms': [{'geodataTransform': 'RPC',
+                                  'geodataTransformArguments': {'coeff': coeffVal}}]}
+    return constantZ, str(RPC).replace("'", '"')
+
+
+# the TripleSat builder before RpcModel
+def legacyRpcText(path):
+    try:
+        coeffVal = []
+        data = open(path, 'r')
+        rpcData = data.read()
+        rpc = rpcData.replace(': ', ':').split('\n')
+        coeffVal = [float(val.split(' ')[0].split(':')[1]) for val in rpc]
+    except Exception:
+        coeffVal = []
+    RPC = {'GeodataTransforms': [{'geodataTransform': 'RPC',
+                                  'geodataTransformArguments': {'coeff': coeffVal}}]}
+    return None, str(RPC)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check and time the RPC readers of SuperView-1 and TripleSat')
+    parser.add_argument('-n', type=int, default=200)
+    parser.add_argument('paths', nargs='*')
+    args = parser.parse_args()
+
+    superView = loadType('SuperView-1', 'SuperView-1.py')
+    tripleSat = loadType('Triplesat', 'TripleSat.py')
+
+    corpus = None
+    paths = args.paths
+    if (not paths):
+        corpus = tempfile.mkdtemp()
+        rng = random.Random(20181019)
+        for i in range(20):
+            paths.append(os.path.join(corpus, 'scene%02d.rpb' % i))
+            writeRpb(paths[-1], rng)
+            paths.append(os.path.join(corpus, 'scene%02d_rpc.txt' % i))
+            writeRpcText(paths[-1], rng)
+
+    try:
+        totals = {}
+        for path in paths:
+            if (path.endswith('.rpb')):
+                module, legacy = superView, legacyRpb
+            else:
+                module, legacy = tripleSat, legacyRpcText
+            model = module.RpcModel(path)
+            constantZ, geodataXform = legacy(path)
+            if (geodataXform != model.geodataXform or
+                    (constantZ is not None and constantZ != model.heightOffset)):
+                raise ValueError('readers disagree on %s' % path)
+            times = [
+                timeit.timeit(lambda: legacy(path), number=args.n),
+                timeit.timeit(lambda: module.RpcModel(path), number=args.n),
+                timeit.timeit(lambda: module.rpcCache.get(path), number=args.n)]
+            kind = os.path.splitext(path)[1]
+            totals[kind] = [a + b for a, b in zip(totals.get(kind, [0, 0, 0]), times)]
+        for kind, times in sorted(totals.items()):
+            count = len([path for path in paths if path.endswith(kind)]) * args.n
+            print('%-5s split parser %7.1f us  RpcModel %7.1f us  cached %6.1f us' % (
+                kind, times[0] * 1e6 / count, times[1] * 1e6 / count,
+                times[2] * 1e6 / count))
+        print('%d files, identical geodataXform' % len(paths))
+    finally:
+        if (corpus is not None):
+            shutil.rmtree(corpus)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+# ------------------------------------------------------------------------------
+# Copyright 2018 Esri
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+# Name: xml_backend_parity.py
+# Description: Checks that the lxml and ElementTree parsers of XmlBackend give
+# the same results on DIMAP, SAFE manifest and MTD_MSI documents: the parsed
+# tree, the find/findall results of the paths the builders read, the
+# namespace map of the manifest, and the fields the Sentinel-1 and Sentinel-2
+# types extract. Exits with 1 on the first difference.
+# Version: 20181021
+# Requirements: ArcGIS Pro python (arcpy), to import the raster types, and
+# lxml, without which there is nothing to compare
+# Required Arguments: N/A
+# Optional Arguments: .dim, manifest.safe and MTD_MSI*.xml files to check
+# instead of the generated documents
+# Usage: python xml_backend_parity.py [scene.dim manifest.safe MTD_MSIL1C.xml ...]
+# Author: Esri Imagery Workflows Team
+# ------------------------------------------------------------------------------
+
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODULES = {
+    'dimap': ('Deimos_2', os.path.join(ROOT, 'System', 'Deimos-2', 'Deimos_2.py')),
+    'safe': ('GeoScene_Sentinel1', os.path.join(
+        ROOT, 'GeoScene-Sentinel1', 'GeoScene_Sentinel1.py')),
+    'mtd': ('GeoScene_Sentinel2', os.path.join(
+        ROOT, 'GeoScene-Sentinel2', 'GeoScene_Sentinel2.py'))}
+
+# paths read below the root, the namespaced ones with the manifest's map
+PATHS = {
+    'dimap': [
+        'Metadata_Id/METADATA_FORMAT',
+        'Dataset_Frame/Vertex',
+        'Dataset_Frame/Vertex/FRAME_X',
+        'Dataset_Sources/Source_Information/Scene_Source',
+        'Dataset_Sources/Source_Information/Scene_Source/SUN_ELEVATION',
+        'Dataset_Sources/Source_Information/Scene_Source/SENSOR_VIEWING',
+        'Image_Interpretation/Spectral_Band_Info',
+        'Image_Interpretation/Spectral_Band_Info/BAND_DESCRIPTION',
+        'Raster_Dimensions/NBANDS'],
+    'safe': [
+        'metadataSection/metadataObject',
+        'dataObjectSection/dataObject',
+        'dataObjectSection/dataObject/byteStream/fileLocation',
+        'metadataSection/metadataObject/metadataWrap/xmlData/safe:platform/safe:familyName',
+        'metadataSection/metadataObject/metadataWrap/xmlData/safe:platform/safe:number',
+        'metadataSection/metadataObject/metadataWrap/xmlData/'
+        'safe:acquisitionPeriod/safe:startTime',
+        'metadataSection/metadataObject/metadataWrap/xmlData/'
+        'safe:frameSet/safe:frame/safe:footPrint',
+        'metadataSection/metadataObject/metadataWrap/xmlData/'
+        'safe:frameSet/safe:frame/safe:footPrint/gml:coordinates',
+        'metadataSection/metadataObject/metadataWrap/xmlData/'
+        's1sarl1:standAloneProductInformation/s1sarl1:productType'],
+    'mtd': [
+        'General_Info/Product_Info/PRODUCT_TYPE',
+        'General_Info/Product_Info/Datatake/SPACECRAFT_NAME',
+        'General_Info/Product_Info/Datatake/DATATAKE_SENSING_START',
+        'General_Info/Product_Info/Product_Organisation/Granule_List/Granule/IMAGE_FILE',
+        'Geometric_Info/Product_Footprint/Product_Footprint/Global_Footprint/EXT_POS_LIST',
+        'Quality_Indicators_Info/Cloud_Coverage_Assessment',
+        'Quality_Indicators_Info/Missing_Section']}
+
+DIMAP = '''<?xml version="1.0" encoding="UTF-8"?>
+<?xml-stylesheet type="text/xsl" href="dimap.xsl"?>
+<Dimap_Document name="DE2_MS4_L1B.dim">
+  <!-- written by the ground segment -->
+  <Metadata_Id><METADATA_FORMAT version="2.0">DIMAP</METADATA_FORMAT></Metadata_Id>
+  <Dataset_Frame>
+    <Vertex><FRAME_X unit="deg">-3.71</FRAME_X><FRAME_Y unit="deg">40.41</FRAME_Y></Vertex>
+    <Vertex><FRAME_X unit="deg">-3.52</FRAME_X><FRAME_Y unit="deg">40.41</FRAME_Y></Vertex>
+    <Vertex><FRAME_X unit="deg">-3.52</FRAME_X><FRAME_Y unit="deg">40.26</FRAME_Y></Vertex>
+    <Vertex><FRAME_X unit="deg">-3.71</FRAME_X><FRAME_Y unit="deg">40.26</FRAME_Y></Vertex>
+  </Dataset_Frame>
+  <Dataset_Sources><Source_Information><Scene_Source>
+    <MISSION>Deimos 2</MISSION><INSTRUMENT>HiRAIS</INSTRUMENT>
+    <STOP_TIME>2018-06-01T10:41:07.250</STOP_TIME>
+    <VIEWING_ANGLE>12.5</VIEWING_ANGLE><SUN_AZIMUTH>150.2</SUN_AZIMUTH>
+    <SUN_ELEVATION>62.1</SUN_ELEVATION><EARTH_SUN_DISTANCE>1.014</EARTH_SUN_DISTANCE>
+  </Scene_Source></Source_Information></Dataset_Sources>
+  <Raster_Dimensions><NCOLS>5120</NCOLS><NROWS>4352</NROWS><NBANDS>4</NBANDS></Raster_Dimensions>
+  <Image_Interpretation>
+%s  </Image_Interpretation>
+</Dimap_Document>
+''' % ''.join(
+    '    <Spectral_Band_Info><BAND_INDEX>%d</BAND_INDEX>'
+    '<BAND_DESCRIPTION>%s</BAND_DESCRIPTION><PHYSICAL_GAIN>0.%d</PHYSICAL_GAIN>'
+    '<PHYSICAL_BIAS>0.0</PHYSICAL_BIAS><PHYSICAL_UNIT>W/m2/sr/um</PHYSICAL_UNIT>'
+    '</Spectral_Band_Info>\n' % (i + 1, name, i + 1)
+    for i, name in enumerate(['NIR', 'RED', 'GREEN', 'BLUE']))
+
+
+def metadataObject(id, xmlData):
+    return ('    <metadataObject ID="%s" classification="DESCRIPTION" category="DMD">\n'
+            '      <metadataWrap mimeType="text/xml" textInfo="%s">\n'
+            '        <xmlData>%s</xmlData>\n'
+            '      </metadataWrap>\n'
+            '    </metadataObject>\n' % (id, id, xmlData))
+
+
+SAFE = '''<?xml version="1.0" encoding="UTF-8"?>
+<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1"
+    xmlns:safe="http://www.esa.int/safe/sentinel-1.0"
+    xmlns:gml="http://www.opengis.net/gml"
+    xmlns:s1sarl1="http://www.esa.int/safe/sentinel-1.0/sentinel-1/sar/level-1"
+    version="esa/safe/sentinel-1.0/sentinel-1/sar/level-1/standard/ew-dp">
+  <informationPackageMap>
+    <xfdu:contentUnit unitType="SAFE Archive Information Package"/>
+  </informationPackageMap>
+  <metadataSection>
+%s  </metadataSection>
+  <!-- data objects -->
+  <dataObjectSection>
+    <dataObject ID="quicklook" repID="s1Level1QuickLookSchema">
+      <byteStream mimeType="image/png" size="186702">
+        <fileLocation locatorType="URL" href="./preview/quick-look.png"/>
+        <checksum checksumName="MD5">0a1b2c3d4e5f60718293a4b5c6d7e8f9</checksum>
+      </byteStream>
+    </dataObject>
+    <dataObject ID="measurement-vv" repID="s1Level1MeasurementSchema">
+      <byteStream mimeType="application/octet-stream" size="835000000">
+        <fileLocation locatorType="URL" href="./measurement/s1a-ew-grd-hh.tiff"/>
+      </byteStream>
+    </dataObject>
+  </dataObjectSection>
+  <?processing step="annotated"?>
+</xfdu:XFDU>
+''' % ''.join([
+    metadataObject('platform', '<safe:platform><safe:nssdcIdentifier>2014-016A'
+                   '</safe:nssdcIdentifier><safe:familyName>SENTINEL-1</safe:familyName>'
+                   '<safe:number>A</safe:number></safe:platform>'),
+    metadataObject('acquisitionPeriod', '<safe:acquisitionPeriod><safe:startTime>'
+                   '2019-03-01T10:11:12.345678</safe:startTime><safe:stopTime>'
+                   '2019-03-01T10:12:12.345678</safe:stopTime></safe:acquisitionPeriod>'),
+    metadataObject('measurementFrameSet', '<safe:frameSet><safe:frame><safe:footPrint '
+                   'srsName="http://www.opengis.net/gml/srs/epsg.xml#4326">'
+                   '<gml:coordinates>23.911518,114.473335 24.327019,111.711006 '
+                   '22.631462,111.398132 22.218449,114.120010</gml:coordinates>'
+                   '</safe:footPrint></safe:frame></safe:frameSet>'),
+    metadataObject('generalProductInformation', '<s1sarl1:standAloneProductInformation>'
+                   '<s1sarl1:productType>GRD</s1sarl1:productType>'
+                   '</s1sarl1:standAloneProductInformation>')])
+
+MTD = '''<?xml version="1.0" encoding="UTF-8"?>
+<n1:Level-1C_User_Product xmlns:n1="https://psd-14.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xsi:schemaLocation="https://psd-14.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd">
+  <n1:General_Info>
+    <Product_Info>
+      <PRODUCT_TYPE>S2MSI1C</PRODUCT_TYPE>
+      <Datatake datatakeIdentifier="GS2A_20200608T025551_025848_N02.09">
+        <SPACECRAFT_NAME>Sentinel-2A</SPACECRAFT_NAME>
+        <DATATAKE_SENSING_START>2020-06-08T02:55:51.024Z</DATATAKE_SENSING_START>
+      </Datatake>
+      <!-- granules -->
+      <Product_Organisation><Granule_List><Granule granuleIdentifier="L1C_T49QFF_A025848"
+          imageFormat="JPEG2000">
+%s      </Granule></Granule_List></Product_Organisation>
+    </Product_Info>
+  </n1:General_Info>
+  <n1:Geometric_Info>
+    <Product_Footprint><Product_Footprint><Global_Footprint>
+      <EXT_POS_LIST>23.5 113.0 23.5 114.1 22.5 114.1 22.5 113.0 23.5 113.0 </EXT_POS_LIST>
+    </Global_Footprint></Product_Footprint></Product_Footprint>
+  </n1:Geometric_Info>
+  <n1:Quality_Indicators_Info>
+    <Cloud_Coverage_Assessment>12.3456</Cloud_Coverage_Assessment>
+  </n1:Quality_Indicators_Info>
+</n1:Level-1C_User_Product>
+''' % ''.join(
+    '        <IMAGE_FILE>GRANULE/L1C_T49QFF_A025848/IMG_DATA/T49QFF_B%02d</IMAGE_FILE>\n' % band
+    for band in range(1, 13))
+
+
+def loadModule(kind):
+    name, path = MODULES[kind]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def kindOf(path):
+    name = os.path.basename(path)
+    if (name.lower().endswith('.dim')):
+        return 'dimap'
+    if (name.lower() == 'manifest.safe'):
+        return 'safe'
+    if (name.startswith('MTD_MSI') and name.endswith('.xml')):
+        return 'mtd'
+    return None
+
+
+# an element as plain data, comments and processing instructions left out
+def canonical(element):
+    if (element is None):
+        return None
+    if (not isinstance(element.tag, str)):
+        return None
+    children = [canonical(child) for child in element]
+    return (element.tag, sorted(element.attrib.items()),
+            (element.text or '').strip(), (element.tail or '').strip(),
+            [child for child in children if (child is not None)])
+
+
+def parseBoth(module, kind, path):
+    results = []
+    for useLxml in (False, True):
+        module.xmlBackend.useLxml = useLxml
+        if (kind == 'safe'):
+            tree, namespaces = module.xmlBackend.parseWithNamespaces(path)
+        else:
+            tree, namespaces = module.xmlBackend.parse(path), {}
+        results.append((tree, namespaces))
+    return results
+
+
+# the results of the paths on each backend, relative to the root and, for
+# the MTD sections, to the section xmlBackend.find is called on
+def pathResults(module, kind, tree, namespaces):
+    root = tree.getroot()
+    results = []
+    for path in PATHS[kind]:
+        results.append(('find', path, canonical(root.find(path, namespaces))))
+        results.append(('findall', path, [canonical(element) for element in
+                                          root.findall(path, namespaces)]))
+        if (kind == 'mtd'):
+            section, below = path.split('/', 1)
+            for child in root:
+                if (child.tag.rsplit('}', 1)[-1] == section):
+                    results.append(('xmlBackend.find', path,
+                                    canonical(module.xmlBackend.find(child, below))))
+                    break
+        elif (not namespaces):
+            results.append(('xmlBackend.find', path,
+                            canonical(module.xmlBackend.find(root, path))))
+    return results
+
+
+# what the raster type reads from the document through its own classes; the
+# Deimos-2 builder reads its fields with the find() paths already compared
+def extraction(module, kind, path, tree):
+    if (kind == 'dimap'):
+        return None
+    if (kind == 'safe'):
+        manifest = module.ManifestIndex(path)
+        return (manifest.namespaces,
+                dict((id, canonical(node)) for id, node in manifest.metadataObjects.items()),
+                dict((id, canonical(node)) for id, node in manifest.dataObjects.items()))
+    return module.ProductMetadata(path).fields
+
+
+def compare(module, kind, path):
+    (etreeTree, etreeNs), (lxmlTree, lxmlNs) = parseBoth(module, kind, path)
+    checks = [
+        ('tree', canonical(etreeTree.getroot()), canonical(lxmlTree.getroot())),
+        ('namespaces', etreeNs, lxmlNs)]
+    for etreeResult, lxmlResult in zip(pathResults(module, kind, etreeTree, etreeNs),
+                                       pathResults(module, kind, lxmlTree, lxmlNs)):
+        checks.append(('%s %s' % etreeResult[:2], etreeResult[2], lxmlResult[2]))
+    module.xmlBackend.useLxml = False
+    etreeFields = extraction(module, kind, path, etreeTree)
+    module.xmlBackend.useLxml = True
+    lxmlFields = extraction(module, kind, path, lxmlTree)
+    checks.append(('extraction', etreeFields, lxmlFields))
+
+    failed = [(name, a, b) for name, a, b in checks if (a != b)]
+    for name, a, b in failed:
+        print('  %s differs\n    etree: %r\n    lxml:  %r' % (name, a, b))
+    print('%-6s %-40s %3d checks  %s' % (
+        kind, os.path.basename(path), len(checks), 'differ' if failed else 'same'))
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the lxml and ElementTree backends of XmlBackend')
+    parser.add_argument('paths', nargs='*')
+    args = parser.parse_args()
+
+    scratch = None
+    if (args.paths):
+        documents = [(kindOf(path), path) for path in args.paths]
+        for kind, path in documents:
+            if (kind is None):
+                parser.error('%s is not a .dim, manifest.safe or MTD_MSI*.xml file' % path)
+    else:
+        scratch = tempfile.mkdtemp()
+        documents = []
+        for kind, name, text in [('dimap', 'DE2_MS4_L1B.dim', DIMAP),
+                                 ('safe', 'manifest.safe', SAFE),
+                                 ('mtd', 'MTD_MSIL1C.xml', MTD)]:
+            path = os.path.join(scratch, name)
+            with open(path, 'w') as f:
+                f.write(text)
+            documents.append((kind, path))
+
+    try:
+        modules = {}
+        same = True
+        for kind, path in documents:
+            if (kind not in modules):
+                modules[kind] = loadModule(kind)
+                if (modules[kind].lxmlEtree is None):
+                    print('lxml is not installed, there is no second backend to compare')
+                    return 1
+            same = compare(modules[kind], kind, path) and same
+        return 0 if same else 1
+    finally:
+        if (scratch is not None):
+            shutil.rmtree(scratch)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# ------------------------------------------------------------------------------
+# Copyright 2018 Esri
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+# Name: yaml_loader.py
+# Description: Compares the pure python SafeLoader with libyaml's CSafeLoader
+# on ODC metadata documents shaped like the ones read by the yaml raster types.
+# Version: 20181016
+# Requirements: python yaml library(https://pyyaml.org/wiki/PyYAMLDocumentation)
+# Required Arguments: N/A
+# Optional Arguments: -n number of loads per document, yaml files to load
+# instead of the generated Landsat and Sentinel-2 documents
+# Usage: python yaml_loader.py [-n 50] [scene.yaml ...]
+# Author: Esri Imagery Workflows Team
+# ------------------------------------------------------------------------------
+
+import argparse
+import os
+import timeit
+
+import yaml
+
+LANDSAT_BANDS = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2',
+                 'aerosol_qa', 'pixel_qa', 'radsat_qa', 'coastal_aerosol']
+
+SENTINEL2_BANDS = ['nbart_coastal_aerosol', 'nbart_blue', 'nbart_green',
+                   'nbart_red', 'nbart_red_edge_1', 'nbart_red_edge_2',
+                   'nbart_red_edge_3', 'nbart_nir_1', 'nbart_nir_2',
+                   'nbart_swir_2', 'nbart_swir_3', 'nbar_coastal_aerosol',
+                   'nbar_blue', 'nbar_green', 'nbar_red', 'nbar_red_edge_1',
+                   'nbar_red_edge_2', 'nbar_red_edge_3', 'nbar_nir_1',
+                   'nbar_nir_2', 'nbar_swir_2', 'nbar_swir_3',
+                   'lambertian_coastal_aerosol', 'lambertian_blue',
+                   'lambertian_green', 'lambertian_red',
+                   'lambertian_red_edge_1', 'lambertian_red_edge_2',
+                   'lambertian_red_edge_3', 'lambertian_nir_1',
+                   'lambertian_nir_2', 'lambertian_swir_2',
+                   'lambertian_swir_3', 'fmask', 'nbart_contiguity',
+                   'nbar_contiguity', 'lambertian_contiguity',
+                   'azimuthal_exiting', 'azimuthal_incident',
+                   'exiting', 'incident', 'relative_azimuth',
+                   'relative_slope', 'satellite_azimuth', 'satellite_view',
+                   'solar_azimuth', 'solar_zenith', 'terrain_shadow',
+                   'timedelta']
+
+
+# builds a document with the layout of an ODC eo dataset, the footprint and
+# lineage sections are what make the real documents large
+def makeDocument(platform, bands, vertices):
+    coordinates = [[[500000.0 + i * 30.0, 7000000.0 - i * 15.0]
+                    for i in range(vertices)]]
+    return {
+        'id': 'b1c4a0c6-7c0a-4f8e-9e4a-0d1c1c6f3a2e',
+        'product_type': 'ard',
+        'platform': {'code': platform},
+        'instrument': {'name': 'MSI' if platform.startswith('SENTINEL') else 'OLI_TIRS'},
+        'format': {'name': 'GeoTIFF'},
+        'extent': {
+            'center_dt': '2018-01-01T00:12:34.567890',
+            'coord': {
+                'll': {'lat': -35.0, 'lon': 149.0},
+                'lr': {'lat': -35.0, 'lon': 150.0},
+                'ul': {'lat': -34.0, 'lon': 149.0},
+                'ur': {'lat': -34.0, 'lon': 150.0}}},
+        'grid_spatial': {
+            'projection': {
+                'spatial_reference': 'EPSG:32755',
+                'geo_ref_points': {
+                    'll': {'x': 499980.0, 'y': 6890200.0},
+                    'lr': {'x': 609780.0, 'y': 6890200.0},
+                    'ul': {'x': 499980.0, 'y': 7000000.0},
+                    'ur': {'x': 609780.0, 'y': 7000000.0}},
+                'valid_data': {
+                    'type': 'Polygon',
+                    'coordinates': coordinates}}},
+        'image': {
+            'bands': dict((band, {'path': 'BAND/%s.TIF' % band, 'layer': 1})
+                          for band in bands)},
+        'lineage': {
+            'source_datasets': dict(
+                ('level%d' % level, {
+                    'id': 'source-%d' % level,
+                    'processing_level': 'Level-%d' % level,
+                    'creation_dt': '2018-01-01 01:00:00',
+                    'software_versions': dict(
+                        ('package%d' % i, {'version': '1.%d.0' % i,
+                                           'repo_url': 'https://example.com/%d' % i})
+                        for i in range(20))})
+                for level in range(3))}}
+
+
+def loadAll(text, loader, number):
+    return timeit.timeit(lambda: yaml.load(text, Loader=loader), number=number)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time SafeLoader against CSafeLoader on ODC yaml documents')
+    parser.add_argument('-n', type=int, default=50)
+    parser.add_argument('paths', nargs='*')
+    args = parser.parse_args()
+
+    if (args.paths):
+        documents = []
+        for path in args.paths:
+            with open(path, 'r') as f:
+                documents.append((os.path.basename(path), f.read()))
+    else:
+        documents = [
+            ('landsat8', yaml.safe_dump(makeDocument('LANDSAT_8', LANDSAT_BANDS, 200))),
+            ('sentinel2', yaml.safe_dump(makeDocument('SENTINEL_2A', SENTINEL2_BANDS, 800)))]
+
+    try:
+        cLoader = yaml.CSafeLoader
+    except AttributeError:
+        cLoader = None
+        print('pyyaml was built without libyaml, only SafeLoader is timed')
+
+    for name, text in documents:
+        pyTime = loadAll(text, yaml.SafeLoader, args.n)
+        line = '%-12s %8d bytes  SafeLoader %8.2f ms' % (
+            name, len(text), pyTime * 1000.0 / args.n)
+        if (cLoader is not None):
+            if (yaml.load(text, Loader=cLoader) != yaml.load(text, Loader=yaml.SafeLoader)):
+                raise ValueError('loaders disagree on %s' % name)
+            cTime = loadAll(text, cLoader, args.n)
+            line += '  CSafeLoader %8.2f ms  x%.1f' % (
+                cTime * 1000.0 / args.n, pyTime / cTime)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
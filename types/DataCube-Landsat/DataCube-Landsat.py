@@ -26,14 +26,47 @@ import os
 import arcpy
 import glob
 import csv
+import fnmatch
+import json
+import re
 import requests
+from requests.packages.urllib3.util.retry import Retry
+import threading
+import time
+import base64
+import datetime
+import sqlite3
+import hashlib
+import ctypes
+import ctypes.util
+import errno
+import select
+import struct
+import sys
+from collections import OrderedDict, deque
 
 try:
     import yaml
     import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
 except ImportError as e:
     raise
 
+# libyaml's C loader is several times faster on the large ODC documents, fall
+# back to the pure python loader when pyyaml was built without libyaml. Both
+# only construct the plain yaml types, documents are never trusted code.
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# python 2 without the futures backport does not prefetch
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+except ImportError:
+    ThreadPoolExecutor = None
+
 
 class DataSourceType():
     File = 1
@@ -243,33 +276,100 @@ class Utilities():
 
     def readYaml(self, path):  # to read the yaml file located locally.
         try:
+            key = os.path.abspath(path)
+            validator = documentStore.localValidator(path)
+            doc = documentStore.get(key, validator)
+            if (doc is not None):
+                return doc
             with open(path, 'r') as q:
                 try:
-                    doc = (yaml.load(q))
+                    doc = yamlExtractor.load(q.read())
                 except yaml.YAMLError as exc:
                     raise
+                documentStore.put(key, validator, doc)
                 return doc
         except BaseException:
             raise
 
-    def readYamlS3(self, path):  # to read the yaml file located on S3
-        page = requests.get(path, stream=True, timeout=None)
+    def loadYamlS3(self, path):  # to read the yaml file located on S3
+        cached = documentStore.lookup(path)
         try:
-            doc = (yaml.load(page.content))
+            page = httpSessionPool.get(
+                path, documentStore.conditionalHeaders(cached))
+        except BaseException:
+            documentStore.miss()
+            raise
+        if (cached is not None and page.status_code == 304):
+            documentStore.hit(path)
+            return cached[1]
+        documentStore.miss()
+        try:
+            doc = yamlExtractor.load(page.content)
         except yaml.YAMLError as exc:
             raise
+        documentStore.put(path, documentStore.httpValidator(page.headers), doc)
         return doc
 
-    def readYamlS3_boto3(self, bucket, path):  # to read the yaml file located on S3
-        client = boto3.client('s3')
+    def loadYamlS3_boto3(self, bucket, path):  # to read the yaml file located on S3
+        key = 's3://' + bucket + '/' + path
+        cached = documentStore.lookup(key)
         try:
-            page = client.get_object(
-                Bucket=bucket, Key=path, RequestPayer='requester')
-            doc = (yaml.load(page['Body'].read()))
+            if (cached is not None and cached[0].startswith('etag:')):
+                try:
+                    page = s3ClientPool.getObject(
+                        bucket, path, IfNoneMatch=cached[0][5:])
+                except ClientError as e:
+                    if (e.response['ResponseMetadata'].get(
+                            'HTTPStatusCode') != 304):
+                        raise
+                    documentStore.hit(key)
+                    return cached[1]
+            else:
+                page = s3ClientPool.getObject(bucket, path)
+        except BaseException:
+            documentStore.miss()
+            raise
+        documentStore.miss()
+        try:
+            doc = yamlExtractor.load(page['Body'].read())
         except yaml.YAMLError as exc:
             raise
+        documentStore.put(key, 'etag:' + page['ETag'], doc)
         return doc
 
+    # to read the yaml file located on S3, the crawler may have prefetched it
+    def readYamlS3(self, path):
+        doc = documentPrefetcher.get(path)
+        if (doc is None):
+            doc = self.loadYamlS3(path)
+        return doc
+
+    def readYamlS3_boto3(self, bucket, path):
+        doc = documentPrefetcher.get('s3://' + bucket + '/' + path)
+        if (doc is None):
+            doc = self.loadYamlS3_boto3(bucket, path)
+        return doc
+
+    # fetches a remote yaml on one of the prefetcher's threads
+    def fetchDocument(self, path):
+        if (path.startswith("s3")):
+            index = path.find("/", 5)
+            return self.loadYamlS3_boto3(path[5:index], path[index + 1:])
+        return self.loadYamlS3(path)
+
+    # s3://bucket/ and s3://bucket/prefix/ are crawled as a listing, any
+    # other s3:// path is an object
+    def isS3Prefix(self, path):
+        return (path.startswith("s3") and (
+            path.endswith("/") or path.find("/", 5) == -1))
+
+    def listS3(self, path, patterns, recurse):
+        index = path.find("/", 5)
+        if (index == -1):
+            return s3ClientPool.listObjects(path[5:], '', patterns, recurse)
+        return s3ClientPool.listObjects(
+            path[5:index], path[index + 1:], patterns, recurse)
+
     def getProductName(self, doc):
         try:
             productName = doc['product_type']
@@ -289,6 +389,1344 @@ class Utilities():
         return None
 
 
+# Keep-alive sessions for the remote yaml reads, one per scheme and host so
+# that consecutive documents from the same endpoint reuse the pooled
+# connections instead of paying a new TCP/TLS handshake per scene. Requests
+# are bounded by the connect/read timeouts and failed connects or 5xx
+# responses are retried with exponential backoff.
+class HttpSessionPool():
+
+    def __init__(
+            self,
+            poolSize=10,
+            connectTimeout=10.0,
+            readTimeout=60.0,
+            retries=3,
+            backoffFactor=0.5):
+        self.poolSize = poolSize
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.retries = retries
+        self.backoffFactor = backoffFactor
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    # picks the http* settings out of the crawler properties, sessions made
+    # with different settings are dropped
+    def configure(self, properties):
+        settings = (
+            int(properties.get('httpPoolSize', self.poolSize)),
+            float(properties.get('httpConnectTimeout', self.connectTimeout)),
+            float(properties.get('httpReadTimeout', self.readTimeout)),
+            int(properties.get('httpRetries', self.retries)),
+            float(properties.get('httpBackoffFactor', self.backoffFactor)))
+        with self.lock:
+            if (settings == (self.poolSize, self.connectTimeout,
+                             self.readTimeout, self.retries, self.backoffFactor)):
+                return
+            (self.poolSize, self.connectTimeout, self.readTimeout,
+             self.retries, self.backoffFactor) = settings
+            sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    def getSession(self, url):
+        scheme, sep, rest = url.partition('://')
+        key = scheme.lower() + sep + rest.partition('/')[0].lower()
+        with self.lock:
+            session = self.sessions.get(key)
+            if (session is None):
+                retry = Retry(
+                    total=self.retries,
+                    connect=self.retries,
+                    read=self.retries,
+                    status=self.retries,
+                    backoff_factor=self.backoffFactor,
+                    status_forcelist=(500, 502, 503, 504),
+                    raise_on_status=False)
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.poolSize,
+                    max_retries=retry)
+                session = requests.Session()
+                session.mount(key + '/', adapter)
+                self.sessions[key] = session
+            return session
+
+    def get(self, url, headers=None):
+        response = self.getSession(url).get(
+            url, headers=headers, timeout=(self.connectTimeout, self.readTimeout))
+        response.raise_for_status()
+        return response
+
+
+httpSessionPool = HttpSessionPool()
+
+
+# One S3 client per process, shared by the crawler and builder threads.
+# boto3 clients are thread safe but expensive to create (credential and
+# endpoint resolution), so the client is built once with a connection pool
+# sized by s3MaxConnections. Whether a bucket is requester pays is worked
+# out on its first read and remembered, a plain GET that is refused is
+# retried once with RequestPayer. s3RequesterPays forces it either way and
+# s3EndpointUrl points the client at another S3 compatible service.
+class S3ClientPool():
+
+    def __init__(self, maxConnections=10, endpointUrl=None, requesterPays=None):
+        self.maxConnections = maxConnections
+        self.endpointUrl = endpointUrl
+        self.requesterPays = requesterPays
+        self.client = None
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def configure(self, properties):
+        requesterPays = properties.get('s3RequesterPays', self.requesterPays)
+        if (requesterPays is not None and not isinstance(requesterPays, bool)):
+            requesterPays = str(requesterPays).lower()
+            if (requesterPays in ('true', '1', 'yes')):
+                requesterPays = True
+            elif (requesterPays in ('false', '0', 'no')):
+                requesterPays = False
+            else:
+                requesterPays = None
+        settings = (
+            int(properties.get('s3MaxConnections', self.maxConnections)),
+            properties.get('s3EndpointUrl', self.endpointUrl) or None,
+            requesterPays)
+        with self.lock:
+            if (settings == (self.maxConnections, self.endpointUrl,
+                             self.requesterPays)):
+                return
+            self.maxConnections, self.endpointUrl, self.requesterPays = settings
+            self.client = None
+            self.buckets = {}
+
+    def getClient(self):
+        with self.lock:
+            if (self.client is None):
+                session = boto3.session.Session()
+                self.client = session.client(
+                    's3',
+                    endpoint_url=self.endpointUrl,
+                    config=Config(max_pool_connections=self.maxConnections))
+            return self.client
+
+    def getObject(self, bucket, key, **kwargs):
+        client = self.getClient()
+        requesterPays = self.requesterPays
+        if (requesterPays is None):
+            requesterPays = self.buckets.get(bucket)
+        if (requesterPays is True):
+            return client.get_object(
+                Bucket=bucket, Key=key, RequestPayer='requester', **kwargs)
+        try:
+            page = client.get_object(Bucket=bucket, Key=key, **kwargs)
+        except ClientError as e:
+            if (requesterPays is not None or e.response.get('Error', {}).get(
+                    'Code') not in ('AccessDenied', '403')):
+                raise
+            page = client.get_object(
+                Bucket=bucket, Key=key, RequestPayer='requester', **kwargs)
+            self.buckets[bucket] = True
+            return page
+        self.buckets[bucket] = False
+        return page
+
+    # yields the s3:// urls of the objects below prefix whose names match one
+    # of the ';' separated patterns. ListObjectsV2 pages are only fetched as
+    # the crawler consumes them. Without recursion the listing is limited to
+    # the prefix level, and the literal start of a single pattern is sent as
+    # part of the prefix so that the server does the filtering.
+    def listObjects(self, bucket, prefix, patterns, recurse):
+        patterns = [pattern.strip() for pattern in patterns.split(';') if pattern.strip()]
+        arguments = {'Bucket': bucket, 'Prefix': prefix}
+        if (not recurse):
+            arguments['Delimiter'] = '/'
+            if (len(patterns) == 1):
+                arguments['Prefix'] = prefix + re.split(r'[*?\[]', patterns[0], maxsplit=1)[0]
+        requesterPays = self.requesterPays
+        if (requesterPays is None):
+            requesterPays = self.buckets.get(bucket)
+        if (requesterPays is True):
+            arguments['RequestPayer'] = 'requester'
+        paginator = self.getClient().get_paginator('list_objects_v2')
+        pages = iter(paginator.paginate(**arguments))
+        try:
+            page = next(pages, None)
+        except ClientError as e:
+            if (requesterPays is not None or e.response.get('Error', {}).get(
+                    'Code') not in ('AccessDenied', '403')):
+                raise
+            arguments['RequestPayer'] = 'requester'
+            pages = iter(paginator.paginate(**arguments))
+            page = next(pages, None)
+            self.buckets[bucket] = True
+        while (page is not None):
+            for item in page.get('Contents', []):
+                name = item['Key'].rpartition('/')[2]
+                for pattern in patterns:
+                    if (fnmatch.fnmatchcase(name, pattern)):
+                        yield 's3://' + bucket + '/' + item['Key']
+                        break
+            page = next(pages, None)
+
+
+s3ClientPool = S3ClientPool(requesterPays=True)
+
+
+# Optional look-ahead for remote scenes (crawler property prefetch=N). The
+# crawler's path generator is wrapped so that the yaml of the next N http/s3
+# paths is fetched on a small thread pool (prefetchThreads) while the
+# current scene is built. Paths still reach the builder one at a time and in
+# crawl order, readYamlS3/readYamlS3_boto3 pick up the fetched documents.
+# The generator only reads ahead as far as the crawler is pulled and the
+# fetched documents waiting for the builder are bounded, the oldest are
+# dropped and simply read again if they are still needed.
+class DocumentPrefetcher():
+
+    def __init__(self, lookAhead=0, threads=4):
+        self.lookAhead = lookAhead
+        self.threads = threads
+        self.executor = None
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    def configure(self, properties):
+        lookAhead = int(properties.get('prefetch', self.lookAhead) or 0)
+        threads = max(1, int(properties.get('prefetchThreads', self.threads) or 1))
+        if (ThreadPoolExecutor is None):
+            lookAhead = 0
+        with self.lock:
+            self.lookAhead = lookAhead
+            if (threads != self.threads and self.executor is not None):
+                self.executor.shutdown(wait=False)
+                self.executor = None
+            self.threads = threads
+
+    def wrap(self, paths, loader):
+        if (self.lookAhead <= 0):
+            return paths
+        return self.prefetch(paths, loader)
+
+    def prefetch(self, paths, loader):
+        window = deque()
+        paths = iter(paths)
+        exhausted = False
+        while (True):
+            while (not exhausted and len(window) <= self.lookAhead):
+                try:
+                    path = next(paths)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if (path.startswith("http") or path.startswith("s3")):
+                    self.submit(path, loader)
+                window.append(path)
+            if (not window):
+                return
+            yield window.popleft()
+
+    def submit(self, path, loader):
+        with self.lock:
+            if (path in self.pending):
+                return
+            if (self.executor is None):
+                self.executor = ThreadPoolExecutor(max_workers=self.threads)
+            self.pending[path] = self.executor.submit(loader, path)
+            while (len(self.pending) > 2 * self.lookAhead):
+                oldPath, oldFuture = self.pending.popitem(last=False)
+                oldFuture.cancel()
+
+    # returns the prefetched document of path, waiting for it if the fetch is
+    # still running. None when the path was not prefetched or the fetch
+    # failed, the caller then reads it itself and gets the error first hand.
+    # The document is handed out once, the entry is dropped as it is taken so
+    # that pending only holds the fetches still ahead of the builder.
+    def get(self, path):
+        with self.lock:
+            future = self.pending.get(path)
+        if (future is None):
+            return None
+        try:
+            return future.result()
+        except BaseException:
+            return None
+        finally:
+            with self.lock:
+                if (self.pending.get(path) is future):
+                    del self.pending[path]
+
+
+documentPrefetcher = DocumentPrefetcher()
+
+
+# Fixed UTC offset of a timestamp read back from the document cache, for
+# python 2, which has no datetime.timezone.
+class FixedOffset(datetime.tzinfo):
+
+    def __init__(self, offset):
+        self.offset = offset
+
+    def utcoffset(self, dt):
+        return self.offset
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        seconds = self.offset.days * 86400 + self.offset.seconds
+        sign = '-' if seconds < 0 else '+'
+        return 'UTC%s%02d:%02d' % (sign, abs(seconds) // 3600, abs(seconds) % 3600 // 60)
+
+
+fixedOffset = getattr(datetime, 'timezone', FixedOffset)
+
+
+# Opt-in persistent cache of parsed yaml documents, enabled with the crawler
+# property documentCache=<sqlite file> and capped by documentCacheSize (MB).
+# Entries are keyed by path or url and carry a validator: mtime and size for
+# local files, the ETag or Last-Modified of remote ones. Local entries are
+# used while the file is unchanged, remote ones when the conditional request
+# comes back 304, so re-indexing an unchanged archive does not download or
+# parse any document again. Least recently used entries go first once the
+# cap is exceeded.
+# Documents are stored as json, never pickled, as the cache file may be
+# writable by others than the ingest host. The values json has no type for
+# (timestamps, binary, non-string keys) are written as tagged objects.
+class DocumentStore():
+
+    TAGS = ('__datetime__', '__date__', '__bytes__', '__set__', '__items__')
+
+    def __init__(self, maxBytes=512 * 1024 * 1024, touchBatch=256):
+        self.path = None
+        self.maxBytes = maxBytes
+        self.touchBatch = touchBatch
+        self.connection = None
+        self.lock = threading.Lock()
+        self.touched = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, properties):
+        size = properties.get('documentCacheSize')
+        if (size):
+            self.maxBytes = int(float(size) * 1024 * 1024)
+        path = properties.get('documentCache')
+        if (path and path != self.path):
+            self.open(path)
+
+    def open(self, path):
+        connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY, '
+            'validator TEXT, size INTEGER, accessed REAL, doc BLOB)')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS documents_accessed ON documents (accessed)')
+        connection.commit()
+        with self.lock:
+            if (self.connection is not None):
+                self.flush()
+                self.connection.commit()
+                self.connection.close()
+            self.connection = connection
+            self.path = path
+            self.touched = {}
+
+    def localValidator(self, path):
+        stat = os.stat(path)
+        return 'stat:%r:%d' % (stat.st_mtime, stat.st_size)
+
+    def httpValidator(self, headers):
+        if (headers.get('ETag')):
+            return 'etag:' + headers['ETag']
+        if (headers.get('Last-Modified')):
+            return 'modified:' + headers['Last-Modified']
+        return None
+
+    def conditionalHeaders(self, entry):
+        if (entry is None):
+            return None
+        if (entry[0].startswith('etag:')):
+            return {'If-None-Match': entry[0][5:]}
+        if (entry[0].startswith('modified:')):
+            return {'If-Modified-Since': entry[0][9:]}
+        return None
+
+    def encode(self, value):
+        if (isinstance(value, dict)):
+            if (all(isinstance(key, str) and key not in self.TAGS for key in value)):
+                return dict((key, self.encode(item)) for key, item in value.items())
+            return {'__items__': [[self.encode(key), self.encode(item)]
+                                  for key, item in value.items()]}
+        if (isinstance(value, list)):
+            return [self.encode(item) for item in value]
+        if (isinstance(value, datetime.datetime)):
+            offset = value.utcoffset()
+            return {'__datetime__': [
+                value.year, value.month, value.day, value.hour, value.minute,
+                value.second, value.microsecond,
+                None if offset is None else offset.days * 86400 + offset.seconds]}
+        if (isinstance(value, datetime.date)):
+            return {'__date__': [value.year, value.month, value.day]}
+        if (isinstance(value, bytes)):
+            return {'__bytes__': base64.b64encode(value).decode('ascii')}
+        if (isinstance(value, (set, frozenset))):
+            return {'__set__': [self.encode(item) for item in value]}
+        return value
+
+    def decodeObject(self, value):
+        if (len(value) != 1):
+            return value
+        tag, item = next(iter(value.items()))
+        if (tag == '__datetime__'):
+            tzinfo = None
+            if (item[7] is not None):
+                tzinfo = fixedOffset(datetime.timedelta(seconds=item[7]))
+            return datetime.datetime(*item[:7], tzinfo=tzinfo)
+        if (tag == '__date__'):
+            return datetime.date(*item)
+        if (tag == '__bytes__'):
+            return base64.b64decode(item)
+        if (tag == '__set__'):
+            return set(item)
+        if (tag == '__items__'):
+            return dict((key, element) for key, element in item)
+        return value
+
+    def dumps(self, doc):
+        return json.dumps(self.encode(doc), separators=(',', ':')).encode('utf-8')
+
+    def loads(self, blob):
+        return json.loads(bytes(blob).decode('utf-8'), object_hook=self.decodeObject)
+
+    # returns (validator, doc) of the cached entry or None
+    def lookup(self, key):
+        with self.lock:
+            if (self.connection is None):
+                return None
+            row = self.connection.execute(
+                'SELECT validator, doc FROM documents WHERE key = ?',
+                (key,)).fetchone()
+        if (row is None):
+            return None
+        try:
+            return row[0], self.loads(row[1])
+        except ValueError:
+            # written by an older version, it is replaced on the next put
+            return None
+
+    # returns the cached document when it is still valid
+    def get(self, key, validator):
+        entry = self.lookup(key)
+        if (entry is None or entry[0] != validator):
+            self.miss()
+            return None
+        self.hit(key)
+        return entry[1]
+
+    # the access times are written in batches, not with a commit per hit
+    def hit(self, key):
+        with self.lock:
+            self.hits += 1
+            self.touched[key] = time.time()
+            if (len(self.touched) >= self.touchBatch):
+                self.flush()
+                self.connection.commit()
+
+    def miss(self):
+        with self.lock:
+            if (self.connection is not None):
+                self.misses += 1
+
+    # writes the pending access times, the caller holds the lock and commits
+    def flush(self):
+        if (self.touched):
+            self.connection.executemany(
+                'UPDATE documents SET accessed = ? WHERE key = ?',
+                [(accessed, key) for key, accessed in self.touched.items()])
+            self.touched = {}
+
+    def put(self, key, validator, doc):
+        if (self.connection is None or validator is None):
+            return
+        blob = self.dumps(doc)
+        if (len(blob) > self.maxBytes):
+            return
+        with self.lock:
+            self.flush()
+            self.connection.execute(
+                'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)',
+                (key, validator, len(blob), time.time(), sqlite3.Binary(blob)))
+            total = self.connection.execute(
+                'SELECT SUM(size) FROM documents').fetchone()[0] or 0
+            while (total > self.maxBytes):
+                oldKey, oldSize = self.connection.execute(
+                    'SELECT key, size FROM documents ORDER BY accessed LIMIT 1').fetchone()
+                self.connection.execute(
+                    'DELETE FROM documents WHERE key = ?', (oldKey,))
+                total -= oldSize
+                self.evictions += 1
+            self.connection.commit()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+documentStore = DocumentStore()
+
+
+# Pulls only the declared key paths out of a yaml document. It works on the
+# parser's event stream, so subtrees that no builder reads (mostly the scene
+# lineage) are skipped instead of being composed and constructed. Paths are
+# dotted keys and '*' matches any key of a mapping. A path selects the whole
+# subtree below it, and a path into a sequence applies to each of its items.
+# The result has the layout of the full document restricted to those paths,
+# with the same values the safe loader constructs.
+class YamlExtractor():
+
+    STR_TAG = 'tag:yaml.org,2002:str'
+
+    def __init__(self, fields):
+        self.fields = {}
+        for field in fields:
+            node = self.fields
+            keys = field.split('.')
+            for key in keys[:-1]:
+                if (node.get(key, {}) is None):
+                    break
+                node = node.setdefault(key, {})
+            else:
+                node[keys[-1]] = None
+        self.resolver = yaml.resolver.Resolver()
+        self.constructor = yaml.constructor.SafeConstructor()
+
+    def load(self, data):
+        try:
+            return self.extract(data)
+        except yaml.constructor.ConstructorError:
+            # tags, merge keys or aliases into skipped subtrees, let the
+            # loader construct the whole document
+            return yaml.load(data, Loader=YamlLoader)
+
+    # the anchors of a document are local to the call, the prefetcher threads
+    # share the extractor
+    def extract(self, data):
+        events = yaml.parse(data, Loader=YamlLoader)
+        for event in events:
+            if (isinstance(event, yaml.DocumentStartEvent)):
+                return self.select(events, next(events), self.fields, {})
+        return None
+
+    def select(self, events, event, fields, anchors):
+        if (fields is None or not isinstance(
+                event, (yaml.MappingStartEvent, yaml.SequenceStartEvent))):
+            return self.construct(events, event, anchors)
+        self.checkTag(event)
+        if (isinstance(event, yaml.SequenceStartEvent)):
+            value = []
+            event = next(events)
+            while (not isinstance(event, yaml.SequenceEndEvent)):
+                value.append(self.select(events, event, fields, anchors))
+                event = next(events)
+            return value
+        value = {}
+        wildcard = fields.get('*', False)
+        event = next(events)
+        while (not isinstance(event, yaml.MappingEndEvent)):
+            key = self.construct(events, event, anchors)
+            child = fields.get(key, wildcard)
+            if (child is False):
+                self.skip(events, next(events))
+            else:
+                value[key] = self.select(events, next(events), child, anchors)
+            event = next(events)
+        return value
+
+    def construct(self, events, event, anchors):
+        if (isinstance(event, yaml.ScalarEvent)):
+            value = self.constructScalar(event)
+        elif (isinstance(event, yaml.AliasEvent)):
+            if (event.anchor not in anchors):
+                raise yaml.constructor.ConstructorError(
+                    None, None, "alias %r into a skipped subtree" % event.anchor,
+                    event.start_mark)
+            return anchors[event.anchor]
+        elif (isinstance(event, yaml.SequenceStartEvent)):
+            self.checkTag(event)
+            value = []
+            if (event.anchor is not None):
+                anchors[event.anchor] = value
+            event = next(events)
+            while (not isinstance(event, yaml.SequenceEndEvent)):
+                value.append(self.construct(events, event, anchors))
+                event = next(events)
+            return value
+        else:
+            self.checkTag(event)
+            value = {}
+            if (event.anchor is not None):
+                anchors[event.anchor] = value
+            event = next(events)
+            while (not isinstance(event, yaml.MappingEndEvent)):
+                key = self.construct(events, event, anchors)
+                if (key == '<<'):
+                    raise yaml.constructor.ConstructorError(
+                        None, None, "merge key", event.start_mark)
+                value[key] = self.construct(events, next(events), anchors)
+                event = next(events)
+            return value
+        if (event.anchor is not None):
+            anchors[event.anchor] = value
+        return value
+
+    def constructScalar(self, event):
+        tag = event.tag
+        if (tag is None or tag == '!'):
+            if (not event.implicit[0]):
+                # quoted scalars are always strings
+                return event.value
+            tag = self.resolver.resolve(yaml.ScalarNode, event.value, event.implicit)
+        if (tag == self.STR_TAG):
+            return event.value
+        if (tag not in self.constructor.yaml_constructors):
+            raise yaml.constructor.ConstructorError(
+                None, None, "unsupported tag %r" % tag, event.start_mark)
+        return self.constructor.yaml_constructors[tag](
+            self.constructor, yaml.ScalarNode(tag, event.value, style=event.style))
+
+    def checkTag(self, event):
+        if (event.tag is not None and event.tag != '!' and event.tag not in (
+                'tag:yaml.org,2002:map', 'tag:yaml.org,2002:seq')):
+            raise yaml.constructor.ConstructorError(
+                None, None, "unsupported tag %r" % event.tag, event.start_mark)
+
+    def skip(self, events, event):
+        depth = 0
+        while (True):
+            if (isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent))):
+                depth += 1
+            elif (isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent))):
+                depth -= 1
+            if (depth == 0):
+                return
+            event = next(events)
+
+# the parts of the yaml documents read by the crawler and builder
+yamlExtractor = YamlExtractor([
+    'id',
+    'product_type',
+    'processing_level',
+    'platform',
+    'instrument',
+    'extent.center_dt',
+    'grid_spatial.projection',
+    'image.bands.*.path'])
+
+
+# arcpy.SpatialReference(...).exportToString() keyed by EPSG code. An archive
+# only uses a handful of codes, so each one is exported once per session
+# instead of once per item. The cache is seeded from a projections.json
+# bundled next to this raster type when there is one, and from the file
+# named by the crawler property projectionCache. New codes are written back
+# to that file, so later sessions start with them (copy it next to the
+# raster type to bundle it).
+class ProjectionCache():
+
+    def __init__(self, seedPath=None):
+        self.strings = {}
+        self.path = None
+        self.lock = threading.Lock()
+        if (seedPath is not None):
+            self.load(seedPath)
+
+    def configure(self, properties):
+        path = properties.get('projectionCache')
+        if (path and path != self.path):
+            self.load(path)
+            self.path = path
+
+    def load(self, path):
+        if (not os.path.exists(path)):
+            return
+        try:
+            with open(path, 'r') as f:
+                strings = json.load(f)
+        except (IOError, ValueError):
+            return
+        with self.lock:
+            for code, text in strings.items():
+                self.strings.setdefault(int(code), text)
+
+    def get(self, spatialId):
+        spatialId = int(spatialId)
+        with self.lock:
+            text = self.strings.get(spatialId)
+        if (text is None):
+            text = arcpy.SpatialReference(spatialId).exportToString()
+            with self.lock:
+                self.strings[spatialId] = text
+            self.save()
+        return text
+
+    def save(self):
+        if (self.path is None):
+            return
+        with self.lock:
+            strings = dict((str(code), text)
+                           for code, text in self.strings.items())
+        temp = self.path + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(strings, f, indent=1, sort_keys=True)
+            if (os.path.exists(self.path)):
+                os.remove(self.path)
+            os.rename(temp, self.path)
+        except (IOError, OSError):
+            # another session may be writing it, the codes are exported
+            # again next time
+            pass
+
+
+projectionCache = ProjectionCache(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'projections.json'))
+
+
+# Directory walker for recursive crawls. Directories are listed with
+# os.scandir, whose entries tell files from directories without a stat per
+# entry, and the subdirectories fan out over a small thread pool (crawler
+# property crawlThreads, 1 lists one directory at a time) so that several
+# listings are in flight at once on network shares. Matching files are
+# yielded as each listing comes back, which with more than one thread is in
+# no fixed order across directories. As with os.walk, unreadable
+# directories are skipped and links to directories are not followed.
+class DirectoryWalker():
+
+    def __init__(self):
+        self.threads = 8
+
+    def configure(self, properties):
+        threads = properties.get('crawlThreads')
+        if (threads):
+            self.threads = max(int(threads), 1)
+
+    # the names of the files and of the subdirectories of a directory
+    def scan(self, path):
+        files = []
+        dirs = []
+        try:
+            for entry in os.scandir(path):
+                try:
+                    isDir = entry.is_dir()
+                except OSError:
+                    isDir = False
+                if (not isDir):
+                    files.append(entry.name)
+                elif (not entry.is_symlink()):
+                    dirs.append(entry.name)
+        except OSError:
+            pass
+        return path, files, dirs
+
+    # Paths of the files below top whose name passes match. prune, when
+    # given, is called with the subdirectory names of each directory and
+    # whether a file matched in it, and returns the ones to walk into.
+    def walk(self, top, match, prune=None):
+        # python 2 has no scandir
+        if (not hasattr(os, 'scandir')):
+            for root, dirs, files in os.walk(top):
+                found = [file for file in files if match(file)]
+                if (prune is not None):
+                    dirs[:] = prune(dirs, bool(found))
+                for file in found:
+                    yield os.path.join(root, file)
+            return
+
+        if (self.threads == 1 or ThreadPoolExecutor is None):
+            pending = [top]
+            while (pending):
+                path, files, dirs = self.scan(pending.pop())
+                found = [file for file in files if match(file)]
+                if (prune is not None):
+                    dirs = prune(dirs, bool(found))
+                pending.extend(os.path.join(path, name) for name in reversed(dirs))
+                for file in found:
+                    yield os.path.join(path, file)
+            return
+
+        pending = deque([top])
+        running = set()
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            while (pending or running):
+                while (pending and len(running) < self.threads * 2):
+                    running.add(executor.submit(self.scan, pending.popleft()))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, files, dirs = future.result()
+                    found = [file for file in files if match(file)]
+                    if (prune is not None):
+                        dirs = prune(dirs, bool(found))
+                    pending.extend(os.path.join(path, name) for name in dirs)
+                    for file in found:
+                        yield os.path.join(path, file)
+        finally:
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+directoryWalker = DirectoryWalker()
+
+
+# Opt-in record of the scenes already ingested, enabled with the crawler
+# property crawlState=<sqlite file>. The builder records the path, size,
+# mtime and a sha1 of the content of every local file it builds, and later
+# crawls only pass on the files that are new or have changed since: another
+# size, or another mtime unless the hash shows the content is the same (a
+# copied or touched file). Files that failed to build are not recorded and
+# are tried again, urls are always passed on. With crawlDeletions=<file>, a
+# crawl that runs to the end also appends the recorded files below its
+# directories that are gone to that file, one path per line, and forgets
+# them. A scene the crawler emits several tags for is recorded once all of
+# them are built, and not when one of them failed.
+class CrawlState():
+
+    def __init__(self):
+        self.path = None
+        self.connection = None
+        self.deletionsPath = None
+        self.lock = threading.Lock()
+        self.pendingTags = {}
+        self.failedScenes = set()
+        self.passed = 0
+        self.skipped = 0
+        self.deleted = 0
+
+    def configure(self, properties):
+        self.deletionsPath = properties.get('crawlDeletions') or None
+        path = properties.get('crawlState')
+        if (path and path != self.path):
+            self.open(path)
+
+    def open(self, path):
+        connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS scenes (key TEXT PRIMARY KEY, '
+            'path TEXT, size INTEGER, mtime REAL, hash TEXT, seen REAL)')
+        connection.commit()
+        with self.lock:
+            if (self.connection is not None):
+                self.connection.close()
+            self.connection = connection
+            self.path = path
+
+    def key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def isLocal(self, path):
+        return '://' not in path
+
+    def contentHash(self, path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # whether the file was built before and has not changed since
+    def unchanged(self, path):
+        key = self.key(path)
+        stat = os.stat(path)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT size, mtime, hash FROM scenes WHERE key = ?',
+                (key,)).fetchone()
+        if (row is None or row[0] != stat.st_size):
+            return False
+        if (row[1] == stat.st_mtime):
+            return True
+        if (self.contentHash(path) != row[2]):
+            return False
+        with self.lock:
+            self.connection.execute(
+                'UPDATE scenes SET mtime = ? WHERE key = ?', (stat.st_mtime, key))
+            self.connection.commit()
+        return True
+
+    # the crawler registers the tags it emits for a scene before the first
+    # of them is built
+    def expect(self, path, tags):
+        if (self.connection is None or not path or not self.isLocal(path)):
+            return
+        key = self.key(path)
+        with self.lock:
+            self.pendingTags[key] = set(tags)
+            self.failedScenes.discard(key)
+
+    # built tells whether the builder built the tag, a scene without
+    # registered tags is recorded with its one uri
+    def release(self, path, tag, built):
+        if (self.connection is None or not path or not self.isLocal(path)):
+            return
+        key = self.key(path)
+        with self.lock:
+            tags = self.pendingTags.get(key)
+            if (tags is not None):
+                tags.discard(tag)
+                if (not built):
+                    self.failedScenes.add(key)
+                if (tags):
+                    return
+                del self.pendingTags[key]
+                if (key in self.failedScenes):
+                    self.failedScenes.discard(key)
+                    return
+        if (built):
+            self.built(path)
+
+    def built(self, path):
+        if (self.connection is None or not path or not self.isLocal(path)):
+            return
+        try:
+            stat = os.stat(path)
+            digest = self.contentHash(path)
+        except (IOError, OSError):
+            return
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO scenes VALUES (?, ?, ?, ?, ?, ?)',
+                (self.key(path), path, stat.st_size, stat.st_mtime, digest,
+                 time.time()))
+            self.connection.commit()
+
+    # the crawler's paths without the unchanged files, roots are the paths
+    # the crawl was given
+    def wrap(self, paths, roots):
+        if (self.connection is None):
+            return paths
+        return self.skipUnchanged(paths, roots)
+
+    def skipUnchanged(self, paths, roots):
+        run = time.time()
+        seen = []
+        for path in paths:
+            if (self.isLocal(path)):
+                if (self.deletionsPath is not None):
+                    seen.append((run, self.key(path)))
+                    if (len(seen) >= 1000):
+                        self.markSeen(seen)
+                        seen = []
+                try:
+                    unchanged = self.unchanged(path)
+                except (IOError, OSError):
+                    unchanged = False
+                if (unchanged):
+                    self.skipped += 1
+                    continue
+            self.passed += 1
+            yield path
+        self.markSeen(seen)
+        if (self.deletionsPath is not None):
+            self.reportDeletions(run, roots)
+
+    def markSeen(self, seen):
+        if (not seen):
+            return
+        with self.lock:
+            self.connection.executemany(
+                'UPDATE scenes SET seen = ? WHERE key = ?', seen)
+            self.connection.commit()
+
+    # recorded files below the crawled directories that this crawl did not
+    # come across and that no longer exist
+    def reportDeletions(self, run, roots):
+        prefixes = [self.key(root).rstrip(os.sep) + os.sep
+                    for root in roots if os.path.isdir(root)]
+        if (not prefixes):
+            return
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT key, path FROM scenes WHERE seen IS NULL OR seen < ?',
+                (run,)).fetchall()
+        deleted = [(key, path) for key, path in rows
+                   if any(key.startswith(prefix) for prefix in prefixes) and
+                   not os.path.exists(path)]
+        if (not deleted):
+            return
+        with open(self.deletionsPath, 'a') as f:
+            for key, path in deleted:
+                f.write(path + '\n')
+        with self.lock:
+            self.connection.executemany(
+                'DELETE FROM scenes WHERE key = ?', [(key,) for key, path in deleted])
+            self.connection.commit()
+            self.deleted += len(deleted)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'passed': self.passed,
+                'skipped': self.skipped,
+                'deleted': self.deleted}
+
+
+crawlState = CrawlState()
+
+
+# Watch mode, enabled with the crawler property watch=true. Once the crawl of
+# the paths is done the crawler keeps running and passes on the metadata
+# files delivered below the directories among them, as the crawl of those
+# directories would have found them. A file is passed on once nothing has
+# changed in its directory, or below it, for watchSettle seconds (5 by
+# default), so that a product still being copied is not built half written.
+# The changes are read from inotify on Linux. Elsewhere, on shares whose
+# changes inotify does not see, or with watch=poll, the directories are
+# scanned every watchPoll seconds (10 by default) instead and a file waits
+# a scan longer. watchTimeout=<seconds> ends the crawl after that long
+# without a new file, by default it runs until it is cancelled.
+class FileWatcher():
+
+    def __init__(self):
+        self.mode = None
+        self.settle = 5.0
+        self.poll = 10.0
+        self.timeout = None
+        self.passed = 0
+
+    def configure(self, properties):
+        mode = str(properties.get('watch') or '').lower()
+        if (mode in ('', 'false', 'no', '0')):
+            self.mode = None
+        elif (mode == 'poll'):
+            self.mode = 'poll'
+        else:
+            self.mode = 'auto'
+        self.settle = float(properties.get('watchSettle') or self.settle)
+        self.poll = max(float(properties.get('watchPoll') or self.poll), 0.1)
+        self.timeout = float(properties.get('watchTimeout') or 0) or None
+
+    # the crawler's paths followed by the files delivered later below roots,
+    # match tells the metadata files from the rest by their name and owns,
+    # when given, the ones of this crawler's shard by their path
+    def wrap(self, paths, roots, match, recurse, owns=None):
+        roots = [root for root in roots if os.path.isdir(root)]
+        if (self.mode is None or not roots):
+            return paths
+        return self.follow(paths, roots, match, recurse, owns)
+
+    def open(self, roots, recurse):
+        if (self.mode == 'auto'):
+            try:
+                return InotifySource(roots, recurse)
+            except (OSError, AttributeError) as e:
+                print('Cannot watch with inotify ({}), scanning every {} seconds'.format(
+                    e, self.poll))
+        return PollingSource(roots, recurse, self.poll)
+
+    def signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime)
+
+    def follow(self, paths, roots, match, recurse, owns):
+        # the source is opened first so that no delivery made during the
+        # crawl is missed, the ones the crawl found are not passed on twice
+        source = self.open(roots, recurse)
+        settle = self.settle + source.latency
+        pending = OrderedDict()
+        passed = {}
+        try:
+            for path in paths:
+                passed[path] = self.signature(path)
+                yield path
+
+            last = time.time()
+            while (True):
+                now = time.time()
+                timeout = None
+                if (pending):
+                    oldest = min(activity for directory, activity in pending.values())
+                    timeout = oldest + settle - now
+                if (self.timeout is not None and not pending):
+                    timeout = last + self.timeout - now
+                for directory, name, written in source.events(
+                        None if timeout is None else max(timeout, 0)):
+                    now = time.time()
+                    if (written and match(name)):
+                        delivered = os.path.join(directory, name)
+                        if (owns is None or owns(delivered)):
+                            pending[delivered] = [directory, now]
+                    # any change in a product holds back its metadata file
+                    for product in pending.values():
+                        if (directory == product[0] or directory.startswith(product[0] + os.sep)):
+                            product[1] = now
+
+                now = time.time()
+                for path, (directory, activity) in list(pending.items()):
+                    if (now - activity < settle):
+                        continue
+                    del pending[path]
+                    signature = self.signature(path)
+                    if (signature is None or passed.get(path) == signature):
+                        continue
+                    passed[path] = signature
+                    last = now
+                    self.passed += 1
+                    yield path
+
+                if (self.timeout is not None and not pending and now - last >= self.timeout):
+                    return
+        finally:
+            source.close()
+
+
+# Changes below a set of directories as inotify reports them, Linux only.
+class InotifySource():
+
+    # from sys/inotify.h
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+    EVENTS = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE)
+    WRITES = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    latency = 0.0
+
+    def __init__(self, roots, recurse):
+        if (not sys.platform.startswith('linux')):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if (self.fd < 0):
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.roots = roots
+        self.recurse = recurse
+        self.watches = {}
+        try:
+            for root in roots:
+                self.add(root)
+        except OSError:
+            self.close()
+            raise
+
+    # watches path, and the directories below it when recursing, and returns
+    # the files found in them
+    def add(self, path):
+        found = []
+        pending = [path]
+        while (pending):
+            directory = pending.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.EVENTS)
+            if (wd < 0):
+                error = ctypes.get_errno()
+                if (error == errno.ENOSPC):
+                    raise OSError(error, 'out of inotify watches, see fs.inotify.max_user_watches')
+                continue
+            # a directory moved within the tree keeps its watch
+            self.watches[wd] = directory
+            directory, files, dirs = directoryWalker.scan(directory)
+            found.extend((directory, name) for name in files)
+            if (self.recurse):
+                pending.extend(os.path.join(directory, name) for name in dirs)
+        return found
+
+    # (directory, name, written) of the changes, waiting up to timeout
+    # seconds for the first, or for good when timeout is None
+    def events(self, timeout):
+        if (not select.select([self.fd], [], [], timeout)[0]):
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if (e.errno == errno.EAGAIN):
+                return []
+            raise
+        events = []
+        offset = 0
+        while (offset + 16 <= len(data)):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b'\0'))
+            offset += 16 + length
+            if (mask & self.IN_Q_OVERFLOW):
+                # events were lost, everything is looked at again
+                for root in self.roots:
+                    events.extend((directory, file, True) for directory, file in self.add(root))
+                continue
+            if (mask & self.IN_IGNORED):
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if (directory is None):
+                continue
+            if (mask & self.IN_ISDIR):
+                # a product moved in whole raises no event for its files
+                if (self.recurse and mask & (self.IN_CREATE | self.IN_MOVED_TO)):
+                    try:
+                        found = self.add(os.path.join(directory, name))
+                    except OSError as e:
+                        print('Cannot watch {}: {}'.format(os.path.join(directory, name), e))
+                        found = []
+                    events.extend((path, file, True) for path, file in found)
+                events.append((directory, name, False))
+            else:
+                events.append((directory, name, bool(mask & self.WRITES)))
+        return events
+
+    def close(self):
+        if (self.fd >= 0):
+            os.close(self.fd)
+            self.fd = -1
+
+
+# Changes below a set of directories found by comparing scans made every
+# interval seconds.
+class PollingSource():
+
+    def __init__(self, roots, recurse, interval):
+        self.roots = roots
+        self.recurse = recurse
+        self.interval = interval
+        self.latency = interval
+        self.files = self.scan()
+        self.due = time.time() + interval
+
+    # size and mtime of every file below the roots
+    def scan(self):
+        files = {}
+        for root in self.roots:
+            if (self.recurse):
+                paths = directoryWalker.walk(root, lambda file: True)
+            else:
+                directory, names, dirs = directoryWalker.scan(root)
+                paths = [os.path.join(directory, name) for name in names]
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_size, stat.st_mtime)
+        return files
+
+    def events(self, timeout):
+        wait = self.due - time.time()
+        if (timeout is not None and timeout < wait):
+            time.sleep(timeout)
+            return []
+        if (wait > 0):
+            time.sleep(wait)
+        files = self.scan()
+        self.due = time.time() + self.interval
+        events = []
+        for path, signature in files.items():
+            if (self.files.get(path) != signature):
+                events.append((os.path.dirname(path), os.path.basename(path), True))
+        for path in self.files:
+            if (path not in files):
+                events.append((os.path.dirname(path), os.path.basename(path), False))
+        self.files = files
+        return events
+
+    def close(self):
+        pass
+
+
+fileWatcher = FileWatcher()
+
+
+# Splits a crawl between processes or hosts, enabled with the crawler property
+# shard=k/N: the crawler passes on only the paths of the k-th of N shards, k
+# from 1 to N. A path goes to the shard picked by a stable hash of where it
+# is below the crawled directory it was found in, or of the url or csv entry
+# as written, so that N crawlers of the same paths each get a disjoint part
+# of them without talking to each other, even with the archive mounted at
+# another place on each host. Separators are hashed as '/' for the same
+# reason.
+class CrawlShard():
+
+    def __init__(self):
+        self.index = 0
+        self.count = 1
+
+    def configure(self, properties):
+        shard = properties.get('shard')
+        if (not shard):
+            self.index = 0
+            self.count = 1
+            return
+        try:
+            index, count = [int(part) for part in str(shard).split('/')]
+        except ValueError:
+            raise ValueError('shard must be given as k/N, not {}'.format(shard))
+        if (count < 1 or index < 1 or index > count):
+            raise ValueError('shard {} is not one of 1/{} to {}/{}'.format(
+                shard, count, count, count))
+        self.index = index - 1
+        self.count = count
+
+    # the crawled directories, as the prefixes of the paths found in them
+    def prefixes(self, roots):
+        prefixes = [os.path.abspath(root).rstrip(os.sep) + os.sep
+                    for root in roots if os.path.isdir(root)]
+        return sorted(prefixes, key=len, reverse=True)
+
+    def key(self, path, prefixes):
+        if ('://' not in path):
+            absolute = os.path.abspath(path)
+            for prefix in prefixes:
+                if (absolute.startswith(prefix)):
+                    path = absolute[len(prefix):]
+                    break
+        return path.replace('\\', '/')
+
+    # whether path belongs to this shard, scene maps the key of a path to the
+    # one of the scene it is part of, when several files make up a scene
+    def owns(self, path, prefixes, scene=None):
+        if (self.count == 1):
+            return True
+        key = self.key(path, prefixes)
+        if (scene is not None):
+            key = scene(key)
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % self.count == self.index
+
+    # a function telling whether a path found below roots belongs to this
+    # shard, None when the crawl is not split
+    def owner(self, roots, scene=None):
+        if (self.count == 1):
+            return None
+        prefixes = self.prefixes(roots)
+        return lambda path: self.owns(path, prefixes, scene)
+
+    def wrap(self, paths, roots, scene=None):
+        owns = self.owner(roots, scene)
+        if (owns is None):
+            return paths
+        return (path for path in paths if owns(path))
+
+
+crawlShard = CrawlShard()
+
+
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
 # LandsatDataCube builder class
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
@@ -341,7 +1779,17 @@ class LandsatDataCubeBuilder():
 
         return cachingMRF
 
+    # the scene is recorded in crawlState once all of its tags are built
     def build(self, itemURI):
+        builtItemsList = None
+        try:
+            builtItemsList = self.buildItems(itemURI)
+        finally:
+            crawlState.release(
+                itemURI.get('path'), itemURI.get('tag'), bool(builtItemsList))
+        return builtItemsList
+
+    def buildItems(self, itemURI):
      # Make sure that the itemURI dictionary contains items
         if (len(itemURI) <= 0):
             return None
@@ -379,7 +1827,7 @@ class LandsatDataCubeBuilder():
                 spatialRef = doc['grid_spatial']['projection']['spatial_reference']
                 spatialIdx = spatialRef.find(':')
                 spatialId = int(spatialRef[spatialIdx + 1:])
-                prjString = arcpy.SpatialReference(spatialId).exportToString()
+                prjString = projectionCache.get(spatialId)
                 protocol = 'vsicurl/http://'
                 cachePath = _yamlpath.split(
                     "//")[1][0:_yamlpath.split("//")[1].rfind("/")].replace(".s3.amazonaws.com", "")
@@ -532,7 +1980,7 @@ class LandsatDataCubeBuilder():
                 spatialRef = doc['grid_spatial']['projection']['spatial_reference']
                 spatialIdx = spatialRef.find(':')
                 spatialId = int(spatialRef[spatialIdx + 1:])
-                prjString = arcpy.SpatialReference(spatialId).exportToString()
+                prjString = projectionCache.get(spatialId)
                 protocol = 'vsis3/'
                 cachePath = _yamlpath.split(
                     "//")[1][0:_yamlpath.split("//")[1].rfind("/")]
@@ -732,361 +2180,414 @@ class LandsatDataCubeBuilder():
             if (projectionNode is not None):
                 srsWKT = int(projectionNode.split(":")[1])
 
-# DEFINE A DICTIONARY OF VARIABLES
-            variables = {}
-
-# Depending upon the tag name in the itemURI pass the appropriate
-# bandProperties dictionary and RFT
-            builtItem = {}
-            if (itemURI['tag'] == "DataCube_L8_MS" or itemURI['tag']
-                    == "DataCube_L7_MS"):
-                # NBART
-                bandProperties = [{'bandName': 'blue'},
-                                  {'bandName': 'green'},
-                                  {'bandName': 'red'},
-                                  {'bandName': 'nir'},
-                                  {'bandName': 'swir1'},
-                                  {'bandName': 'swir2'}]
-
-                builtItem['raster'] = {
-                    'functionDataset': {
-                        'rasterFunction': "DataCube_MS_Composite.rft.xml",
-                        'rasterFunctionArguments': {
-                            'Raster1': NRT01,
-                            'Raster1_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster2': NRT02,
-                            'Raster2_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster3': NRT03,
-                            'Raster3_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster4': NRT04,
-                            'Raster4_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster5': NRT05,
-                            'Raster5_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster6': NRT06,
-                            'Raster6_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY}}}}
-
-            elif (itemURI['tag'] == "DataCube_L8_MS_QA"):
-                bandProperties = [{'bandName': 'blue'},
-                                  {'bandName': 'green'},
-                                  {'bandName': 'red'},
-                                  {'bandName': 'nir'},
-                                  {'bandName': 'swir1'},
-                                  {'bandName': 'swir2'},
-                                  {'bandName': 'aerosol_qa'},
-                                  {'bandName': 'coastal_aerosol'},
-                                  {'bandName': 'pixel_qa'},
-                                  {'bandName': 'radsat_qa'}]
-
-                builtItem['raster'] = {
-                    'functionDataset': {
-                        'rasterFunction': "DataCube_MS_QA_Composite.rft.xml",
-                        'rasterFunctionArguments': {
-                            'Raster1': NRT01,
-                            'Raster1_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster2': NRT02,
-                            'Raster2_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster3': NRT03,
-                            'Raster3_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster4': NRT04,
-                            'Raster4_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster5': NRT05,
-                            'Raster5_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster6': NRT06,
-                            'Raster6_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster7': NRT07,
-                            'Raster7_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster8': NRT08,
-                            'Raster8_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster9': NRT09,
-                            'Raster9_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster10': NRT10,
-                            'Raster10_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY}}}}
-
-            elif (itemURI['tag'] == "DataCube_L7_MS_QA"):
-                bandProperties = [{'bandName': 'blue'},
-                                  {'bandName': 'green'},
-                                  {'bandName': 'red'},
-                                  {'bandName': 'nir'},
-                                  {'bandName': 'swir1'},
-                                  {'bandName': 'swir2'},
-                                  {'bandName': 'atmos_opacity'},
-                                  {'bandName': 'cloud_qa'},
-                                  {'bandName': 'pixel_qa'},
-                                  {'bandName': 'radsat_qa'}]
-                builtItem['raster'] = {
-                    'functionDataset': {
-                        'rasterFunction': "DataCube_MS_QA_Composite.rft.xml",
-                        'rasterFunctionArguments': {
-                            'Raster1': NRT01,
-                            'Raster1_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster2': NRT02,
-                            'Raster2_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster3': NRT03,
-                            'Raster3_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster4': NRT04,
-                            'Raster4_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster5': NRT05,
-                            'Raster5_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster6': NRT06,
-                            'Raster6_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster7': NRT07,
-                            'Raster7_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster8': NRT08,
-                            'Raster8_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster9': NRT09,
-                            'Raster9_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY},
-                            'Raster10': NRT10,
-                            'Raster10_rasterInfo': {
-                                'pixelType': 6,
-                                'ncols': 3500,
-                                'nRows': 3500,
-                                'nBands': 1,
-                                'spatialReference': srsWKT,
-                                'xMin': minX,
-                                'yMin': minY,
-                                'xMax': maxX,
-                                'yMax': maxY}}}}
+            # Depending upon the tag name in the itemURI build a single item,
+            # or one item for every tag that applies to the scene when the
+            # crawler batched all the tags of the yaml into one uri
+            uriProperties = itemURI.get('uriProperties') or {}
+            if (uriProperties.get('buildAllTags')):
+                tags = self.getApplicableTags(doc, uriProperties['tags'])
+            else:
+                tags = [itemURI['tag']]
 
-# Assemble everything into an outgoing dictionary
+            rasters = [NRT01, NRT02, NRT03, NRT04, NRT05,
+                       NRT06, NRT07, NRT08, NRT09, NRT10]
+            extent = [minX, minY, maxX, maxY]
             cordsList = doc['grid_spatial']['projection']['valid_data']['coordinates']
-            metadata['bandProperties'] = bandProperties
-            builtItem['spatialReference'] = srsWKT
-            builtItem['variables'] = variables
-            builtItem['itemUri'] = itemURI
-            builtItem['keyProperties'] = metadata
-            builtItem['footprint'] = cordsList[0]
             builtItemsList = list()
-            builtItemsList.append(builtItem)
+            for tag in tags:
+                builtItemsList.append(
+                    self.buildItem(
+                        itemURI,
+                        tag,
+                        rasters,
+                        metadata,
+                        srsWKT,
+                        extent,
+                        cordsList[0]))
             return builtItemsList
         except Exception as e:
             raise
         return None
 
+    # returns the tags of a scene which can be built, Landsat8 documents carry
+    # the aerosol_qa band, Landsat7 documents the atmos_opacity band
+    def getApplicableTags(self, doc, tags):
+        if ('aerosol_qa' in doc['image']['bands']):
+            sensorTag = 'DataCube_L8_'
+        else:
+            sensorTag = 'DataCube_L7_'
+        return [tag for tag in tags if tag.startswith(sensorTag)]
+
+    def buildItem(
+            self,
+            itemURI,
+            tag,
+            rasters,
+            metadata,
+            srsWKT,
+            extent,
+            footprint):
+        NRT01, NRT02, NRT03, NRT04, NRT05, NRT06, NRT07, NRT08, NRT09, NRT10 = rasters
+        minX, minY, maxX, maxY = extent
+        metadata = dict(metadata)
+        uriProperties = itemURI.get('uriProperties') or {}
+        if (uriProperties.get('buildAllTags')):
+            # every built item gets a uri of its own, so that rebuilding it
+            # does not build all the tags of the scene again
+            itemURI = dict(itemURI)
+            itemURI['tag'] = tag
+            itemURI['uriProperties'] = dict(uriProperties)
+            del itemURI['uriProperties']['buildAllTags']
+            del itemURI['uriProperties']['tags']
+# DEFINE A DICTIONARY OF VARIABLES
+        variables = {}
+
+# Depending upon the tag name in the itemURI pass the appropriate
+# bandProperties dictionary and RFT
+        builtItem = {}
+        if (tag == "DataCube_L8_MS" or tag
+                == "DataCube_L7_MS"):
+            # NBART
+            bandProperties = [{'bandName': 'blue'},
+                              {'bandName': 'green'},
+                              {'bandName': 'red'},
+                              {'bandName': 'nir'},
+                              {'bandName': 'swir1'},
+                              {'bandName': 'swir2'}]
+
+            builtItem['raster'] = {
+                'functionDataset': {
+                    'rasterFunction': "DataCube_MS_Composite.rft.xml",
+                    'rasterFunctionArguments': {
+                        'Raster1': NRT01,
+                        'Raster1_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster2': NRT02,
+                        'Raster2_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster3': NRT03,
+                        'Raster3_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster4': NRT04,
+                        'Raster4_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster5': NRT05,
+                        'Raster5_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster6': NRT06,
+                        'Raster6_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY}}}}
+
+        elif (tag == "DataCube_L8_MS_QA"):
+            bandProperties = [{'bandName': 'blue'},
+                              {'bandName': 'green'},
+                              {'bandName': 'red'},
+                              {'bandName': 'nir'},
+                              {'bandName': 'swir1'},
+                              {'bandName': 'swir2'},
+                              {'bandName': 'aerosol_qa'},
+                              {'bandName': 'coastal_aerosol'},
+                              {'bandName': 'pixel_qa'},
+                              {'bandName': 'radsat_qa'}]
+
+            builtItem['raster'] = {
+                'functionDataset': {
+                    'rasterFunction': "DataCube_MS_QA_Composite.rft.xml",
+                    'rasterFunctionArguments': {
+                        'Raster1': NRT01,
+                        'Raster1_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster2': NRT02,
+                        'Raster2_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster3': NRT03,
+                        'Raster3_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster4': NRT04,
+                        'Raster4_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster5': NRT05,
+                        'Raster5_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster6': NRT06,
+                        'Raster6_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster7': NRT07,
+                        'Raster7_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster8': NRT08,
+                        'Raster8_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster9': NRT09,
+                        'Raster9_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster10': NRT10,
+                        'Raster10_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY}}}}
+
+        elif (tag == "DataCube_L7_MS_QA"):
+            bandProperties = [{'bandName': 'blue'},
+                              {'bandName': 'green'},
+                              {'bandName': 'red'},
+                              {'bandName': 'nir'},
+                              {'bandName': 'swir1'},
+                              {'bandName': 'swir2'},
+                              {'bandName': 'atmos_opacity'},
+                              {'bandName': 'cloud_qa'},
+                              {'bandName': 'pixel_qa'},
+                              {'bandName': 'radsat_qa'}]
+            builtItem['raster'] = {
+                'functionDataset': {
+                    'rasterFunction': "DataCube_MS_QA_Composite.rft.xml",
+                    'rasterFunctionArguments': {
+                        'Raster1': NRT01,
+                        'Raster1_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster2': NRT02,
+                        'Raster2_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster3': NRT03,
+                        'Raster3_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster4': NRT04,
+                        'Raster4_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster5': NRT05,
+                        'Raster5_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster6': NRT06,
+                        'Raster6_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster7': NRT07,
+                        'Raster7_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster8': NRT08,
+                        'Raster8_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster9': NRT09,
+                        'Raster9_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY},
+                        'Raster10': NRT10,
+                        'Raster10_rasterInfo': {
+                            'pixelType': 6,
+                            'ncols': 3500,
+                            'nRows': 3500,
+                            'nBands': 1,
+                            'spatialReference': srsWKT,
+                            'xMin': minX,
+                            'yMin': minY,
+                            'xMax': maxX,
+                            'yMax': maxY}}}}
+
+# Assemble everything into an outgoing dictionary
+        metadata['bandProperties'] = bandProperties
+        builtItem['spatialReference'] = srsWKT
+        builtItem['variables'] = variables
+        builtItem['itemUri'] = itemURI
+        builtItem['keyProperties'] = metadata
+        builtItem['footprint'] = footprint
+        return builtItem
+
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
 # LandsatDataCube Crawlerclass
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
@@ -1096,6 +2597,15 @@ class LandsatDataCubeCrawler():
 
     def __init__(self, **crawlerProperties):
         self.utils = Utilities()
+        httpSessionPool.configure(crawlerProperties)
+        s3ClientPool.configure(crawlerProperties)
+        documentPrefetcher.configure(crawlerProperties)
+        documentStore.configure(crawlerProperties)
+        projectionCache.configure(crawlerProperties)
+        directoryWalker.configure(crawlerProperties)
+        crawlState.configure(crawlerProperties)
+        fileWatcher.configure(crawlerProperties)
+        crawlShard.configure(crawlerProperties)
         try:
             self.paths = crawlerProperties['paths']
             self.recurse = crawlerProperties['recurse']
@@ -1106,8 +2616,18 @@ class LandsatDataCubeCrawler():
             return None
         if (self.filter is (None or "")):
             self.filter = '*.yaml'
+        # buildAllTags emits a single uri per yaml and lets the builder parse
+        # it once for all of its tags instead of once per tag
+        self.buildAllTags = str(crawlerProperties.get(
+            'buildAllTags', False)).lower() in ('true', '1', 'yes')
         try:
-            self.pathGenerator = self.createGenerator()
+            generator = crawlShard.wrap(self.createGenerator(), self.paths)
+            # only the crawl is read ahead, in watch mode the look-ahead would
+            # hold a delivered scene back until the next one arrives
+            generator = documentPrefetcher.wrap(generator, self.utils.fetchDocument)
+            generator = fileWatcher.wrap(generator, self.paths, self.isMetadata, self.recurse,
+                                         crawlShard.owner(self.paths))
+            self.pathGenerator = crawlState.wrap(generator, self.paths)
         except StopIteration:
             return None
 
@@ -1124,9 +2644,19 @@ class LandsatDataCubeCrawler():
                 "DataCube_L7_MS_QA"]:  # Landsat8 and Landsat7
             yield tag
 
+    # whether a file of a crawled directory is one of the metadata files
+    def isMetadata(self, name):
+        if (self.recurse):
+            return name.endswith(".yaml")
+        return fnmatch.fnmatch(name, self.filter)
+
     def createGenerator(self):
         for path in self.paths:
-            if (path.startswith("http") or (path.startswith("s3"))):
+            if (self.utils.isS3Prefix(path)):
+                for url in self.utils.listS3(path, self.filter, self.recurse):
+                    yield url
+
+            elif (path.startswith("http") or (path.startswith("s3"))):
                 yield path
 
             elif (not os.path.exists(path)):
@@ -1134,11 +2664,8 @@ class LandsatDataCubeCrawler():
 
             elif (os.path.isdir(path)):
                 if (self.recurse):
-                    for root, dirs, files in (os.walk(path)):
-                        for file in (files):
-                            if (file.endswith(".yaml")):
-                                filename = os.path.join(root, file)
-                                yield filename
+                    for filename in directoryWalker.walk(path, self.isMetadata):
+                        yield filename
                 else:
                     filter_to_scan = path + os.path.sep + self.filter
                     for filename in glob.glob(filter_to_scan):
@@ -1176,6 +2703,8 @@ class LandsatDataCubeCrawler():
         return self.getNextUri()
 
     def getNextUri(self):
+        if (self.buildAllTags):
+            return self.getNextBatchedUri()
         try:
             if (self.run == 1):  # the path generator should kick in first (for the very first record) before the tag generator kicks in otherwise the number of URIs generated will be one less than the number of tags.
                 try:
@@ -1197,6 +2726,9 @@ class LandsatDataCubeCrawler():
                 curTag = next(self.tagGenerator)
         except StopIteration:
             return None
+        if (curTag == next(self.createTagGenerator())):
+            # first uri of a scene
+            crawlState.expect(self.curPath, self.createTagGenerator())
         uri = {
             'path': self.curPath,
             'displayName': os.path.basename(self.curPath).partition(".")[0],
@@ -1205,3 +2737,18 @@ class LandsatDataCubeCrawler():
             # 'productName':productName
         }
         return uri
+
+    def getNextBatchedUri(self):
+        try:
+            self.curPath = next(self.pathGenerator)
+        except StopIteration:
+            return None
+        tags = list(self.createTagGenerator())
+        uri = {
+            'path': self.curPath,
+            'displayName': os.path.basename(self.curPath).partition(".")[0],
+            'tag': tags[0],
+            'groupName': os.path.basename(self.curPath).partition(".")[0],
+            'uriProperties': {'buildAllTags': True, 'tags': tags}
+        }
+        return uri
@@ -26,16 +26,52 @@ import os
 import arcpy
 import glob
 import csv
+import fnmatch
+import json
+import re
+import numpy as np
 ##import urllib.request
 import requests
+from requests.packages.urllib3.util.retry import Retry
+import threading
+import time
+import base64
+import datetime
+import sqlite3
+import hashlib
+import heapq
+import math
+import ctypes
+import ctypes.util
+import errno
+import select
+import struct
+import sys
+from collections import OrderedDict, deque
 from osgeo import gdal
 
 try:
     import yaml
     import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
 except ImportError as e:
     raise
 
+# libyaml's C loader is several times faster on the large ODC documents, fall
+# back to the pure python loader when pyyaml was built without libyaml. Both
+# only construct the plain yaml types, documents are never trusted code.
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# python 2 without the futures backport does not prefetch
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+except ImportError:
+    ThreadPoolExecutor = None
+
 
 class DataSourceType():
     File = 1
@@ -259,11 +295,17 @@ class Utilities():
 
     def readYaml(self, path):  # to read the yaml file located locally.
         try:
+            key = os.path.abspath(path)
+            validator = documentStore.localValidator(path)
+            doc = documentStore.get(key, validator)
+            if (doc is not None):
+                return doc
             with open(path, 'r') as q:
                 try:
-                    doc = (yaml.load(q))
+                    doc = yamlExtractor.load(q.read())
                 except yaml.YAMLError as exc:
                     raise
+                documentStore.put(key, validator, doc)
                 return doc
         except BaseException:
             raise
@@ -278,25 +320,85 @@ class Utilities():
 # return doc
 
     # to read the yaml file located on S3 over s3:// protocol
-    def readYamlS3_boto3(self, bucket, path):
-        client = boto3.client('s3')
+    def loadYamlS3_boto3(self, bucket, path):
+        key = 's3://' + bucket + '/' + path
+        cached = documentStore.lookup(key)
         try:
-            page = client.get_object(
-                Bucket=bucket, Key=path, RequestPayer='requester')
-            page = client.get_object(Bucket=bucket, Key=path)
-            doc = (yaml.load(page['Body'].read()))
+            if (cached is not None and cached[0].startswith('etag:')):
+                try:
+                    page = s3ClientPool.getObject(
+                        bucket, path, IfNoneMatch=cached[0][5:])
+                except ClientError as e:
+                    if (e.response['ResponseMetadata'].get(
+                            'HTTPStatusCode') != 304):
+                        raise
+                    documentStore.hit(key)
+                    return cached[1]
+            else:
+                page = s3ClientPool.getObject(bucket, path)
+        except BaseException:
+            documentStore.miss()
+            raise
+        documentStore.miss()
+        try:
+            doc = yamlExtractor.load(page['Body'].read())
         except yaml.YAMLError as exc:
             raise
+        documentStore.put(key, 'etag:' + page['ETag'], doc)
         return doc
 
-    def readYamlS3(self, path):  # to read the yaml file located on S3 over https:// protocol
-        page = requests.get(path, stream=True, timeout=None)
+    def loadYamlS3(self, path):  # to read the yaml file located on S3 over https:// protocol
+        cached = documentStore.lookup(path)
         try:
-            doc = (yaml.load(page.content))
+            page = httpSessionPool.get(
+                path, documentStore.conditionalHeaders(cached))
+        except BaseException:
+            documentStore.miss()
+            raise
+        if (cached is not None and page.status_code == 304):
+            documentStore.hit(path)
+            return cached[1]
+        documentStore.miss()
+        try:
+            doc = yamlExtractor.load(page.content)
         except yaml.YAMLError as exc:
             raise
+        documentStore.put(path, documentStore.httpValidator(page.headers), doc)
+        return doc
+
+    # to read the yaml file located on S3, the crawler may have prefetched it
+    def readYamlS3(self, path):
+        doc = documentPrefetcher.get(path)
+        if (doc is None):
+            doc = self.loadYamlS3(path)
+        return doc
+
+    def readYamlS3_boto3(self, bucket, path):
+        doc = documentPrefetcher.get('s3://' + bucket + '/' + path)
+        if (doc is None):
+            doc = self.loadYamlS3_boto3(bucket, path)
         return doc
 
+    # fetches a remote yaml on one of the prefetcher's threads
+    def fetchDocument(self, path):
+        if (path.startswith("s3")):
+            index = path.find("/", 5)
+            return self.loadYamlS3_boto3(path[5:index], path[index + 1:])
+        return self.loadYamlS3(path)
+
+    # s3://bucket/ and s3://bucket/prefix/ are crawled as a listing, any
+    # other s3:// path is an object
+    def isS3Prefix(self, path):
+        return (path.startswith("s3") and (
+            path.endswith("/") or path.find("/", 5) == -1))
+
+    def listS3(self, path, patterns, recurse):
+        index = path.find("/", 5)
+        if (index == -1):
+            return s3ClientPool.listObjects(path[5:], '', patterns, recurse)
+        return s3ClientPool.listObjects(
+            path[5:index], path[index + 1:], patterns, recurse)
+
     def getProductName(self, path):
         path = os.path.basename(path)
         if (path.startswith('be')):
@@ -333,6 +435,1782 @@ class Utilities():
         return None
 
 
+# Keep-alive sessions for the remote yaml reads, one per scheme and host so
+# that consecutive documents from the same endpoint reuse the pooled
+# connections instead of paying a new TCP/TLS handshake per scene. Requests
+# are bounded by the connect/read timeouts and failed connects or 5xx
+# responses are retried with exponential backoff.
+class HttpSessionPool():
+
+    def __init__(
+            self,
+            poolSize=10,
+            connectTimeout=10.0,
+            readTimeout=60.0,
+            retries=3,
+            backoffFactor=0.5):
+        self.poolSize = poolSize
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.retries = retries
+        self.backoffFactor = backoffFactor
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    # picks the http* settings out of the crawler properties, sessions made
+    # with different settings are dropped
+    def configure(self, properties):
+        settings = (
+            int(properties.get('httpPoolSize', self.poolSize)),
+            float(properties.get('httpConnectTimeout', self.connectTimeout)),
+            float(properties.get('httpReadTimeout', self.readTimeout)),
+            int(properties.get('httpRetries', self.retries)),
+            float(properties.get('httpBackoffFactor', self.backoffFactor)))
+        with self.lock:
+            if (settings == (self.poolSize, self.connectTimeout,
+                             self.readTimeout, self.retries, self.backoffFactor)):
+                return
+            (self.poolSize, self.connectTimeout, self.readTimeout,
+             self.retries, self.backoffFactor) = settings
+            sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    def getSession(self, url):
+        scheme, sep, rest = url.partition('://')
+        key = scheme.lower() + sep + rest.partition('/')[0].lower()
+        with self.lock:
+            session = self.sessions.get(key)
+            if (session is None):
+                retry = Retry(
+                    total=self.retries,
+                    connect=self.retries,
+                    read=self.retries,
+                    status=self.retries,
+                    backoff_factor=self.backoffFactor,
+                    status_forcelist=(500, 502, 503, 504),
+                    raise_on_status=False)
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.poolSize,
+                    max_retries=retry)
+                session = requests.Session()
+                session.mount(key + '/', adapter)
+                self.sessions[key] = session
+            return session
+
+    def get(self, url, headers=None):
+        response = self.getSession(url).get(
+            url, headers=headers, timeout=(self.connectTimeout, self.readTimeout))
+        response.raise_for_status()
+        return response
+
+
+httpSessionPool = HttpSessionPool()
+
+
+# One S3 client per process, shared by the crawler and builder threads.
+# boto3 clients are thread safe but expensive to create (credential and
+# endpoint resolution), so the client is built once with a connection pool
+# sized by s3MaxConnections. Whether a bucket is requester pays is worked
+# out on its first read and remembered, a plain GET that is refused is
+# retried once with RequestPayer. s3RequesterPays forces it either way and
+# s3EndpointUrl points the client at another S3 compatible service.
+class S3ClientPool():
+
+    def __init__(self, maxConnections=10, endpointUrl=None, requesterPays=None):
+        self.maxConnections = maxConnections
+        self.endpointUrl = endpointUrl
+        self.requesterPays = requesterPays
+        self.client = None
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def configure(self, properties):
+        requesterPays = properties.get('s3RequesterPays', self.requesterPays)
+        if (requesterPays is not None and not isinstance(requesterPays, bool)):
+            requesterPays = str(requesterPays).lower()
+            if (requesterPays in ('true', '1', 'yes')):
+                requesterPays = True
+            elif (requesterPays in ('false', '0', 'no')):
+                requesterPays = False
+            else:
+                requesterPays = None
+        settings = (
+            int(properties.get('s3MaxConnections', self.maxConnections)),
+            properties.get('s3EndpointUrl', self.endpointUrl) or None,
+            requesterPays)
+        with self.lock:
+            if (settings == (self.maxConnections, self.endpointUrl,
+                             self.requesterPays)):
+                return
+            self.maxConnections, self.endpointUrl, self.requesterPays = settings
+            self.client = None
+            self.buckets = {}
+
+    def getClient(self):
+        with self.lock:
+            if (self.client is None):
+                session = boto3.session.Session()
+                self.client = session.client(
+                    's3',
+                    endpoint_url=self.endpointUrl,
+                    config=Config(max_pool_connections=self.maxConnections))
+            return self.client
+
+    def getObject(self, bucket, key, **kwargs):
+        client = self.getClient()
+        requesterPays = self.requesterPays
+        if (requesterPays is None):
+            requesterPays = self.buckets.get(bucket)
+        if (requesterPays is True):
+            return client.get_object(
+                Bucket=bucket, Key=key, RequestPayer='requester', **kwargs)
+        try:
+            page = client.get_object(Bucket=bucket, Key=key, **kwargs)
+        except ClientError as e:
+            if (requesterPays is not None or e.response.get('Error', {}).get(
+                    'Code') not in ('AccessDenied', '403')):
+                raise
+            page = client.get_object(
+                Bucket=bucket, Key=key, RequestPayer='requester', **kwargs)
+            self.buckets[bucket] = True
+            return page
+        self.buckets[bucket] = False
+        return page
+
+    # yields the s3:// urls of the objects below prefix whose names match one
+    # of the ';' separated patterns. ListObjectsV2 pages are only fetched as
+    # the crawler consumes them. Without recursion the listing is limited to
+    # the prefix level, and the literal start of a single pattern is sent as
+    # part of the prefix so that the server does the filtering.
+    def listObjects(self, bucket, prefix, patterns, recurse):
+        patterns = [pattern.strip() for pattern in patterns.split(';') if pattern.strip()]
+        arguments = {'Bucket': bucket, 'Prefix': prefix}
+        if (not recurse):
+            arguments['Delimiter'] = '/'
+            if (len(patterns) == 1):
+                arguments['Prefix'] = prefix + re.split(r'[*?\[]', patterns[0], maxsplit=1)[0]
+        requesterPays = self.requesterPays
+        if (requesterPays is None):
+            requesterPays = self.buckets.get(bucket)
+        if (requesterPays is True):
+            arguments['RequestPayer'] = 'requester'
+        paginator = self.getClient().get_paginator('list_objects_v2')
+        pages = iter(paginator.paginate(**arguments))
+        try:
+            page = next(pages, None)
+        except ClientError as e:
+            if (requesterPays is not None or e.response.get('Error', {}).get(
+                    'Code') not in ('AccessDenied', '403')):
+                raise
+            arguments['RequestPayer'] = 'requester'
+            pages = iter(paginator.paginate(**arguments))
+            page = next(pages, None)
+            self.buckets[bucket] = True
+        while (page is not None):
+            for item in page.get('Contents', []):
+                name = item['Key'].rpartition('/')[2]
+                for pattern in patterns:
+                    if (fnmatch.fnmatchcase(name, pattern)):
+                        yield 's3://' + bucket + '/' + item['Key']
+                        break
+            page = next(pages, None)
+
+
+s3ClientPool = S3ClientPool()
+
+
+# Optional look-ahead for remote scenes (crawler property prefetch=N). The
+# crawler's path generator is wrapped so that the yaml of the next N http/s3
+# paths is fetched on a small thread pool (prefetchThreads) while the
+# current scene is built. Paths still reach the builder one at a time and in
+# crawl order, readYamlS3/readYamlS3_boto3 pick up the fetched documents.
+# The generator only reads ahead as far as the crawler is pulled and the
+# fetched documents waiting for the builder are bounded, the oldest are
+# dropped and simply read again if they are still needed.
+class DocumentPrefetcher():
+
+    def __init__(self, lookAhead=0, threads=4):
+        self.lookAhead = lookAhead
+        self.threads = threads
+        self.executor = None
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    def configure(self, properties):
+        lookAhead = int(properties.get('prefetch', self.lookAhead) or 0)
+        threads = max(1, int(properties.get('prefetchThreads', self.threads) or 1))
+        if (ThreadPoolExecutor is None):
+            lookAhead = 0
+        with self.lock:
+            self.lookAhead = lookAhead
+            if (threads != self.threads and self.executor is not None):
+                self.executor.shutdown(wait=False)
+                self.executor = None
+            self.threads = threads
+
+    def wrap(self, paths, loader):
+        if (self.lookAhead <= 0):
+            return paths
+        return self.prefetch(paths, loader)
+
+    def prefetch(self, paths, loader):
+        window = deque()
+        paths = iter(paths)
+        exhausted = False
+        while (True):
+            while (not exhausted and len(window) <= self.lookAhead):
+                try:
+                    path = next(paths)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if (path.startswith("http") or path.startswith("s3")):
+                    self.submit(path, loader)
+                window.append(path)
+            if (not window):
+                return
+            yield window.popleft()
+
+    def submit(self, path, loader):
+        with self.lock:
+            if (path in self.pending):
+                return
+            if (self.executor is None):
+                self.executor = ThreadPoolExecutor(max_workers=self.threads)
+            self.pending[path] = self.executor.submit(loader, path)
+            while (len(self.pending) > 2 * self.lookAhead):
+                oldPath, oldFuture = self.pending.popitem(last=False)
+                oldFuture.cancel()
+
+    # returns the prefetched document of path, waiting for it if the fetch is
+    # still running. None when the path was not prefetched or the fetch
+    # failed, the caller then reads it itself and gets the error first hand.
+    # The document is handed out once, the entry is dropped as it is taken so
+    # that pending only holds the fetches still ahead of the builder.
+    def get(self, path):
+        with self.lock:
+            future = self.pending.get(path)
+        if (future is None):
+            return None
+        try:
+            return future.result()
+        except BaseException:
+            return None
+        finally:
+            with self.lock:
+                if (self.pending.get(path) is future):
+                    del self.pending[path]
+
+
+documentPrefetcher = DocumentPrefetcher()
+
+
+# Fixed UTC offset of a timestamp read back from the document cache, for
+# python 2, which has no datetime.timezone.
+class FixedOffset(datetime.tzinfo):
+
+    def __init__(self, offset):
+        self.offset = offset
+
+    def utcoffset(self, dt):
+        return self.offset
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        seconds = self.offset.days * 86400 + self.offset.seconds
+        sign = '-' if seconds < 0 else '+'
+        return 'UTC%s%02d:%02d' % (sign, abs(seconds) // 3600, abs(seconds) % 3600 // 60)
+
+
+fixedOffset = getattr(datetime, 'timezone', FixedOffset)
+
+
+# Opt-in persistent cache of parsed yaml documents, enabled with the crawler
+# property documentCache=<sqlite file> and capped by documentCacheSize (MB).
+# Entries are keyed by path or url and carry a validator: mtime and size for
+# local files, the ETag or Last-Modified of remote ones. Local entries are
+# used while the file is unchanged, remote ones when the conditional request
+# comes back 304, so re-indexing an unchanged archive does not download or
+# parse any document again. Least recently used entries go first once the
+# cap is exceeded.
+# Documents are stored as json, never pickled, as the cache file may be
+# writable by others than the ingest host. The values json has no type for
+# (timestamps, binary, non-string keys) are written as tagged objects.
+class DocumentStore():
+
+    TAGS = ('__datetime__', '__date__', '__bytes__', '__set__', '__items__')
+
+    def __init__(self, maxBytes=512 * 1024 * 1024, touchBatch=256):
+        self.path = None
+        self.maxBytes = maxBytes
+        self.touchBatch = touchBatch
+        self.connection = None
+        self.lock = threading.Lock()
+        self.touched = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, properties):
+        size = properties.get('documentCacheSize')
+        if (size):
+            self.maxBytes = int(float(size) * 1024 * 1024)
+        path = properties.get('documentCache')
+        if (path and path != self.path):
+            self.open(path)
+
+    def open(self, path):
+        connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY, '
+            'validator TEXT, size INTEGER, accessed REAL, doc BLOB)')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS documents_accessed ON documents (accessed)')
+        connection.commit()
+        with self.lock:
+            if (self.connection is not None):
+                self.flush()
+                self.connection.commit()
+                self.connection.close()
+            self.connection = connection
+            self.path = path
+            self.touched = {}
+
+    def localValidator(self, path):
+        stat = os.stat(path)
+        return 'stat:%r:%d' % (stat.st_mtime, stat.st_size)
+
+    def httpValidator(self, headers):
+        if (headers.get('ETag')):
+            return 'etag:' + headers['ETag']
+        if (headers.get('Last-Modified')):
+            return 'modified:' + headers['Last-Modified']
+        return None
+
+    def conditionalHeaders(self, entry):
+        if (entry is None):
+            return None
+        if (entry[0].startswith('etag:')):
+            return {'If-None-Match': entry[0][5:]}
+        if (entry[0].startswith('modified:')):
+            return {'If-Modified-Since': entry[0][9:]}
+        return None
+
+    def encode(self, value):
+        if (isinstance(value, dict)):
+            if (all(isinstance(key, str) and key not in self.TAGS for key in value)):
+                return dict((key, self.encode(item)) for key, item in value.items())
+            return {'__items__': [[self.encode(key), self.encode(item)]
+                                  for key, item in value.items()]}
+        if (isinstance(value, list)):
+            return [self.encode(item) for item in value]
+        if (isinstance(value, datetime.datetime)):
+            offset = value.utcoffset()
+            return {'__datetime__': [
+                value.year, value.month, value.day, value.hour, value.minute,
+                value.second, value.microsecond,
+                None if offset is None else offset.days * 86400 + offset.seconds]}
+        if (isinstance(value, datetime.date)):
+            return {'__date__': [value.year, value.month, value.day]}
+        if (isinstance(value, bytes)):
+            return {'__bytes__': base64.b64encode(value).decode('ascii')}
+        if (isinstance(value, (set, frozenset))):
+            return {'__set__': [self.encode(item) for item in value]}
+        return value
+
+    def decodeObject(self, value):
+        if (len(value) != 1):
+            return value
+        tag, item = next(iter(value.items()))
+        if (tag == '__datetime__'):
+            tzinfo = None
+            if (item[7] is not None):
+                tzinfo = fixedOffset(datetime.timedelta(seconds=item[7]))
+            return datetime.datetime(*item[:7], tzinfo=tzinfo)
+        if (tag == '__date__'):
+            return datetime.date(*item)
+        if (tag == '__bytes__'):
+            return base64.b64decode(item)
+        if (tag == '__set__'):
+            return set(item)
+        if (tag == '__items__'):
+            return dict((key, element) for key, element in item)
+        return value
+
+    def dumps(self, doc):
+        return json.dumps(self.encode(doc), separators=(',', ':')).encode('utf-8')
+
+    def loads(self, blob):
+        return json.loads(bytes(blob).decode('utf-8'), object_hook=self.decodeObject)
+
+    # returns (validator, doc) of the cached entry or None
+    def lookup(self, key):
+        with self.lock:
+            if (self.connection is None):
+                return None
+            row = self.connection.execute(
+                'SELECT validator, doc FROM documents WHERE key = ?',
+                (key,)).fetchone()
+        if (row is None):
+            return None
+        try:
+            return row[0], self.loads(row[1])
+        except ValueError:
+            # written by an older version, it is replaced on the next put
+            return None
+
+    # returns the cached document when it is still valid
+    def get(self, key, validator):
+        entry = self.lookup(key)
+        if (entry is None or entry[0] != validator):
+            self.miss()
+            return None
+        self.hit(key)
+        return entry[1]
+
+    # the access times are written in batches, not with a commit per hit
+    def hit(self, key):
+        with self.lock:
+            self.hits += 1
+            self.touched[key] = time.time()
+            if (len(self.touched) >= self.touchBatch):
+                self.flush()
+                self.connection.commit()
+
+    def miss(self):
+        with self.lock:
+            if (self.connection is not None):
+                self.misses += 1
+
+    # writes the pending access times, the caller holds the lock and commits
+    def flush(self):
+        if (self.touched):
+            self.connection.executemany(
+                'UPDATE documents SET accessed = ? WHERE key = ?',
+                [(accessed, key) for key, accessed in self.touched.items()])
+            self.touched = {}
+
+    def put(self, key, validator, doc):
+        if (self.connection is None or validator is None):
+            return
+        blob = self.dumps(doc)
+        if (len(blob) > self.maxBytes):
+            return
+        with self.lock:
+            self.flush()
+            self.connection.execute(
+                'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)',
+                (key, validator, len(blob), time.time(), sqlite3.Binary(blob)))
+            total = self.connection.execute(
+                'SELECT SUM(size) FROM documents').fetchone()[0] or 0
+            while (total > self.maxBytes):
+                oldKey, oldSize = self.connection.execute(
+                    'SELECT key, size FROM documents ORDER BY accessed LIMIT 1').fetchone()
+                self.connection.execute(
+                    'DELETE FROM documents WHERE key = ?', (oldKey,))
+                total -= oldSize
+                self.evictions += 1
+            self.connection.commit()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+documentStore = DocumentStore()
+
+
+# Pulls only the declared key paths out of a yaml document. It works on the
+# parser's event stream, so subtrees that no builder reads (mostly the scene
+# lineage) are skipped instead of being composed and constructed. Paths are
+# dotted keys and '*' matches any key of a mapping. A path selects the whole
+# subtree below it, and a path into a sequence applies to each of its items.
+# The result has the layout of the full document restricted to those paths,
+# with the same values the safe loader constructs.
+class YamlExtractor():
+
+    STR_TAG = 'tag:yaml.org,2002:str'
+
+    def __init__(self, fields):
+        self.fields = {}
+        for field in fields:
+            node = self.fields
+            keys = field.split('.')
+            for key in keys[:-1]:
+                if (node.get(key, {}) is None):
+                    break
+                node = node.setdefault(key, {})
+            else:
+                node[keys[-1]] = None
+        self.resolver = yaml.resolver.Resolver()
+        self.constructor = yaml.constructor.SafeConstructor()
+
+    def load(self, data):
+        try:
+            return self.extract(data)
+        except yaml.constructor.ConstructorError:
+            # tags, merge keys or aliases into skipped subtrees, let the
+            # loader construct the whole document
+            return yaml.load(data, Loader=YamlLoader)
+
+    # the anchors of a document are local to the call, the prefetcher threads
+    # share the extractor
+    def extract(self, data):
+        events = yaml.parse(data, Loader=YamlLoader)
+        for event in events:
+            if (isinstance(event, yaml.DocumentStartEvent)):
+                return self.select(events, next(events), self.fields, {})
+        return None
+
+    def select(self, events, event, fields, anchors):
+        if (fields is None or not isinstance(
+                event, (yaml.MappingStartEvent, yaml.SequenceStartEvent))):
+            return self.construct(events, event, anchors)
+        self.checkTag(event)
+        if (isinstance(event, yaml.SequenceStartEvent)):
+            value = []
+            event = next(events)
+            while (not isinstance(event, yaml.SequenceEndEvent)):
+                value.append(self.select(events, event, fields, anchors))
+                event = next(events)
+            return value
+        value = {}
+        wildcard = fields.get('*', False)
+        event = next(events)
+        while (not isinstance(event, yaml.MappingEndEvent)):
+            key = self.construct(events, event, anchors)
+            child = fields.get(key, wildcard)
+            if (child is False):
+                self.skip(events, next(events))
+            else:
+                value[key] = self.select(events, next(events), child, anchors)
+            event = next(events)
+        return value
+
+    def construct(self, events, event, anchors):
+        if (isinstance(event, yaml.ScalarEvent)):
+            value = self.constructScalar(event)
+        elif (isinstance(event, yaml.AliasEvent)):
+            if (event.anchor not in anchors):
+                raise yaml.constructor.ConstructorError(
+                    None, None, "alias %r into a skipped subtree" % event.anchor,
+                    event.start_mark)
+            return anchors[event.anchor]
+        elif (isinstance(event, yaml.SequenceStartEvent)):
+            self.checkTag(event)
+            value = []
+            if (event.anchor is not None):
+                anchors[event.anchor] = value
+            event = next(events)
+            while (not isinstance(event, yaml.SequenceEndEvent)):
+                value.append(self.construct(events, event, anchors))
+                event = next(events)
+            return value
+        else:
+            self.checkTag(event)
+            value = {}
+            if (event.anchor is not None):
+                anchors[event.anchor] = value
+            event = next(events)
+            while (not isinstance(event, yaml.MappingEndEvent)):
+                key = self.construct(events, event, anchors)
+                if (key == '<<'):
+                    raise yaml.constructor.ConstructorError(
+                        None, None, "merge key", event.start_mark)
+                value[key] = self.construct(events, next(events), anchors)
+                event = next(events)
+            return value
+        if (event.anchor is not None):
+            anchors[event.anchor] = value
+        return value
+
+    def constructScalar(self, event):
+        tag = event.tag
+        if (tag is None or tag == '!'):
+            if (not event.implicit[0]):
+                # quoted scalars are always strings
+                return event.value
+            tag = self.resolver.resolve(yaml.ScalarNode, event.value, event.implicit)
+        if (tag == self.STR_TAG):
+            return event.value
+        if (tag not in self.constructor.yaml_constructors):
+            raise yaml.constructor.ConstructorError(
+                None, None, "unsupported tag %r" % tag, event.start_mark)
+        return self.constructor.yaml_constructors[tag](
+            self.constructor, yaml.ScalarNode(tag, event.value, style=event.style))
+
+    def checkTag(self, event):
+        if (event.tag is not None and event.tag != '!' and event.tag not in (
+                'tag:yaml.org,2002:map', 'tag:yaml.org,2002:seq')):
+            raise yaml.constructor.ConstructorError(
+                None, None, "unsupported tag %r" % event.tag, event.start_mark)
+
+    def skip(self, events, event):
+        depth = 0
+        while (True):
+            if (isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent))):
+                depth += 1
+            elif (isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent))):
+                depth -= 1
+            if (depth == 0):
+                return
+            event = next(events)
+
+# the parts of the yaml documents read by the crawler and builder
+yamlExtractor = YamlExtractor([
+    'id',
+    'product_type',
+    'processing_level',
+    'platform',
+    'instrument',
+    'extent.center_dt',
+    'grid_spatial.projection',
+    'image.bands.*.path'])
+
+
+# arcpy.SpatialReference(...).exportToString() keyed by EPSG code. An archive
+# only uses a handful of codes, so each one is exported once per session
+# instead of once per item. The cache is seeded from a projections.json
+# bundled next to this raster type when there is one, and from the file
+# named by the crawler property projectionCache. New codes are written back
+# to that file, so later sessions start with them (copy it next to the
+# raster type to bundle it).
+class ProjectionCache():
+
+    def __init__(self, seedPath=None):
+        self.strings = {}
+        self.path = None
+        self.lock = threading.Lock()
+        if (seedPath is not None):
+            self.load(seedPath)
+
+    def configure(self, properties):
+        path = properties.get('projectionCache')
+        if (path and path != self.path):
+            self.load(path)
+            self.path = path
+
+    def load(self, path):
+        if (not os.path.exists(path)):
+            return
+        try:
+            with open(path, 'r') as f:
+                strings = json.load(f)
+        except (IOError, ValueError):
+            return
+        with self.lock:
+            for code, text in strings.items():
+                self.strings.setdefault(int(code), text)
+
+    def get(self, spatialId):
+        spatialId = int(spatialId)
+        with self.lock:
+            text = self.strings.get(spatialId)
+        if (text is None):
+            text = arcpy.SpatialReference(spatialId).exportToString()
+            with self.lock:
+                self.strings[spatialId] = text
+            self.save()
+        return text
+
+    def save(self):
+        if (self.path is None):
+            return
+        with self.lock:
+            strings = dict((str(code), text)
+                           for code, text in self.strings.items())
+        temp = self.path + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(strings, f, indent=1, sort_keys=True)
+            if (os.path.exists(self.path)):
+                os.remove(self.path)
+            os.rename(temp, self.path)
+        except (IOError, OSError):
+            # another session may be writing it, the codes are exported
+            # again next time
+            pass
+
+
+projectionCache = ProjectionCache(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'projections.json'))
+
+
+# The edges of a ring held as a linked list (x, y and after, the next vertex,
+# by vertex) in a uniform grid, each edge, named by its first vertex, in the
+# cells its bounding box covers. build sets the cell size to the mean length
+# of the edges, the owner calls it again as the ring shrinks. Edges
+# covering more than longCells cells are kept apart and always returned, so
+# that one long edge does not fill the grid.
+class EdgeGrid():
+
+    def __init__(self, x, y, after, longCells=64):
+        self.x = x
+        self.y = y
+        self.after = after
+        self.longCells = longCells
+        self.size = 0
+        self.cells = {}
+        self.spans = {}
+        self.long = set()
+
+    def build(self, vertices):
+        vertices = list(vertices)
+        self.left = min(self.x[vertex] for vertex in vertices)
+        self.bottom = min(self.y[vertex] for vertex in vertices)
+        self.size = len(vertices)
+        # cells of the mean edge length, a footprint's vertices lie along its
+        # outline and not all over its bounding box
+        self.cell = sum(math.hypot(self.x[self.after[vertex]] - self.x[vertex],
+                                   self.y[self.after[vertex]] - self.y[vertex])
+                        for vertex in vertices) / self.size or 1.0
+        self.cells = {}
+        self.spans = {}
+        self.long = set()
+        for vertex in vertices:
+            self.add(vertex)
+
+    # the cells covered by a box, as column and row ranges
+    def span(self, left, bottom, right, top):
+        return (int(math.floor((left - self.left) / self.cell)),
+                int(math.floor((right - self.left) / self.cell)),
+                int(math.floor((bottom - self.bottom) / self.cell)),
+                int(math.floor((top - self.bottom) / self.cell)))
+
+    def cellCount(self, span):
+        return (span[1] - span[0] + 1) * (span[3] - span[2] + 1)
+
+    def add(self, edge):
+        end = self.after[edge]
+        span = self.span(min(self.x[edge], self.x[end]), min(self.y[edge], self.y[end]),
+                         max(self.x[edge], self.x[end]), max(self.y[edge], self.y[end]))
+        self.spans[edge] = span
+        if (self.cellCount(span) > self.longCells):
+            self.long.add(edge)
+            return
+        for column in range(span[0], span[1] + 1):
+            for row in range(span[2], span[3] + 1):
+                self.cells.setdefault((column, row), set()).add(edge)
+
+    def remove(self, edge):
+        span = self.spans.pop(edge)
+        if (edge in self.long):
+            self.long.discard(edge)
+            return
+        for column in range(span[0], span[1] + 1):
+            for row in range(span[2], span[3] + 1):
+                self.cells[(column, row)].discard(edge)
+
+    # the edges in the cells a box covers, a superset of those meeting it
+    def near(self, left, bottom, right, top):
+        span = self.span(left, bottom, right, top)
+        if (self.cellCount(span) > len(self.spans)):
+            return set(self.spans)
+        found = set(self.long)
+        for column in range(span[0], span[1] + 1):
+            for row in range(span[2], span[3] + 1):
+                cell = self.cells.get((column, row))
+                if (cell):
+                    found |= cell
+        return found
+
+
+# valid_data rings handled as NumPy arrays. The coordinates of a ring are
+# converted in one go instead of one arcpy.Point per vertex, and the arcpy
+# geometry is created once, from Esri JSON, for the final rings.
+class FootprintProcessor():
+
+    def __init__(self):
+        self.tolerance = None
+        self.maxVertices = None
+        self.lock = threading.Lock()
+        self.items = 0
+        self.vertices = 0
+        self.simplifiedVertices = 0
+
+    # a valid_data ring ([[x, y], ...]) as an (n, 2) array
+    def parseRing(self, coordinates):
+        return np.asarray(coordinates, dtype=float).reshape(-1, 2)
+
+    # twice the signed area of a ring, positive when it runs counter-clockwise
+    def signedArea(self, ring):
+        x = ring[:, 0]
+        y = ring[:, 1]
+        return np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))
+
+    # the ring closed and running clockwise, as Esri exterior rings do
+    # (geojson exterior rings run counter-clockwise)
+    def exteriorRing(self, ring):
+        if (len(ring) and (ring[0] != ring[-1]).any()):
+            ring = np.vstack((ring, ring[:1]))
+        if (self.signedArea(ring) > 0):
+            ring = ring[::-1]
+        return ring
+
+    # Optional simplification of the footprints, set by the crawler
+    # properties footprintTolerance (how far the outline may move, in the
+    # units of the footprint's coordinate system) and footprintMaxVertices.
+    # Either one enables it, with both the tolerance is never exceeded even
+    # when the vertex budget is not met.
+    def configure(self, properties):
+        tolerance = properties.get('footprintTolerance')
+        maxVertices = properties.get('footprintMaxVertices')
+        self.tolerance = float(tolerance) if (tolerance) else None
+        self.maxVertices = max(int(maxVertices), 3) if (maxVertices) else None
+
+    def enabled(self):
+        return (self.tolerance is not None or self.maxVertices is not None)
+
+    # Simplifies an exterior ring (closed, clockwise) and returns it together
+    # with its stats. The outline is only ever moved outwards, so the result
+    # covers the original: concave vertices are removed, which adds the
+    # triangle they cut off, and once none are left pairs of convex vertices
+    # b, c are replaced by the point p where their outer edges meet. A change
+    # is only made when the added triangle holds no other vertex of the ring
+    # and no edge of the ring crosses its new edges, which keeps the ring from
+    # crossing itself. The deviation is bounded both ways: the distance from
+    # the original vertices to the new edges, and error, for each edge, the
+    # farthest any of its points can be from the original outline. That is
+    # the deviation of the edge for the edges between original vertices, and
+    # grows by the distance of p from the edge b-c for the edges through p.
+    def simplify(self, ring):
+        original = ring[:-1]
+        count = len(original)
+        points = original
+        index = np.arange(count)
+        error = np.zeros(count)
+        tolerance = self.tolerance if (self.tolerance is not None) else np.inf
+        budget = self.maxVertices if (self.maxVertices is not None) else 3
+
+        # concave vertices go in passes, every other one of a run per pass
+        # so that the edges around a removed vertex stay as they were
+        parity = 0
+        idle = 0
+        while (len(points) > budget and idle < 2):
+            before = np.roll(points, 1, axis=0)
+            after = np.roll(points, -1, axis=0)
+            concave = self.cross(before, points, after) >= 0
+            concave[1 - parity::2] = False
+            if (len(points) % 2):
+                concave[-1] = False
+            candidates = np.flatnonzero(concave)
+            if (len(candidates)):
+                deviation = self.spanDeviation(
+                    original, index[candidates - 1],
+                    index[(candidates + 1) % len(points)],
+                    before[candidates], after[candidates])
+                candidates = candidates[deviation <= tolerance]
+                deviation = deviation[deviation <= tolerance]
+                excess = len(points) - budget
+                if (self.maxVertices is not None and len(candidates) > excess):
+                    order = np.argsort(deviation, kind='mergesort')[:excess]
+                    candidates = candidates[order]
+                    deviation = deviation[order]
+                empty = self.emptyTriangles(
+                    points, candidates - 1, candidates,
+                    (candidates + 1) % len(points))
+                candidates = candidates[empty]
+                deviation = deviation[empty]
+            if (len(candidates)):
+                # the edge from a to c replaces the original vertices up to
+                # c, so its error is the deviation
+                error[candidates - 1] = deviation
+                keep = np.ones(len(points), dtype=bool)
+                keep[candidates] = False
+                points = points[keep]
+                index = index[keep]
+                error = error[keep]
+                idle = 0
+            else:
+                idle += 1
+            parity = 1 - parity
+
+        # then convex pairs, the one adding the least area first, until the
+        # vertex budget is met
+        if (self.maxVertices is not None and len(points) > max(budget, 3)):
+            points, index, error = self.collapsePairs(
+                original, points, index, error, tolerance, max(budget, 3))
+
+        simplified = np.vstack((points, points[:1]))
+        stats = {
+            'vertices': count,
+            'simplifiedVertices': len(points),
+            'area': abs(self.signedArea(ring)) / 2.0,
+            'simplifiedArea': abs(self.signedArea(simplified)) / 2.0,
+            'deviation': float(max(error.max(), self.spanDeviation(
+                original, index, np.roll(index, -1), points,
+                np.roll(points, -1, axis=0)).max()))}
+        with self.lock:
+            self.items += 1
+            self.vertices += stats['vertices']
+            self.simplifiedVertices += stats['simplifiedVertices']
+        return simplified, stats
+
+    # z of (b - a) x (c - b), negative where a clockwise ring turns convex
+    def cross(self, a, b, c):
+        return ((b[:, 0] - a[:, 0]) * (c[:, 1] - b[:, 1]) -
+                (b[:, 1] - a[:, 1]) * (c[:, 0] - b[:, 0]))
+
+    # Replaces convex pairs b, c by the point p where the edges from a and to
+    # d meet, the pair adding the least area first, until count vertices are
+    # left. The ring is held as a linked list with a heap of its pairs and a
+    # grid of its edges, so that a merge only recomputes the pairs around p
+    # and tests the new edges against the edges near them. A heap entry is
+    # dropped once its vertex has changed since. A pair whose triangle the
+    # ring gets in the way of is set aside and tried again after other merges,
+    # which may have removed what was in the way.
+    def collapsePairs(self, original, points, index, error, tolerance, count):
+        originalX = original[:, 0].tolist()
+        originalY = original[:, 1].tolist()
+        x = points[:, 0].tolist()
+        y = points[:, 1].tolist()
+        index = index.tolist()
+        error = error.tolist()
+        size = len(x)
+        after = list(range(1, size)) + [0]
+        before = [size - 1] + list(range(size - 1))
+        alive = [True] * size
+        stamp = [0] * size
+        grid = EdgeGrid(x, y, after)
+        grid.build(range(size))
+        heap = []
+
+        def push(b):
+            stamp[b] += 1
+            a = before[b]
+            c = after[b]
+            d = after[c]
+            ux, uy = x[b] - x[a], y[b] - y[a]
+            wx, wy = x[c] - x[d], y[c] - y[d]
+            ex, ey = x[c] - x[b], y[c] - y[b]
+            denominator = ux * wy - uy * wx
+            if (denominator == 0):
+                return
+            t = (ex * wy - ey * wx) / denominator
+            s = (ex * uy - ey * ux) / denominator
+            # the edges from a and to d meet beyond b and c, both convex
+            if (not (t > 0 and s > 0) or ux * ey - uy * ex >= 0 or ex * wy - ey * wx <= 0):
+                return
+            p = (x[b] + t * ux, y[b] + t * uy)
+            area = abs(self.turn((x[b], y[b]), p, (x[c], y[c])))
+            heapq.heappush(heap, (area, b, stamp[b], p))
+
+        for b in range(size):
+            push(b)
+        blocked = []
+        merged = False
+        while (size > count):
+            if (not heap):
+                if (not blocked or not merged):
+                    break
+                for entry in blocked:
+                    heapq.heappush(heap, entry)
+                blocked = []
+                merged = False
+            entry = heapq.heappop(heap)
+            area, b, mark, p = entry
+            if (not alive[b] or stamp[b] != mark):
+                continue
+            a = before[b]
+            c = after[b]
+            d = after[c]
+            # p takes the place of b, the original vertices up to b stay with
+            # the edge from a and those after it go with the edge to d. The
+            # points of the new edges are within the height of p over the
+            # edge b-c of that edge, or on the edges from a and to d they
+            # extend. a-p extends a-b, so the original vertices of a-b are no
+            # farther from it.
+            height = self.pointDistance(p, (x[b], y[b]), (x[c], y[c]))
+            errorFrom = max(error[a], height + error[b])
+            errorTo = max(error[c], height + error[b])
+            if (max(errorFrom, errorTo) > tolerance):
+                continue
+            if (tolerance < np.inf and self.spanExceeds(
+                    originalX, originalY, index[b], index[d], p, (x[d], y[d]), tolerance)):
+                continue
+            if (self.blocked(grid, x, y, after, a, b, c, p)):
+                blocked.append(entry)
+                continue
+
+            for edge in (a, b, c):
+                grid.remove(edge)
+            x[b], y[b] = p
+            alive[c] = False
+            after[b] = d
+            before[d] = b
+            error[a] = errorFrom
+            error[b] = errorTo
+            grid.add(a)
+            grid.add(b)
+            size -= 1
+            merged = True
+            for vertex in (before[a], a, b, d):
+                push(vertex)
+            if (size * 2 <= grid.size):
+                grid.build([vertex for vertex in range(len(x)) if (alive[vertex])])
+
+        # back to arrays, in the order of the ring as it was
+        first = alive.index(True)
+        order = [first]
+        while (after[order[-1]] != first):
+            order.append(after[order[-1]])
+        return (np.column_stack((np.take(x, order), np.take(y, order))),
+                np.take(index, order), np.take(error, order))
+
+    # whether the ring gets in the way of replacing the convex pair b, c by
+    # p: a vertex other than b and c in the triangle b, p, c, or an edge other
+    # than the three at the pair meeting its new edges from b to p or from p
+    # to c
+    def blocked(self, grid, x, y, after, a, b, c, p):
+        pb = (x[b], y[b])
+        pc = (x[c], y[c])
+        flat = self.turn(pb, p, pc) == 0
+        for edge in grid.near(min(pb[0], p[0], pc[0]), min(pb[1], p[1], pc[1]),
+                              max(pb[0], p[0], pc[0]), max(pb[1], p[1], pc[1])):
+            if (edge == a or edge == b or edge == c):
+                continue
+            start = (x[edge], y[edge])
+            end = (x[after[edge]], y[after[edge]])
+            # a triangle without area adds nothing and holds no vertex
+            if (not flat):
+                sides = (self.turn(pb, p, start), self.turn(p, pc, start),
+                         self.turn(pc, pb, start))
+                if (not (min(sides) < 0 and max(sides) > 0)):
+                    return True
+            if (self.segmentMeets(pb, p, start, end) or self.segmentMeets(p, pc, start, end)):
+                return True
+        return False
+
+    # z of (b - a) x (c - b) for single points
+    def turn(self, a, b, c):
+        return (b[0] - a[0]) * (c[1] - b[1]) - (b[1] - a[1]) * (c[0] - b[0])
+
+    # whether the segment from a to b meets the segment from start to end,
+    # touching included
+    def segmentMeets(self, a, b, start, end):
+        d1 = self.turn(a, b, start)
+        d2 = self.turn(a, b, end)
+        d3 = self.turn(start, end, a)
+        d4 = self.turn(start, end, b)
+        if (d1 * d2 < 0 and d3 * d4 < 0):
+            return True
+        return ((d1 == 0 and self.inBox(a, b, start)) or
+                (d2 == 0 and self.inBox(a, b, end)) or
+                (d3 == 0 and self.inBox(start, end, a)) or
+                (d4 == 0 and self.inBox(start, end, b)))
+
+    # whether an original vertex strictly between the original indices start
+    # and end (along the ring) is farther than tolerance from the segment from
+    # a to b
+    def spanExceeds(self, originalX, originalY, start, end, a, b, tolerance):
+        count = len(originalX)
+        vertex = (start + 1) % count
+        while (vertex != end):
+            if (self.pointDistance((originalX[vertex], originalY[vertex]), a, b) > tolerance):
+                return True
+            vertex = (vertex + 1) % count
+        return False
+
+    # distance from a point to the segment from a to b
+    def pointDistance(self, point, a, b):
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        length = dx * dx + dy * dy
+        along = 0.0
+        if (length > 0):
+            along = min(max(((point[0] - a[0]) * dx + (point[1] - a[1]) * dy) / length, 0.0), 1.0)
+        return math.hypot(point[0] - a[0] - along * dx, point[1] - a[1] - along * dy)
+
+    # whether the point lies in the bounding box of the segment from a to b,
+    # which for a point on its line means on the segment
+    def inBox(self, a, b, point):
+        return (min(a[0], b[0]) <= point[0] <= max(a[0], b[0]) and
+                min(a[1], b[1]) <= point[1] <= max(a[1], b[1]))
+
+    # The original vertices strictly between the original indices start and
+    # end (along the ring) of each span, and the span each one belongs to
+    def spanVertices(self, original, start, end):
+        count = len(original)
+        spans = (end - start) % count - 1
+        spans[spans < 0] += count
+        owner = np.repeat(np.arange(len(start)), spans)
+        offset = np.arange(len(owner)) - np.repeat(np.cumsum(spans) - spans, spans)
+        return owner, original[(start[owner] + 1 + offset) % count]
+
+    def segmentDistance(self, vertices, a, b):
+        segment = b - a
+        relative = vertices - a
+        length = (segment * segment).sum(axis=-1)
+        along = (relative * segment).sum(axis=-1) / np.where(length > 0, length, 1.0)
+        along = np.clip(along, 0.0, 1.0)[..., None]
+        return np.hypot(*(relative - along * segment).T)
+
+    # largest distance from the original vertices of each span to the
+    # segment from a to b that replaces them
+    def spanDeviation(self, original, start, end, a, b):
+        owner, vertices = self.spanVertices(original, start, end)
+        deviation = np.zeros(len(start))
+        np.maximum.at(deviation, owner,
+                      self.segmentDistance(vertices, a[owner], b[owner]))
+        return deviation
+
+    # For each triangle, given by the positions of its corners in points,
+    # whether no other vertex lies inside it or on its edges. Only the
+    # vertices within the x range of a triangle are tested, found by binary
+    # search on the vertices sorted by x, and all the pairs at once.
+    def emptyTriangles(self, points, first, second, third):
+        first = first % len(points)
+        corners = [points[first], points[second], points[third]]
+        order = np.argsort(points[:, 0], kind='mergesort')
+        x = points[order, 0]
+        low = np.searchsorted(x, np.minimum.reduce([c[:, 0] for c in corners]), 'left')
+        high = np.searchsorted(x, np.maximum.reduce([c[:, 0] for c in corners]), 'right')
+        counts = high - low
+        owner = np.repeat(np.arange(len(first)), counts)
+        offset = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        position = order[low[owner] + offset]
+        vertices = points[position]
+        side = []
+        for a, b in ((0, 1), (1, 2), (2, 0)):
+            a = corners[a][owner]
+            b = corners[b][owner]
+            side.append((b[:, 0] - a[:, 0]) * (vertices[:, 1] - a[:, 1]) -
+                        (b[:, 1] - a[:, 1]) * (vertices[:, 0] - a[:, 0]))
+        side = np.array(side)
+        inside = ~((side < 0).any(axis=0) & (side > 0).any(axis=0))
+        inside &= ((position != first[owner]) & (position != second[owner]) &
+                   (position != third[owner]))
+        # a triangle without area adds nothing and cannot be crossed
+        flat = self.cross(corners[0], corners[1], corners[2]) == 0
+        return flat | (np.bincount(owner[inside], minlength=len(first)) == 0)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'items': self.items,
+                'vertices': self.vertices,
+                'simplifiedVertices': self.simplifiedVertices}
+
+    # logs the stats of a simplified footprint
+    def report(self, name, stats):
+        arcpy.AddMessage(
+            "Footprint of {0} simplified from {1} to {2} vertices, area +{3:.2f}%, deviation {4:g}".format(
+                name, stats['vertices'], stats['simplifiedVertices'],
+                (stats['simplifiedArea'] / stats['area'] - 1) * 100 if (stats['area']) else 0,
+                stats['deviation']))
+
+    def polygon(self, rings, spatialReference=None):
+        shape = {'rings': [np.asarray(ring).tolist() for ring in rings]}
+        if (spatialReference is not None):
+            shape['spatialReference'] = {'wkid': spatialReference}
+        return arcpy.AsShape(shape, True)
+
+
+footprintProcessor = FootprintProcessor()
+
+
+# Directory walker for recursive crawls. Directories are listed with
+# os.scandir, whose entries tell files from directories without a stat per
+# entry, and the subdirectories fan out over a small thread pool (crawler
+# property crawlThreads, 1 lists one directory at a time) so that several
+# listings are in flight at once on network shares. Matching files are
+# yielded as each listing comes back, which with more than one thread is in
+# no fixed order across directories. As with os.walk, unreadable
+# directories are skipped and links to directories are not followed.
+class DirectoryWalker():
+
+    def __init__(self):
+        self.threads = 8
+
+    def configure(self, properties):
+        threads = properties.get('crawlThreads')
+        if (threads):
+            self.threads = max(int(threads), 1)
+
+    # the names of the files and of the subdirectories of a directory
+    def scan(self, path):
+        files = []
+        dirs = []
+        try:
+            for entry in os.scandir(path):
+                try:
+                    isDir = entry.is_dir()
+                except OSError:
+                    isDir = False
+                if (not isDir):
+                    files.append(entry.name)
+                elif (not entry.is_symlink()):
+                    dirs.append(entry.name)
+        except OSError:
+            pass
+        return path, files, dirs
+
+    # Paths of the files below top whose name passes match. prune, when
+    # given, is called with the subdirectory names of each directory and
+    # whether a file matched in it, and returns the ones to walk into.
+    def walk(self, top, match, prune=None):
+        # python 2 has no scandir
+        if (not hasattr(os, 'scandir')):
+            for root, dirs, files in os.walk(top):
+                found = [file for file in files if match(file)]
+                if (prune is not None):
+                    dirs[:] = prune(dirs, bool(found))
+                for file in found:
+                    yield os.path.join(root, file)
+            return
+
+        if (self.threads == 1 or ThreadPoolExecutor is None):
+            pending = [top]
+            while (pending):
+                path, files, dirs = self.scan(pending.pop())
+                found = [file for file in files if match(file)]
+                if (prune is not None):
+                    dirs = prune(dirs, bool(found))
+                pending.extend(os.path.join(path, name) for name in reversed(dirs))
+                for file in found:
+                    yield os.path.join(path, file)
+            return
+
+        pending = deque([top])
+        running = set()
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            while (pending or running):
+                while (pending and len(running) < self.threads * 2):
+                    running.add(executor.submit(self.scan, pending.popleft()))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, files, dirs = future.result()
+                    found = [file for file in files if match(file)]
+                    if (prune is not None):
+                        dirs = prune(dirs, bool(found))
+                    pending.extend(os.path.join(path, name) for name in dirs)
+                    for file in found:
+                        yield os.path.join(path, file)
+        finally:
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+directoryWalker = DirectoryWalker()
+
+
+# Opt-in record of the scenes already ingested, enabled with the crawler
+# property crawlState=<sqlite file>. The builder records the path, size,
+# mtime and a sha1 of the content of every local file it builds, and later
+# crawls only pass on the files that are new or have changed since: another
+# size, or another mtime unless the hash shows the content is the same (a
+# copied or touched file). Files that failed to build are not recorded and
+# are tried again, urls are always passed on. With crawlDeletions=<file>, a
+# crawl that runs to the end also appends the recorded files below its
+# directories that are gone to that file, one path per line, and forgets
+# them.
+class CrawlState():
+
+    def __init__(self):
+        self.path = None
+        self.connection = None
+        self.deletionsPath = None
+        self.lock = threading.Lock()
+        self.passed = 0
+        self.skipped = 0
+        self.deleted = 0
+
+    def configure(self, properties):
+        self.deletionsPath = properties.get('crawlDeletions') or None
+        path = properties.get('crawlState')
+        if (path and path != self.path):
+            self.open(path)
+
+    def open(self, path):
+        connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS scenes (key TEXT PRIMARY KEY, '
+            'path TEXT, size INTEGER, mtime REAL, hash TEXT, seen REAL)')
+        connection.commit()
+        with self.lock:
+            if (self.connection is not None):
+                self.connection.close()
+            self.connection = connection
+            self.path = path
+
+    def key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def isLocal(self, path):
+        return '://' not in path
+
+    def contentHash(self, path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # whether the file was built before and has not changed since
+    def unchanged(self, path):
+        key = self.key(path)
+        stat = os.stat(path)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT size, mtime, hash FROM scenes WHERE key = ?',
+                (key,)).fetchone()
+        if (row is None or row[0] != stat.st_size):
+            return False
+        if (row[1] == stat.st_mtime):
+            return True
+        if (self.contentHash(path) != row[2]):
+            return False
+        with self.lock:
+            self.connection.execute(
+                'UPDATE scenes SET mtime = ? WHERE key = ?', (stat.st_mtime, key))
+            self.connection.commit()
+        return True
+
+    def built(self, path):
+        if (self.connection is None or not path or not self.isLocal(path)):
+            return
+        try:
+            stat = os.stat(path)
+            digest = self.contentHash(path)
+        except (IOError, OSError):
+            return
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO scenes VALUES (?, ?, ?, ?, ?, ?)',
+                (self.key(path), path, stat.st_size, stat.st_mtime, digest,
+                 time.time()))
+            self.connection.commit()
+
+    # the crawler's paths without the unchanged files, roots are the paths
+    # the crawl was given
+    def wrap(self, paths, roots):
+        if (self.connection is None):
+            return paths
+        return self.skipUnchanged(paths, roots)
+
+    def skipUnchanged(self, paths, roots):
+        run = time.time()
+        seen = []
+        for path in paths:
+            if (self.isLocal(path)):
+                if (self.deletionsPath is not None):
+                    seen.append((run, self.key(path)))
+                    if (len(seen) >= 1000):
+                        self.markSeen(seen)
+                        seen = []
+                try:
+                    unchanged = self.unchanged(path)
+                except (IOError, OSError):
+                    unchanged = False
+                if (unchanged):
+                    self.skipped += 1
+                    continue
+            self.passed += 1
+            yield path
+        self.markSeen(seen)
+        if (self.deletionsPath is not None):
+            self.reportDeletions(run, roots)
+
+    def markSeen(self, seen):
+        if (not seen):
+            return
+        with self.lock:
+            self.connection.executemany(
+                'UPDATE scenes SET seen = ? WHERE key = ?', seen)
+            self.connection.commit()
+
+    # recorded files below the crawled directories that this crawl did not
+    # come across and that no longer exist
+    def reportDeletions(self, run, roots):
+        prefixes = [self.key(root).rstrip(os.sep) + os.sep
+                    for root in roots if os.path.isdir(root)]
+        if (not prefixes):
+            return
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT key, path FROM scenes WHERE seen IS NULL OR seen < ?',
+                (run,)).fetchall()
+        deleted = [(key, path) for key, path in rows
+                   if any(key.startswith(prefix) for prefix in prefixes) and
+                   not os.path.exists(path)]
+        if (not deleted):
+            return
+        with open(self.deletionsPath, 'a') as f:
+            for key, path in deleted:
+                f.write(path + '\n')
+        with self.lock:
+            self.connection.executemany(
+                'DELETE FROM scenes WHERE key = ?', [(key,) for key, path in deleted])
+            self.connection.commit()
+            self.deleted += len(deleted)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'passed': self.passed,
+                'skipped': self.skipped,
+                'deleted': self.deleted}
+
+
+crawlState = CrawlState()
+
+
+# Watch mode, enabled with the crawler property watch=true. Once the crawl of
+# the paths is done the crawler keeps running and passes on the metadata
+# files delivered below the directories among them, as the crawl of those
+# directories would have found them. A file is passed on once nothing has
+# changed in its directory, or below it, for watchSettle seconds (5 by
+# default), so that a product still being copied is not built half written.
+# The changes are read from inotify on Linux. Elsewhere, on shares whose
+# changes inotify does not see, or with watch=poll, the directories are
+# scanned every watchPoll seconds (10 by default) instead and a file waits
+# a scan longer. watchTimeout=<seconds> ends the crawl after that long
+# without a new file, by default it runs until it is cancelled.
+class FileWatcher():
+
+    def __init__(self):
+        self.mode = None
+        self.settle = 5.0
+        self.poll = 10.0
+        self.timeout = None
+        self.passed = 0
+
+    def configure(self, properties):
+        mode = str(properties.get('watch') or '').lower()
+        if (mode in ('', 'false', 'no', '0')):
+            self.mode = None
+        elif (mode == 'poll'):
+            self.mode = 'poll'
+        else:
+            self.mode = 'auto'
+        self.settle = float(properties.get('watchSettle') or self.settle)
+        self.poll = max(float(properties.get('watchPoll') or self.poll), 0.1)
+        self.timeout = float(properties.get('watchTimeout') or 0) or None
+
+    # the crawler's paths followed by the files delivered later below roots,
+    # match tells the metadata files from the rest by their name and owns,
+    # when given, the ones of this crawler's shard by their path
+    def wrap(self, paths, roots, match, recurse, owns=None):
+        roots = [root for root in roots if os.path.isdir(root)]
+        if (self.mode is None or not roots):
+            return paths
+        return self.follow(paths, roots, match, recurse, owns)
+
+    def open(self, roots, recurse):
+        if (self.mode == 'auto'):
+            try:
+                return InotifySource(roots, recurse)
+            except (OSError, AttributeError) as e:
+                print('Cannot watch with inotify ({}), scanning every {} seconds'.format(
+                    e, self.poll))
+        return PollingSource(roots, recurse, self.poll)
+
+    def signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime)
+
+    def follow(self, paths, roots, match, recurse, owns):
+        # the source is opened first so that no delivery made during the
+        # crawl is missed, the ones the crawl found are not passed on twice
+        source = self.open(roots, recurse)
+        settle = self.settle + source.latency
+        pending = OrderedDict()
+        passed = {}
+        try:
+            for path in paths:
+                passed[path] = self.signature(path)
+                yield path
+
+            last = time.time()
+            while (True):
+                now = time.time()
+                timeout = None
+                if (pending):
+                    oldest = min(activity for directory, activity in pending.values())
+                    timeout = oldest + settle - now
+                if (self.timeout is not None and not pending):
+                    timeout = last + self.timeout - now
+                for directory, name, written in source.events(
+                        None if timeout is None else max(timeout, 0)):
+                    now = time.time()
+                    if (written and match(name)):
+                        delivered = os.path.join(directory, name)
+                        if (owns is None or owns(delivered)):
+                            pending[delivered] = [directory, now]
+                    # any change in a product holds back its metadata file
+                    for product in pending.values():
+                        if (directory == product[0] or directory.startswith(product[0] + os.sep)):
+                            product[1] = now
+
+                now = time.time()
+                for path, (directory, activity) in list(pending.items()):
+                    if (now - activity < settle):
+                        continue
+                    del pending[path]
+                    signature = self.signature(path)
+                    if (signature is None or passed.get(path) == signature):
+                        continue
+                    passed[path] = signature
+                    last = now
+                    self.passed += 1
+                    yield path
+
+                if (self.timeout is not None and not pending and now - last >= self.timeout):
+                    return
+        finally:
+            source.close()
+
+
+# Changes below a set of directories as inotify reports them, Linux only.
+class InotifySource():
+
+    # from sys/inotify.h
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+    EVENTS = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE)
+    WRITES = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    latency = 0.0
+
+    def __init__(self, roots, recurse):
+        if (not sys.platform.startswith('linux')):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if (self.fd < 0):
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.roots = roots
+        self.recurse = recurse
+        self.watches = {}
+        try:
+            for root in roots:
+                self.add(root)
+        except OSError:
+            self.close()
+            raise
+
+    # watches path, and the directories below it when recursing, and returns
+    # the files found in them
+    def add(self, path):
+        found = []
+        pending = [path]
+        while (pending):
+            directory = pending.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.EVENTS)
+            if (wd < 0):
+                error = ctypes.get_errno()
+                if (error == errno.ENOSPC):
+                    raise OSError(error, 'out of inotify watches, see fs.inotify.max_user_watches')
+                continue
+            # a directory moved within the tree keeps its watch
+            self.watches[wd] = directory
+            directory, files, dirs = directoryWalker.scan(directory)
+            found.extend((directory, name) for name in files)
+            if (self.recurse):
+                pending.extend(os.path.join(directory, name) for name in dirs)
+        return found
+
+    # (directory, name, written) of the changes, waiting up to timeout
+    # seconds for the first, or for good when timeout is None
+    def events(self, timeout):
+        if (not select.select([self.fd], [], [], timeout)[0]):
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if (e.errno == errno.EAGAIN):
+                return []
+            raise
+        events = []
+        offset = 0
+        while (offset + 16 <= len(data)):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b'\0'))
+            offset += 16 + length
+            if (mask & self.IN_Q_OVERFLOW):
+                # events were lost, everything is looked at again
+                for root in self.roots:
+                    events.extend((directory, file, True) for directory, file in self.add(root))
+                continue
+            if (mask & self.IN_IGNORED):
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if (directory is None):
+                continue
+            if (mask & self.IN_ISDIR):
+                # a product moved in whole raises no event for its files
+                if (self.recurse and mask & (self.IN_CREATE | self.IN_MOVED_TO)):
+                    try:
+                        found = self.add(os.path.join(directory, name))
+                    except OSError as e:
+                        print('Cannot watch {}: {}'.format(os.path.join(directory, name), e))
+                        found = []
+                    events.extend((path, file, True) for path, file in found)
+                events.append((directory, name, False))
+            else:
+                events.append((directory, name, bool(mask & self.WRITES)))
+        return events
+
+    def close(self):
+        if (self.fd >= 0):
+            os.close(self.fd)
+            self.fd = -1
+
+
+# Changes below a set of directories found by comparing scans made every
+# interval seconds.
+class PollingSource():
+
+    def __init__(self, roots, recurse, interval):
+        self.roots = roots
+        self.recurse = recurse
+        self.interval = interval
+        self.latency = interval
+        self.files = self.scan()
+        self.due = time.time() + interval
+
+    # size and mtime of every file below the roots
+    def scan(self):
+        files = {}
+        for root in self.roots:
+            if (self.recurse):
+                paths = directoryWalker.walk(root, lambda file: True)
+            else:
+                directory, names, dirs = directoryWalker.scan(root)
+                paths = [os.path.join(directory, name) for name in names]
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_size, stat.st_mtime)
+        return files
+
+    def events(self, timeout):
+        wait = self.due - time.time()
+        if (timeout is not None and timeout < wait):
+            time.sleep(timeout)
+            return []
+        if (wait > 0):
+            time.sleep(wait)
+        files = self.scan()
+        self.due = time.time() + self.interval
+        events = []
+        for path, signature in files.items():
+            if (self.files.get(path) != signature):
+                events.append((os.path.dirname(path), os.path.basename(path), True))
+        for path in self.files:
+            if (path not in files):
+                events.append((os.path.dirname(path), os.path.basename(path), False))
+        self.files = files
+        return events
+
+    def close(self):
+        pass
+
+
+fileWatcher = FileWatcher()
+
+
+# Splits a crawl between processes or hosts, enabled with the crawler property
+# shard=k/N: the crawler passes on only the paths of the k-th of N shards, k
+# from 1 to N. A path goes to the shard picked by a stable hash of where it
+# is below the crawled directory it was found in, or of the url or csv entry
+# as written, so that N crawlers of the same paths each get a disjoint part
+# of them without talking to each other, even with the archive mounted at
+# another place on each host. Separators are hashed as '/' for the same
+# reason.
+class CrawlShard():
+
+    def __init__(self):
+        self.index = 0
+        self.count = 1
+
+    def configure(self, properties):
+        shard = properties.get('shard')
+        if (not shard):
+            self.index = 0
+            self.count = 1
+            return
+        try:
+            index, count = [int(part) for part in str(shard).split('/')]
+        except ValueError:
+            raise ValueError('shard must be given as k/N, not {}'.format(shard))
+        if (count < 1 or index < 1 or index > count):
+            raise ValueError('shard {} is not one of 1/{} to {}/{}'.format(
+                shard, count, count, count))
+        self.index = index - 1
+        self.count = count
+
+    # the crawled directories, as the prefixes of the paths found in them
+    def prefixes(self, roots):
+        prefixes = [os.path.abspath(root).rstrip(os.sep) + os.sep
+                    for root in roots if os.path.isdir(root)]
+        return sorted(prefixes, key=len, reverse=True)
+
+    def key(self, path, prefixes):
+        if ('://' not in path):
+            absolute = os.path.abspath(path)
+            for prefix in prefixes:
+                if (absolute.startswith(prefix)):
+                    path = absolute[len(prefix):]
+                    break
+        return path.replace('\\', '/')
+
+    # whether path belongs to this shard, scene maps the key of a path to the
+    # one of the scene it is part of, when several files make up a scene
+    def owns(self, path, prefixes, scene=None):
+        if (self.count == 1):
+            return True
+        key = self.key(path, prefixes)
+        if (scene is not None):
+            key = scene(key)
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % self.count == self.index
+
+    # a function telling whether a path found below roots belongs to this
+    # shard, None when the crawl is not split
+    def owner(self, roots, scene=None):
+        if (self.count == 1):
+            return None
+        prefixes = self.prefixes(roots)
+        return lambda path: self.owns(path, prefixes, scene)
+
+    def wrap(self, paths, roots, scene=None):
+        owns = self.owner(roots, scene)
+        if (owns is None):
+            return paths
+        return (path for path in paths if owns(path))
+
+
+crawlShard = CrawlShard()
+
+
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
 # Geoscience builder class
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
@@ -453,7 +2331,14 @@ class GeoscienceBuilder():
 #            arcpy.AddMessage(str(exp))
             raise Exception(str(exp))
 
+    # records the scene in crawlState once it is built
     def build(self, itemURI):
+        builtItemsList = self.buildItems(itemURI)
+        if (builtItemsList):
+            crawlState.built(itemURI.get('path'))
+        return builtItemsList
+
+    def buildItems(self, itemURI):
      # Make sure that the itemURI dictionary contains items
         if (len(itemURI) <= 0):
             return None
@@ -527,8 +2412,7 @@ class GeoscienceBuilder():
                         spatialRef = doc['grid_spatial']['projection']['spatial_reference']
                         spatialIdx = spatialRef.find(':')
                         spatialId = int(spatialRef[spatialIdx + 1:])
-                        prjString = arcpy.SpatialReference(
-                            spatialId).exportToString()
+                        prjString = projectionCache.get(spatialId)
                         srsEPSG = spatialId
 
                         BE1 = self.embedMRF(
@@ -676,8 +2560,7 @@ class GeoscienceBuilder():
                         spatialRef = doc['grid_spatial']['projection']['spatial_reference']
                         spatialIdx = spatialRef.find(':')
                         spatialId = int(spatialRef[spatialIdx + 1:])
-                        prjString = arcpy.SpatialReference(
-                            spatialId).exportToString()
+                        prjString = projectionCache.get(spatialId)
                         srsEPSG = spatialId
 
                         BE1 = self.embedMRF(
@@ -799,8 +2682,7 @@ class GeoscienceBuilder():
                         spatialRef = doc['grid_spatial']['projection']['spatial_reference']
                         spatialIdx = spatialRef.find(':')
                         spatialId = int(spatialRef[spatialIdx + 1:])
-                        prjString = arcpy.SpatialReference(
-                            spatialId).exportToString()
+                        prjString = projectionCache.get(spatialId)
                         srsEPSG = spatialId
 
                         BE1 = os.path.join(
@@ -900,8 +2782,7 @@ class GeoscienceBuilder():
                     spatialRef = doc['grid_spatial']['projection']['spatial_reference']
                     spatialIdx = spatialRef.find(':')
                     spatialId = int(spatialRef[spatialIdx + 1:])
-                    prjString = arcpy.SpatialReference(
-                        spatialId).exportToString()
+                    prjString = projectionCache.get(spatialId)
                     srsEPSG = spatialId
 
                     if tag == 'fc':
@@ -1120,8 +3001,7 @@ class GeoscienceBuilder():
                     spatialRef = doc['grid_spatial']['projection']['spatial_reference']
                     spatialIdx = spatialRef.find(':')
                     spatialId = int(spatialRef[spatialIdx + 1:])
-                    prjString = arcpy.SpatialReference(
-                        spatialId).exportToString()
+                    prjString = projectionCache.get(spatialId)
                     srsEPSG = spatialId
 
                     if tag == 'fc':
@@ -1329,8 +3209,7 @@ class GeoscienceBuilder():
                     spatialRef = doc['grid_spatial']['projection']['spatial_reference']
                     spatialIdx = spatialRef.find(':')
                     spatialId = int(spatialRef[spatialIdx + 1:])
-                    prjString = arcpy.SpatialReference(
-                        spatialId).exportToString()
+                    prjString = projectionCache.get(spatialId)
                     srsEPSG = spatialId
 
                     if tag == 'fc':
@@ -1412,16 +3291,18 @@ class GeoscienceBuilder():
 
             # wofs_fs does not have a different footprint provided
             if (tag != 'wofs_fs'):
-                vertex_array = arcpy.Array()
                 try:
                     coords = doc['grid_spatial']['projection']['valid_data']['coordinates'][0]
                 except BaseException:
                     coords = None
                 if coords:
-                    for point in coords:
-                        vertex_array.add(arcpy.Point(point[0], point[1]))
-
-                    footprint_geometry = arcpy.Polygon(vertex_array, srsEPSG)
+                    ring = footprintProcessor.exteriorRing(
+                        footprintProcessor.parseRing(coords))
+                    if (footprintProcessor.enabled()):
+                        ring, stats = footprintProcessor.simplify(ring)
+                        footprintProcessor.report(_yamlpath, stats)
+                    footprint_geometry = footprintProcessor.polygon(
+                        [ring], srsEPSG)
 
             # Metadata Information
             metadata = {}
@@ -1786,6 +3667,16 @@ class GeoscienceCrawler():
 
     def __init__(self, **crawlerProperties):
         self.utils = Utilities()
+        httpSessionPool.configure(crawlerProperties)
+        s3ClientPool.configure(crawlerProperties)
+        documentPrefetcher.configure(crawlerProperties)
+        documentStore.configure(crawlerProperties)
+        projectionCache.configure(crawlerProperties)
+        directoryWalker.configure(crawlerProperties)
+        crawlState.configure(crawlerProperties)
+        fileWatcher.configure(crawlerProperties)
+        crawlShard.configure(crawlerProperties)
+        footprintProcessor.configure(crawlerProperties)
         self.paths = crawlerProperties['paths']
         self.recurse = crawlerProperties['recurse']
         self.filter = crawlerProperties['filter']
@@ -1797,14 +3688,30 @@ class GeoscienceCrawler():
             self.filter = '*.yaml'
 
         try:
-            self.pathGenerator = self.createGenerator()
+            generator = crawlShard.wrap(self.createGenerator(), self.paths)
+            # only the crawl is read ahead, in watch mode the look-ahead would
+            # hold a delivered scene back until the next one arrives
+            generator = documentPrefetcher.wrap(generator, self.utils.fetchDocument)
+            generator = fileWatcher.wrap(generator, self.paths, self.isMetadata, self.recurse,
+                                         crawlShard.owner(self.paths))
+            self.pathGenerator = crawlState.wrap(generator, self.paths)
 
         except StopIteration:
             return None
 
+    # whether a file of a crawled directory is one of the metadata files
+    def isMetadata(self, name):
+        if (self.recurse):
+            return name.endswith(".yaml")
+        return fnmatch.fnmatch(name, self.filter)
+
     def createGenerator(self):
         for path in self.paths:
-            if (path.startswith("http") or (path.startswith("s3"))):
+            if (self.utils.isS3Prefix(path)):
+                for url in self.utils.listS3(path, self.filter, self.recurse):
+                    yield url
+
+            elif (path.startswith("http") or (path.startswith("s3"))):
                 yield path
 
             elif (not os.path.exists(path)):
@@ -1812,11 +3719,8 @@ class GeoscienceCrawler():
 
             elif (os.path.isdir(path)):
                 if (self.recurse):
-                    for root, dirs, files in (os.walk(path)):
-                        for file in (files):
-                            if (file.endswith(".yaml")):
-                                filename = os.path.join(root, file)
-                                yield filename
+                    for filename in directoryWalker.walk(path, self.isMetadata):
+                        yield filename
                 else:
                     filter_to_scan = path + os.path.sep + self.filter
                     for filename in glob.glob(filter_to_scan):
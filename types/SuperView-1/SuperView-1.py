@@ -27,13 +27,38 @@ import os
 import arcpy
 import glob
 import csv
+import json
 import math
+import re
+import threading
+import hashlib
+import sqlite3
+import time
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import select
+import struct
+import sys
+from collections import OrderedDict, deque
+
+# python 2 without the futures backport walks directories on one thread
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+except ImportError:
+    ThreadPoolExecutor = None
 
 try:
     import xml.etree.cElementTree as ET
 except ImportError:
     import xml.etree.ElementTree as ET
 
+try:
+    from lxml import etree as lxmlEtree
+except ImportError:
+    lxmlEtree = None
+
 
 class DataSourceType():
     Unknown = 0
@@ -181,62 +206,18 @@ class RasterTypeFactory():
 
 class Utilities():
 
-    # checks if input data is from SuperView
+    # checks if input data is from SuperView, reading the metadata file only up to
+    # its SatelliteID (.xml) or MISSION (.dim) element
     def isSuperView1(self, path):
-        isSV1 = False
-        try:
-            dataFile = open(path)
-        except BaseException:
-            raise #Exception("Data file could not be opened")
-#            return False
-        data = dataFile.read()
-        if '<SatelliteID>SV1' in data:
-            isSV1 = True
-        else:
-            try:
-                tree = ET.parse(path)
-            except ET.ParseError as e:
-                raise
-                #print("Exception while parsing {0}\n{1}".format(path, e))
-#                return None
-
-            mission = tree.find('Dataset_Sources/Scene_Source/MISSION')
-            if mission is not None:
-                if 'SUPERVIEW' in mission.text:
-                    isSV1 = True
-
-        dataFile.close()
-        return isSV1
-
-    def __getTagFromTree(self, tree):
-        # metadata has one parent root with all relevant metadata under it, hence\
-        # taking the root
-        try:
-            root = tree.getroot()
-            nBands = root.find('Bands')
-            if nBands is None:
-                nBands = tree.find('Raster_Dimensions/NBANDS')
-
-            if nBands is not None:
-                numBands = int(nBands.text)
-
-            if numBands == 1:
-                return 'Pan'
-            if numBands >= 3:
-                return 'MS'
-        except BaseException:
-            return None
-        return None
+        return superViewSniffer.match(path)
 
     def getTag(self, path):
-        # get tag by parsing the data tree
-        try:
-            tree = ET.parse(path)
-        except ET.ParseError as e:
-            print("Exception while parsing {0}\n{1}".format(path, e))
+        # get tag from the scene's parsed metadata
+        scene = getScene(path)
+        if scene is None:
             return None
 
-        return self.__getTagFromTree(tree)
+        return scene.tag
 
     def getProductName(self, tree):
          # returns product level- 1B/2A/3A
@@ -252,13 +233,11 @@ class Utilities():
 
     def getProductNameFromFile(self, path):
         # Get product name (level)
-        try:
-            tree = ET.parse(path)
-        except ET.ParseError as e:
-            print("Exception while parsing {0}\n{1}".format(path, e))
+        scene = getScene(path)
+        if scene is None:
             return None
 
-        return self.getProductName(tree)
+        return scene.productName
 
 
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
@@ -277,7 +256,14 @@ class SuperView1Builder():
         # string 'SuperView', if not, the data is not added
         return self.utilities.isSuperView1(datasetPath)
 
+    # records the scene in crawlState once it is built
     def build(self, itemURI):
+        builtItemsList = self.buildItems(itemURI)
+        if builtItemsList:
+            crawlState.built(itemURI.get('path'))
+        return builtItemsList
+
+    def buildItems(self, itemURI):
 
         # constant values for pixel type and stretch based on pixel depth
         maxStretch16 = 2048
@@ -302,7 +288,7 @@ class SuperView1Builder():
             srsWKT = ''
 
             if path.endswith('.xml'):
-                tree = ET.parse(path)
+                tree = sceneCache.get(path).tree
                 root = tree.getroot()
 
                 bands = root.find('Bands')
@@ -527,7 +513,7 @@ class SuperView1Builder():
                 metadata['CloudCover'] = cloudCover
 
             elif path.endswith('.dim'):
-                tree = ET.parse(path)
+                tree = sceneCache.get(path).tree
 
                 srsWKT = 0
                 projectionNode = tree.find(
@@ -590,7 +576,15 @@ class SuperView1Builder():
                 # Band info(part of metadata) - gain, bias etc
                 img_interpretation = tree.find('Image_Interpretation')
                 img_display = tree.find('Image_Display')
-                noOfChildren = len(img_display.getchildren())
+
+                # Band statistics from Image_Display, keyed by band index
+                bandStatistics = {}
+                if img_display is not None:
+                    for child in list(img_display)[2:]:
+                        values = list(child)
+                        bandStatistics[int(values[0].text)] = {
+                            'minimum': float(values[3].text), 'maximum': float(values[4].text),
+                            'mean': float(values[2].text), 'standardDeviation': float(values[1].text)}
 
                 if img_interpretation is not None:
                     for band_info in img_interpretation:
@@ -626,17 +620,8 @@ class SuperView1Builder():
                         if unit is not None:
                             bandProperty['unit'] = unit.text
 
-                        if img_display is not None:
-                            for i in range(2, noOfChildren):
-                                child = img_display.getchildren()[i]
-                                if int(
-                                        child.getchildren()[0].text) == band_num:
-                                    min_ = float(child.getchildren()[3].text)
-                                    max_ = float(child.getchildren()[4].text)
-                                    stdv = float(child.getchildren()[1].text)
-                                    mean = float(child.getchildren()[2].text)
-                                    bandProperty['statistics'] = {
-                                        'minimum': min_, 'maximum': max_, 'mean': mean, 'standardDeviation': stdv}
+                        if band_num in bandStatistics:
+                            bandProperty['statistics'] = bandStatistics[band_num]
 
                         bandProperties.append(bandProperty)
 
@@ -706,53 +691,13 @@ class SuperView1Builder():
                 if cloudCover is not None:
                     metadata['CloudCover'] = cloudCover
 
-         # adding RPC parameters from rpb file available in dataset
-            try:
-                coeffVal = []
-                try:
-                    rpcFileName = os.path.splitext(path)[0] + '.rpb'
-                    #rpcPath = os.path.join(os.path.dirname(path), rpcFileName)
-                    data = open(rpcFileName, 'r')
-                except BaseException:
-                    raise Exception("RPC file could not be opened")
-
-                rpc = data.read()
-                rpc = rpc.replace('\t', '').split('(')
-                metadata['CONSTANTZ'] = (
-                    rpc[0].split('heightOffset = ')[1]).split(";")[0]
-                predata = rpc[0]
-                predata = predata.split('IMAGE')[1].split('lineNumCoef')[0]
-                predata = predata.split(';')
-                predata = [float(val.split('=')[1]) for val in predata[0:-1]]
-
-                lineNumCoef = [float(val)
-                               for val in rpc[1].split(')')[0].split(',')]
-                lineDenCoef = [float(val)
-                               for val in rpc[2].split(')')[0].split(',')]
-                sampNumCoef = [float(val)
-                               for val in rpc[3].split(')')[0].split(',')]
-                sampDenCoef = [float(val)
-                               for val in rpc[4].split(')')[0].split(',')]
-
-                # list of 90 RPC values
-                coeffVal = predata[2:] + lineNumCoef + \
-                    lineDenCoef + sampNumCoef + sampDenCoef
-            except Exception:
-                coeffVal = []
-            RPC = {
-                'GeodataTransforms': [
-                    {
-                        'geodataTransform': 'RPC',
-                        'geodataTransformArguments': {
-                            'coeff': coeffVal
-                        }
-                    }
-                ]
-            }
-            try:
-                geoDataTransform = str(RPC).replace("'", '"')
-            except Exception:
-                geoDataTransform = ''
+            # adding RPC parameters from rpb file available in dataset
+            rpcModel = getRpcModel(os.path.splitext(path)[0] + '.rpb')
+            if rpcModel is not None:
+                metadata['CONSTANTZ'] = rpcModel.heightOffset
+                geoDataTransform = rpcModel.geodataXform
+            else:
+                geoDataTransform = rpcGeodataXform([])
 
             metadata['SensorName'] = self.SensorName
             metadata['bandProperties'] = bandProperties
@@ -803,6 +748,9 @@ class SuperView1Builder():
 
         except BaseException:
             raise
+        finally:
+            if path is not None:
+                sceneCache.release(path)
 
 
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
@@ -814,17 +762,38 @@ class SuperView1Crawler():
 
     def __init__(self, **crawlerProperties):
         self.utils = Utilities()
+        sceneCache.configure(crawlerProperties)
+        xmlBackend.configure(crawlerProperties)
+        directoryWalker.configure(crawlerProperties)
+        productLayout.configure(crawlerProperties)
+        crawlState.configure(crawlerProperties)
+        fileWatcher.configure(crawlerProperties)
+        crawlShard.configure(crawlerProperties)
         self.paths = crawlerProperties['paths']
         self.recurse = crawlerProperties['recurse']
         self.filter = crawlerProperties['filter']
         if not self.filter:
             self.filter = 'SV*.xml;SW*.dim'
         try:
-            self.pathGenerator = self.createGenerator()
+            generator = crawlShard.wrap(self.createGenerator(), self.paths, self.sceneKey)
+            generator = fileWatcher.wrap(generator, self.paths, self.isMetadata, self.recurse,
+                                         crawlShard.owner(self.paths, self.sceneKey))
+            self.pathGenerator = crawlState.wrap(generator, self.paths)
 
         except StopIteration:
             return None
 
+    # whether a file of a crawled directory is one of the metadata files
+    def isMetadata(self, name):
+        fileFilter = list(filter(None, self.filter.split(';')))
+        if self.recurse:
+            return name.endswith(fileFilter[0][1:]) or name.endswith(fileFilter[1][1:])
+        return any(fnmatch.fnmatch(name, pattern) for pattern in fileFilter)
+
+    # the MUX and PAN files of a scene are kept in the same shard
+    def sceneKey(self, key):
+        return key.replace('PAN', 'MUX')
+
     def createGenerator(self):
         fileFilter = self.filter.split(';')
         fileFilter = list(filter(None, fileFilter))
@@ -836,12 +805,8 @@ class SuperView1Crawler():
             # handles paths with different folder levels
             if os.path.isdir(path):
                 if self.recurse:
-                    for root, dirs, files in (os.walk(path)):
-                        for file in (files):
-                            if file.endswith(fileFilter[0][1:]) or file.endswith(
-                                    fileFilter[1][1:]):
-                                filename = os.path.join(root, file)
-                                yield filename
+                    for filename in directoryWalker.walk(path, self.isMetadata, productLayout.pruner()):
+                        yield filename
                 else:
                     for filterToScan in fileFilter:
                         filter_to_scan = path + os.path.sep + filterToScan
@@ -919,3 +884,901 @@ class SuperView1Crawler():
         }
 
         return uri
+
+
+# Parser backend for the metadata files. lxml is used when it is installed, as
+# it parses large documents such as SAFE manifests markedly faster than
+# ElementTree; the crawler property xmlParser=etree|lxml picks one explicitly.
+# The lxml parser drops comments and processing instructions, as ElementTree
+# does, so both backends give the same children. errors holds the parse
+# exceptions of both, and find() evaluates a path on either kind of element,
+# through an XPath compiled once per path for lxml elements.
+class XmlBackend():
+
+    def __init__(self):
+        self.useLxml = lxmlEtree is not None
+        self.errors = (ET.ParseError,)
+        if lxmlEtree is not None:
+            self.errors = (ET.ParseError, lxmlEtree.XMLSyntaxError)
+        self.xpaths = {}
+
+    def configure(self, properties):
+        parser = properties.get('xmlParser')
+        if parser:
+            self.useLxml = parser == 'lxml' and lxmlEtree is not None
+
+    def parse(self, path):
+        if self.useLxml:
+            return lxmlEtree.parse(path, lxmlEtree.XMLParser(
+                remove_comments=True, remove_pis=True))
+        return ET.parse(path)
+
+    def find(self, element, path):
+        if lxmlEtree is None or not isinstance(element, lxmlEtree._Element):
+            return element.find(path)
+        xpath = self.xpaths.get(path)
+        if xpath is None:
+            xpath = self.xpaths[path] = lxmlEtree.XPath(path)
+        result = xpath(element)
+        return result[0] if result else None
+
+
+xmlBackend = XmlBackend()
+
+
+# Parsed scene metadata shared by the crawler and the builder, which both
+# read the same scene file. The cache is bounded by the size on disk of the
+# files it holds (xmlCacheSize crawler property, in MB) rather than by their
+# count, and an entry is only reused while the file's mtime and size are
+# unchanged. The builder releases a scene once the item is built, so
+# the cache only holds scenes that are still in flight. Files that fail to
+# parse are not cached.
+class ElementTreeCache():
+
+    def __init__(self, maxBytes=64 * 1024 * 1024, parse=None):
+        self.maxBytes = maxBytes
+        self.parse = parse if parse is not None else xmlBackend.parse
+        self.trees = OrderedDict()
+        self.totalBytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.releases = 0
+
+    def configure(self, properties):
+        size = properties.get('xmlCacheSize')
+        if size:
+            self.maxBytes = int(float(size) * 1024 * 1024)
+
+    def key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    # returns the parsed file, raises one of xmlBackend.errors on bad XML
+    def get(self, path):
+        key = self.key(path)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime, stat.st_size)
+        with self.lock:
+            entry = self.trees.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.trees.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        tree = self.parse(path)
+
+        with self.lock:
+            self.remove(key)
+            self.trees[key] = (stamp, tree)
+            self.totalBytes += stat.st_size
+            while self.totalBytes > self.maxBytes and len(self.trees) > 1:
+                self.remove(next(iter(self.trees)))
+                self.evictions += 1
+        return tree
+
+    def release(self, path):
+        with self.lock:
+            if self.remove(self.key(path)):
+                self.releases += 1
+
+    # callers hold the lock
+    def remove(self, key):
+        entry = self.trees.pop(key, None)
+        if entry is None:
+            return False
+        self.totalBytes -= entry[0][1]
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'releases': self.releases,
+                'entries': len(self.trees),
+                'bytes': self.totalBytes}
+
+
+# Metadata of one scene, parsed once and shared by the crawler's
+# getTag/getProductNameFromFile and the builder through sceneCache
+class SceneMetadata():
+
+    def __init__(self, path):
+        self.path = path
+        self.tree = xmlBackend.parse(path)
+        self.root = self.tree.getroot()
+        self.tag = self.getTag()
+        self.productName = Utilities().getProductName(self.tree)
+
+    def getTag(self):
+        # metadata has one parent root with all relevant metadata under it, hence\
+        # taking the root
+        try:
+            nBands = self.root.find('Bands')
+            if nBands is None:
+                nBands = self.tree.find('Raster_Dimensions/NBANDS')
+
+            if nBands is not None:
+                numBands = int(nBands.text)
+
+            if numBands == 1:
+                return 'Pan'
+            if numBands >= 3:
+                return 'MS'
+        except BaseException:
+            return None
+        return None
+
+
+sceneCache = ElementTreeCache(parse=SceneMetadata)
+
+
+def getScene(path):
+    try:
+        return sceneCache.get(path)
+    except xmlBackend.errors as e:
+        print("Exception while parsing {0}\n{1}".format(path, e))
+        return None
+
+
+# Decides whether a metadata file belongs to this raster type without parsing
+# all of it. Each rule is an element path from the root, compared by local
+# name so namespace prefixes do not matter, and a predicate on the element's
+# text. The file is fed to a pull parser in small chunks and reading stops at
+# the first element that matches a rule, whose predicate gives the answer.
+# Files without any matching element, or that fail to parse before one is
+# seen, are rejected.
+class XmlSniffer():
+
+    def __init__(self, *rules, **kwargs):
+        self.rules = [(path.split('/'), predicate) for path, predicate in rules]
+        self.chunkSize = kwargs.get('chunkSize', 4096)
+
+    def localName(self, tag):
+        return tag.rsplit('}', 1)[-1]
+
+    def match(self, path):
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        stack = []
+        try:
+            with open(path, 'rb') as f:
+                chunk = f.read(self.chunkSize)
+                while chunk:
+                    parser.feed(chunk)
+                    for event, element in parser.read_events():
+                        if event == 'start':
+                            stack.append(self.localName(element.tag))
+                            continue
+                        for rulePath, predicate in self.rules:
+                            if stack[1:] == rulePath:
+                                return bool(predicate(element.text or ''))
+                        stack.pop()
+                        element.clear()
+                    chunk = f.read(self.chunkSize)
+        except ET.ParseError as e:
+            print("Exception while parsing {0}\n{1}".format(path, e))
+        return False
+
+
+superViewSniffer = XmlSniffer(
+    ('SatelliteID', lambda text: text.startswith('SV1')),
+    ('Dataset_Sources/Scene_Source/MISSION', lambda text: 'SUPERVIEW' in text))
+
+
+# geodataXform of the RPC model, as JSON
+def rpcGeodataXform(coeff):
+    return json.dumps({
+        'GeodataTransforms': [
+            {
+                'geodataTransform': 'RPC',
+                'geodataTransformArguments': {
+                    'coeff': coeff
+                }
+            }
+        ]
+    })
+
+
+# The RPC model of a scene, read from the .rpb next to its metadata. The
+# file is tokenized in one pass into name = value pairs, a value being a
+# scalar or a parenthesized list, and checked for the ten offsets and scales
+# and the four 20 term polynomials. The 90 coefficients are kept in the order
+# the RPC geodataXform takes them, and the geodataXform is serialized once.
+class RpcModel():
+
+    tokens = re.compile(
+        r'(\w+)[ \t]*=[ \t]*(?:\(([^)]*)\)|([^;\r\n]*?))[ \t]*(?:;|$)', re.M)
+    scalars = ['lineOffset', 'sampOffset', 'latOffset', 'longOffset',
+               'heightOffset', 'lineScale', 'sampScale', 'latScale',
+               'longScale', 'heightScale']
+    polynomials = ['lineNumCoef', 'lineDenCoef', 'sampNumCoef', 'sampDenCoef']
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'r') as f:
+            text = f.read()
+        values = {}
+        for match in self.tokens.finditer(text):
+            name, terms, value = match.groups()
+            values.setdefault(name, terms.split(',') if terms is not None else value)
+
+        self.coeff = []
+        for name in self.scalars:
+            value = values.get(name)
+            if not isinstance(value, str):
+                raise ValueError('{0} is missing'.format(name))
+            self.coeff.append(float(value))
+        for name in self.polynomials:
+            terms = values.get(name)
+            if not isinstance(terms, list) or len(terms) != 20:
+                raise ValueError('{0} does not have 20 terms'.format(name))
+            self.coeff.extend(float(term) for term in terms)
+        if not all(math.isfinite(value) for value in self.coeff):
+            raise ValueError('coefficients are not finite')
+
+        self.heightOffset = values['heightOffset']
+        self.geodataXform = rpcGeodataXform(self.coeff)
+
+
+# RPC models by path and mtime, a scene's products and repeated builds share
+# the parsed model
+rpcCache = ElementTreeCache(maxBytes=4 * 1024 * 1024, parse=RpcModel)
+
+
+def getRpcModel(path):
+    try:
+        return rpcCache.get(path)
+    except (IOError, OSError):
+        return None
+    except ValueError as e:
+        print("Exception while reading {0}\n{1}".format(path, e))
+        return None
+
+
+# Directory walker for recursive crawls. Directories are listed with
+# os.scandir, whose entries tell files from directories without a stat per
+# entry, and the subdirectories fan out over a small thread pool (crawler
+# property crawlThreads, 1 lists one directory at a time) so that several
+# listings are in flight at once on network shares. Matching files are
+# yielded as each listing comes back, which with more than one thread is in
+# no fixed order across directories. As with os.walk, unreadable
+# directories are skipped and links to directories are not followed.
+class DirectoryWalker():
+
+    def __init__(self):
+        self.threads = 8
+
+    def configure(self, properties):
+        threads = properties.get('crawlThreads')
+        if threads:
+            self.threads = max(int(threads), 1)
+
+    # the names of the files and of the subdirectories of a directory
+    def scan(self, path):
+        files = []
+        dirs = []
+        try:
+            for entry in os.scandir(path):
+                try:
+                    isDir = entry.is_dir()
+                except OSError:
+                    isDir = False
+                if not isDir:
+                    files.append(entry.name)
+                elif not entry.is_symlink():
+                    dirs.append(entry.name)
+        except OSError:
+            pass
+        return path, files, dirs
+
+    # Paths of the files below top whose name passes match. prune, when
+    # given, is called with the subdirectory names of each directory and
+    # whether a file matched in it, and returns the ones to walk into.
+    def walk(self, top, match, prune=None):
+        # python 2 has no scandir
+        if not hasattr(os, 'scandir'):
+            for root, dirs, files in os.walk(top):
+                found = [file for file in files if match(file)]
+                if prune is not None:
+                    dirs[:] = prune(dirs, bool(found))
+                for file in found:
+                    yield os.path.join(root, file)
+            return
+
+        if self.threads == 1 or ThreadPoolExecutor is None:
+            pending = [top]
+            while pending:
+                path, files, dirs = self.scan(pending.pop())
+                found = [file for file in files if match(file)]
+                if prune is not None:
+                    dirs = prune(dirs, bool(found))
+                pending.extend(os.path.join(path, name) for name in reversed(dirs))
+                for file in found:
+                    yield os.path.join(path, file)
+            return
+
+        pending = deque([top])
+        running = set()
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            while pending or running:
+                while pending and len(running) < self.threads * 2:
+                    running.add(executor.submit(self.scan, pending.popleft()))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, files, dirs = future.result()
+                    found = [file for file in files if match(file)]
+                    if prune is not None:
+                        dirs = prune(dirs, bool(found))
+                    pending.extend(os.path.join(path, name) for name in dirs)
+                    for file in found:
+                        yield os.path.join(path, file)
+        finally:
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+directoryWalker = DirectoryWalker()
+
+
+# Layout of the products this raster type crawls, used to prune recursive
+# crawls. The metadata file of a scene sits next to its images, so
+# once a directory holds one nothing below it is walked.
+# The crawler property pruneProducts=false walks every directory.
+class ProductLayout():
+
+    def __init__(self, dataDirs=()):
+        self.dataDirs = set(name.lower() for name in dataDirs)
+        self.enabled = True
+
+    def configure(self, properties):
+        enabled = properties.get('pruneProducts')
+        if enabled is not None and not isinstance(enabled, bool):
+            enabled = str(enabled).lower() not in ('false', '0', 'no')
+        if enabled is not None:
+            self.enabled = enabled
+
+    # the subdirectories to walk into, none below a product's metadata file
+    def prune(self, dirs, found):
+        if found:
+            return []
+        return [name for name in dirs if name.lower() not in self.dataDirs]
+
+    def pruner(self):
+        return self.prune if self.enabled else None
+
+
+productLayout = ProductLayout()
+
+
+# Opt-in record of the scenes already ingested, enabled with the crawler
+# property crawlState=<sqlite file>. The builder records the path, size,
+# mtime and a sha1 of the content of every local file it builds, and later
+# crawls only pass on the files that are new or have changed since: another
+# size, or another mtime unless the hash shows the content is the same (a
+# copied or touched file). Files that failed to build are not recorded and
+# are tried again, urls are always passed on. With crawlDeletions=<file>, a
+# crawl that runs to the end also appends the recorded files below its
+# directories that are gone to that file, one path per line, and forgets
+# them.
+class CrawlState():
+
+    def __init__(self):
+        self.path = None
+        self.connection = None
+        self.deletionsPath = None
+        self.lock = threading.Lock()
+        self.passed = 0
+        self.skipped = 0
+        self.deleted = 0
+
+    def configure(self, properties):
+        self.deletionsPath = properties.get('crawlDeletions') or None
+        path = properties.get('crawlState')
+        if path and path != self.path:
+            self.open(path)
+
+    def open(self, path):
+        connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS scenes (key TEXT PRIMARY KEY, '
+            'path TEXT, size INTEGER, mtime REAL, hash TEXT, seen REAL)')
+        connection.commit()
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+            self.connection = connection
+            self.path = path
+
+    def key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def isLocal(self, path):
+        return '://' not in path
+
+    def contentHash(self, path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # whether the file was built before and has not changed since
+    def unchanged(self, path):
+        key = self.key(path)
+        stat = os.stat(path)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT size, mtime, hash FROM scenes WHERE key = ?',
+                (key,)).fetchone()
+        if row is None or row[0] != stat.st_size:
+            return False
+        if row[1] == stat.st_mtime:
+            return True
+        if self.contentHash(path) != row[2]:
+            return False
+        with self.lock:
+            self.connection.execute(
+                'UPDATE scenes SET mtime = ? WHERE key = ?', (stat.st_mtime, key))
+            self.connection.commit()
+        return True
+
+    def built(self, path):
+        if self.connection is None or not path or not self.isLocal(path):
+            return
+        try:
+            stat = os.stat(path)
+            digest = self.contentHash(path)
+        except (IOError, OSError):
+            return
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO scenes VALUES (?, ?, ?, ?, ?, ?)',
+                (self.key(path), path, stat.st_size, stat.st_mtime, digest,
+                 time.time()))
+            self.connection.commit()
+
+    # the crawler's paths without the unchanged files, roots are the paths
+    # the crawl was given
+    def wrap(self, paths, roots):
+        if self.connection is None:
+            return paths
+        return self.skipUnchanged(paths, roots)
+
+    def skipUnchanged(self, paths, roots):
+        run = time.time()
+        seen = []
+        for path in paths:
+            if self.isLocal(path):
+                if self.deletionsPath is not None:
+                    seen.append((run, self.key(path)))
+                    if len(seen) >= 1000:
+                        self.markSeen(seen)
+                        seen = []
+                try:
+                    unchanged = self.unchanged(path)
+                except (IOError, OSError):
+                    unchanged = False
+                if unchanged:
+                    self.skipped += 1
+                    continue
+            self.passed += 1
+            yield path
+        self.markSeen(seen)
+        if self.deletionsPath is not None:
+            self.reportDeletions(run, roots)
+
+    def markSeen(self, seen):
+        if not seen:
+            return
+        with self.lock:
+            self.connection.executemany(
+                'UPDATE scenes SET seen = ? WHERE key = ?', seen)
+            self.connection.commit()
+
+    # recorded files below the crawled directories that this crawl did not
+    # come across and that no longer exist
+    def reportDeletions(self, run, roots):
+        prefixes = [self.key(root).rstrip(os.sep) + os.sep
+                    for root in roots if os.path.isdir(root)]
+        if not prefixes:
+            return
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT key, path FROM scenes WHERE seen IS NULL OR seen < ?',
+                (run,)).fetchall()
+        deleted = [(key, path) for key, path in rows
+                   if any(key.startswith(prefix) for prefix in prefixes) and
+                   not os.path.exists(path)]
+        if not deleted:
+            return
+        with open(self.deletionsPath, 'a') as f:
+            for key, path in deleted:
+                f.write(path + '\n')
+        with self.lock:
+            self.connection.executemany(
+                'DELETE FROM scenes WHERE key = ?', [(key,) for key, path in deleted])
+            self.connection.commit()
+            self.deleted += len(deleted)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'passed': self.passed,
+                'skipped': self.skipped,
+                'deleted': self.deleted}
+
+
+crawlState = CrawlState()
+
+
+# Watch mode, enabled with the crawler property watch=true. Once the crawl of
+# the paths is done the crawler keeps running and passes on the metadata
+# files delivered below the directories among them, as the crawl of those
+# directories would have found them. A file is passed on once nothing has
+# changed in its directory, or below it, for watchSettle seconds (5 by
+# default), so that a product still being copied is not built half written.
+# The changes are read from inotify on Linux. Elsewhere, on shares whose
+# changes inotify does not see, or with watch=poll, the directories are
+# scanned every watchPoll seconds (10 by default) instead and a file waits
+# a scan longer. watchTimeout=<seconds> ends the crawl after that long
+# without a new file, by default it runs until it is cancelled.
+class FileWatcher():
+
+    def __init__(self):
+        self.mode = None
+        self.settle = 5.0
+        self.poll = 10.0
+        self.timeout = None
+        self.passed = 0
+
+    def configure(self, properties):
+        mode = str(properties.get('watch') or '').lower()
+        if mode in ('', 'false', 'no', '0'):
+            self.mode = None
+        elif mode == 'poll':
+            self.mode = 'poll'
+        else:
+            self.mode = 'auto'
+        self.settle = float(properties.get('watchSettle') or self.settle)
+        self.poll = max(float(properties.get('watchPoll') or self.poll), 0.1)
+        self.timeout = float(properties.get('watchTimeout') or 0) or None
+
+    # the crawler's paths followed by the files delivered later below roots,
+    # match tells the metadata files from the rest by their name and owns,
+    # when given, the ones of this crawler's shard by their path
+    def wrap(self, paths, roots, match, recurse, owns=None):
+        roots = [root for root in roots if os.path.isdir(root)]
+        if self.mode is None or not roots:
+            return paths
+        return self.follow(paths, roots, match, recurse, owns)
+
+    def open(self, roots, recurse):
+        if self.mode == 'auto':
+            try:
+                return InotifySource(roots, recurse)
+            except (OSError, AttributeError) as e:
+                print('Cannot watch with inotify ({}), scanning every {} seconds'.format(
+                    e, self.poll))
+        return PollingSource(roots, recurse, self.poll)
+
+    def signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime)
+
+    def follow(self, paths, roots, match, recurse, owns):
+        # the source is opened first so that no delivery made during the
+        # crawl is missed, the ones the crawl found are not passed on twice
+        source = self.open(roots, recurse)
+        settle = self.settle + source.latency
+        pending = OrderedDict()
+        passed = {}
+        try:
+            for path in paths:
+                passed[path] = self.signature(path)
+                yield path
+
+            last = time.time()
+            while True:
+                now = time.time()
+                timeout = None
+                if pending:
+                    oldest = min(activity for directory, activity in pending.values())
+                    timeout = oldest + settle - now
+                if self.timeout is not None and not pending:
+                    timeout = last + self.timeout - now
+                for directory, name, written in source.events(
+                        None if timeout is None else max(timeout, 0)):
+                    now = time.time()
+                    if written and match(name):
+                        delivered = os.path.join(directory, name)
+                        if owns is None or owns(delivered):
+                            pending[delivered] = [directory, now]
+                    # any change in a product holds back its metadata file
+                    for product in pending.values():
+                        if directory == product[0] or directory.startswith(product[0] + os.sep):
+                            product[1] = now
+
+                now = time.time()
+                for path, (directory, activity) in list(pending.items()):
+                    if now - activity < settle:
+                        continue
+                    del pending[path]
+                    signature = self.signature(path)
+                    if signature is None or passed.get(path) == signature:
+                        continue
+                    passed[path] = signature
+                    last = now
+                    self.passed += 1
+                    yield path
+
+                if self.timeout is not None and not pending and now - last >= self.timeout:
+                    return
+        finally:
+            source.close()
+
+
+# Changes below a set of directories as inotify reports them, Linux only.
+class InotifySource():
+
+    # from sys/inotify.h
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+    EVENTS = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE)
+    WRITES = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    latency = 0.0
+
+    def __init__(self, roots, recurse):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.roots = roots
+        self.recurse = recurse
+        self.watches = {}
+        try:
+            for root in roots:
+                self.add(root)
+        except OSError:
+            self.close()
+            raise
+
+    # watches path, and the directories below it when recursing, and returns
+    # the files found in them
+    def add(self, path):
+        found = []
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.EVENTS)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise OSError(error, 'out of inotify watches, see fs.inotify.max_user_watches')
+                continue
+            # a directory moved within the tree keeps its watch
+            self.watches[wd] = directory
+            directory, files, dirs = directoryWalker.scan(directory)
+            found.extend((directory, name) for name in files)
+            if self.recurse:
+                pending.extend(os.path.join(directory, name) for name in dirs)
+        return found
+
+    # (directory, name, written) of the changes, waiting up to timeout
+    # seconds for the first, or for good when timeout is None
+    def events(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b'\0'))
+            offset += 16 + length
+            if mask & self.IN_Q_OVERFLOW:
+                # events were lost, everything is looked at again
+                for root in self.roots:
+                    events.extend((directory, file, True) for directory, file in self.add(root))
+                continue
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & self.IN_ISDIR:
+                # a product moved in whole raises no event for its files
+                if self.recurse and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    try:
+                        found = self.add(os.path.join(directory, name))
+                    except OSError as e:
+                        print('Cannot watch {}: {}'.format(os.path.join(directory, name), e))
+                        found = []
+                    events.extend((path, file, True) for path, file in found)
+                events.append((directory, name, False))
+            else:
+                events.append((directory, name, bool(mask & self.WRITES)))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+# Changes below a set of directories found by comparing scans made every
+# interval seconds.
+class PollingSource():
+
+    def __init__(self, roots, recurse, interval):
+        self.roots = roots
+        self.recurse = recurse
+        self.interval = interval
+        self.latency = interval
+        self.files = self.scan()
+        self.due = time.time() + interval
+
+    # size and mtime of every file below the roots
+    def scan(self):
+        files = {}
+        for root in self.roots:
+            if self.recurse:
+                paths = directoryWalker.walk(root, lambda file: True)
+            else:
+                directory, names, dirs = directoryWalker.scan(root)
+                paths = [os.path.join(directory, name) for name in names]
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_size, stat.st_mtime)
+        return files
+
+    def events(self, timeout):
+        wait = self.due - time.time()
+        if timeout is not None and timeout < wait:
+            time.sleep(timeout)
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        files = self.scan()
+        self.due = time.time() + self.interval
+        events = []
+        for path, signature in files.items():
+            if self.files.get(path) != signature:
+                events.append((os.path.dirname(path), os.path.basename(path), True))
+        for path in self.files:
+            if path not in files:
+                events.append((os.path.dirname(path), os.path.basename(path), False))
+        self.files = files
+        return events
+
+    def close(self):
+        pass
+
+
+fileWatcher = FileWatcher()
+
+
+# Splits a crawl between processes or hosts, enabled with the crawler property
+# shard=k/N: the crawler passes on only the paths of the k-th of N shards, k
+# from 1 to N. A path goes to the shard picked by a stable hash of where it
+# is below the crawled directory it was found in, or of the url or csv entry
+# as written, so that N crawlers of the same paths each get a disjoint part
+# of them without talking to each other, even with the archive mounted at
+# another place on each host. Separators are hashed as '/' for the same
+# reason.
+class CrawlShard():
+
+    def __init__(self):
+        self.index = 0
+        self.count = 1
+
+    def configure(self, properties):
+        shard = properties.get('shard')
+        if not shard:
+            self.index = 0
+            self.count = 1
+            return
+        try:
+            index, count = [int(part) for part in str(shard).split('/')]
+        except ValueError:
+            raise ValueError('shard must be given as k/N, not {}'.format(shard))
+        if count < 1 or index < 1 or index > count:
+            raise ValueError('shard {} is not one of 1/{} to {}/{}'.format(
+                shard, count, count, count))
+        self.index = index - 1
+        self.count = count
+
+    # the crawled directories, as the prefixes of the paths found in them
+    def prefixes(self, roots):
+        prefixes = [os.path.abspath(root).rstrip(os.sep) + os.sep
+                    for root in roots if os.path.isdir(root)]
+        return sorted(prefixes, key=len, reverse=True)
+
+    def key(self, path, prefixes):
+        if '://' not in path:
+            absolute = os.path.abspath(path)
+            for prefix in prefixes:
+                if absolute.startswith(prefix):
+                    path = absolute[len(prefix):]
+                    break
+        return path.replace('\\', '/')
+
+    # whether path belongs to this shard, scene maps the key of a path to the
+    # one of the scene it is part of, when several files make up a scene
+    def owns(self, path, prefixes, scene=None):
+        if self.count == 1:
+            return True
+        key = self.key(path, prefixes)
+        if scene is not None:
+            key = scene(key)
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % self.count == self.index
+
+    # a function telling whether a path found below roots belongs to this
+    # shard, None when the crawl is not split
+    def owner(self, roots, scene=None):
+        if self.count == 1:
+            return None
+        prefixes = self.prefixes(roots)
+        return lambda path: self.owns(path, prefixes, scene)
+
+    def wrap(self, paths, roots, scene=None):
+        owns = self.owner(roots, scene)
+        if owns is None:
+            return paths
+        return (path for path in paths if owns(path))
+
+
+crawlShard = CrawlShard()